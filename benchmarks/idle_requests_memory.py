@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Memory benchmark of many concurrent idle requests
+
+Starts a server in a child process with a ``schema.validate``-decorated
+handler that waits until released (like a long poll), opens
+``--requests`` connections to it, and prints the growth of the resident
+memory of the server per idle request, along with the size of the
+``__dict__`` of an idle handler, which per-request state of
+``BaseHandler`` (body, query, deadline, ...) only adds entries to once it
+is set. Linux only (reads ``/proc``); raise ``ulimit -n`` for more than
+about 1000 requests.
+
+    python benchmarks/idle_requests_memory.py [--requests 1000]
+"""
+# ---- The following so benchmark can be run without having to install package ----#
+import sys
+sys.path.append(".")
+# ---- Can be removed if Tornado-JSON is installed ----#
+
+import json
+import socket
+import argparse
+import multiprocessing
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.httputil import HTTPServerRequest
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream
+
+from tornado_json import schema
+from tornado_json.application import Application
+from tornado_json.requesthandlers import APIHandler
+
+
+class IdleHandler(APIHandler):
+
+    waiting = 0
+    release = None
+
+    @schema.validate(output_schema={"type": "string"})
+    @gen.coroutine
+    def get(self):
+        IdleHandler.waiting += 1
+        yield IdleHandler.release
+        raise gen.Return("released")
+
+
+class StatsHandler(APIHandler):
+
+    @schema.validate(output_schema={"type": "integer"})
+    def get(self):
+        return IdleHandler.waiting
+
+
+class _Connection(object):
+    """Enough of a connection to create handlers outside of a server"""
+
+    def set_close_callback(self, callback):
+        pass
+
+
+def get_handler_size():
+    """Bytes of the ``__dict__`` of an ``IdleHandler`` once it waits"""
+    handler = IdleHandler(
+        Application(routes=[], settings={}),
+        HTTPServerRequest("GET", "/api/idle", connection=_Connection()))
+    # As set by ``schema.validate``
+    handler.body = None
+    return sys.getsizeof(handler.__dict__)
+
+
+def serve(port, ready):
+    IdleHandler.release = Future()
+    application = Application(routes=[("/api/idle", IdleHandler),
+                                      ("/api/stats", StatsHandler)],
+                              settings={})
+    application.listen(port, "127.0.0.1")
+    ready.set()
+    IOLoop.current().start()
+
+
+def get_rss(pid):
+    """Resident memory of process ``pid`` in bytes"""
+    with open("/proc/{}/status".format(pid)) as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+
+
+@gen.coroutine
+def get_waiting(port):
+    stream = IOStream(socket.socket())
+    yield stream.connect(("127.0.0.1", port))
+    yield stream.write(b"GET /api/stats HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+                       b"Connection: close\r\n\r\n")
+    response = yield stream.read_until_close()
+    raise gen.Return(json.loads(response.split(b"\r\n\r\n", 1)[1])["data"])
+
+
+@gen.coroutine
+def open_idle_requests(port, n):
+    streams = []
+    for _ in range(n):
+        stream = IOStream(socket.socket())
+        yield stream.connect(("127.0.0.1", port))
+        yield stream.write(b"GET /api/idle HTTP/1.1\r\n"
+                           b"Host: 127.0.0.1\r\n\r\n")
+        streams.append(stream)
+    while (yield get_waiting(port)) < n:
+        yield gen.sleep(0.05)
+    raise gen.Return(streams)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=8898)
+    args = parser.parse_args()
+
+    spawn = multiprocessing.get_context("spawn")
+    ready = spawn.Event()
+    server = spawn.Process(target=serve, args=(args.port, ready))
+    server.start()
+    ready.wait()
+    try:
+        # Warm up, so that one-off allocations are not counted
+        IOLoop.current().run_sync(lambda: get_waiting(args.port))
+        before = get_rss(server.pid)
+        streams = IOLoop.current().run_sync(
+            lambda: open_idle_requests(args.port, args.requests))
+        after = get_rss(server.pid)
+        for stream in streams:
+            stream.close()
+    finally:
+        server.terminate()
+        server.join()
+
+    print("idle requests:            {}".format(args.requests))
+    print("server RSS growth:        {:.1f} MB".format(
+        (after - before) / 2 ** 20))
+    print("per idle request:         {:.0f} bytes".format(
+        (after - before) / args.requests))
+    print("idle handler __dict__:    {} bytes".format(get_handler_size()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Load-generation benchmark of the server presets in
+``application.SERVER_PROFILES`` against the ``cars`` demo API
+
+For each profile, the demo is started in a child process and hit by
+``--connections`` keep-alive HTTP/1.1 connections, each sending
+``--requests`` requests with up to ``--pipeline`` of them in flight
+(pipelined) at a time. Throughput and latency percentiles are printed.
+The small requests of the demo should perform about the same with every
+profile; ``high_throughput`` only differs from ``default`` in accepting
+gzipped request bodies, and the limits of ``low_latency`` are not reached.
+
+    python benchmarks/server_presets.py [--connections 50] [--requests 200]
+                                        [--pipeline 1]
+"""
+# ---- The following so benchmark can be run without having to install package ----#
+import sys
+sys.path.append(".")
+sys.path.append("demos/rest_api")
+# ---- Can be removed if Tornado-JSON is installed ----#
+
+import time
+import socket
+import argparse
+import multiprocessing
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream
+
+from tornado_json.routes import get_routes
+from tornado_json.application import Application, SERVER_PROFILES
+
+PATHS = [
+    b"/api/cars/",
+    b"/api/cars/Ford/",
+    b"/api/cars/Ford/Fusion/",
+    b"/api/cars/Ford/Fusion/2014/",
+]
+
+
+def serve(port, profile, ready):
+    import cars
+    application = Application(routes=get_routes(cars), settings={})
+    application.listen(port, "127.0.0.1", profile=profile)
+    ready.set()
+    IOLoop.current().start()
+
+
+@gen.coroutine
+def read_response(stream):
+    headers = yield stream.read_until(b"\r\n\r\n")
+    length = 0
+    for line in headers.split(b"\r\n"):
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":", 1)[1])
+    yield stream.read_bytes(length)
+
+
+@gen.coroutine
+def run_connection(port, requests, pipeline, latencies):
+    stream = IOStream(socket.socket())
+    yield stream.connect(("127.0.0.1", port))
+    sent = received = 0
+    sent_at = []
+    while received < requests:
+        # Keep up to ``pipeline`` requests in flight
+        while sent < requests and sent - received < pipeline:
+            path = PATHS[sent % len(PATHS)]
+            sent_at.append(time.time())
+            stream.write(b"GET " + path + b" HTTP/1.1\r\n"
+                         b"Host: 127.0.0.1\r\n\r\n")
+            sent += 1
+        yield read_response(stream)
+        latencies.append(time.time() - sent_at[received])
+        received += 1
+    stream.close()
+
+
+def percentile(values, p):
+    return sorted(values)[min(len(values) - 1, int(len(values) * p))]
+
+
+def bench(profile, port, args):
+    # A forked server would share the IOLoop of this process
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    server = context.Process(target=serve, args=(port, profile, ready))
+    server.start()
+    ready.wait()
+    try:
+        latencies = []
+        start = time.time()
+        IOLoop.current().run_sync(lambda: gen.multi([
+            run_connection(port, args.requests, args.pipeline, latencies)
+            for _ in range(args.connections)
+        ]))
+        elapsed = time.time() - start
+    finally:
+        server.terminate()
+        server.join()
+    return (
+        len(latencies) / elapsed,
+        percentile(latencies, 0.5) * 1e3,
+        percentile(latencies, 0.99) * 1e3,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--pipeline", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8899)
+    args = parser.parse_args()
+
+    print("{:<16} {:>10} {:>10} {:>10}".format(
+        "profile", "req/s", "p50 (ms)", "p99 (ms)"))
+    for i, profile in enumerate(sorted(SERVER_PROFILES)):
+        print("{:<16} {:>10.0f} {:>10.2f} {:>10.2f}".format(
+            profile, *bench(profile, args.port + i, args)))
+
+
+if __name__ == '__main__':
+    main()
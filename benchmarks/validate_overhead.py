@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Micro-benchmark of the per-call overhead of ``schema.validate``
+
+Calls decorated methods of a fake handler directly (no HTTP) for each
+kind of method, with and without ``specialize``, and prints the time
+per call.
+
+    python benchmarks/validate_overhead.py [--number N]
+"""
+# ---- The following so benchmark can be run without having to install package ----#
+import sys
+sys.path.append(".")
+# ---- Can be removed if Tornado-JSON is installed ----#
+
+import timeit
+import argparse
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from tornado_json import schema
+from tornado_json.gen import coroutine
+
+
+class FakeHandler(object):
+
+    class Request(object):
+        body = b'{"name": "Fred"}'
+        headers = {}
+
+    request = Request()
+
+    def success(self, data):
+        pass
+
+
+def make_handler(specialize):
+    input_schema = {
+        "type": "object",
+        "properties": {"name": {"type": "string"}},
+    }
+    validate = schema.validate(input_schema=input_schema,
+                               output_schema={"type": "string"},
+                               specialize=specialize)
+
+    class Handler(FakeHandler):
+
+        @validate
+        def sync(self):
+            return self.body["name"]
+
+        @validate
+        @coroutine
+        def tornado_coroutine(self):
+            raise gen.Return(self.body["name"])
+
+        @validate
+        async def native_coroutine(self):
+            return self.body["name"]
+
+    return Handler()
+
+
+def bench(handler, method_name, number):
+    """Average time per call of ``handler.method_name``, in seconds"""
+    method = getattr(handler, method_name)
+
+    @gen.coroutine
+    def run():
+        for _ in range(number):
+            result = method()
+            # Specialized synchronous methods return None
+            if result is not None:
+                yield result
+
+    return timeit.timeit(
+        lambda: IOLoop.current().run_sync(run), number=1) / number
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    print("{:<20} {:>14} {:>14}".format(
+        "method", "coroutine (us)", "specialize (us)"))
+    default, specialized = make_handler(False), make_handler(True)
+    for method_name in ("sync", "tornado_coroutine"):
+        print("{:<20} {:>14.2f} {:>14.2f}".format(
+            method_name,
+            bench(default, method_name, args.number) * 1e6,
+            bench(specialized, method_name, args.number) * 1e6,
+        ))
+    # Native coroutines are only awaited in specialize mode
+    print("{:<20} {:>14} {:>14.2f}".format(
+        "native_coroutine", "n/a",
+        bench(specialized, "native_coroutine", args.number) * 1e6,
+    ))
+
+
+if __name__ == '__main__':
+    main()
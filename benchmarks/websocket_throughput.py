@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Throughput benchmark of ``WebSocketAPIHandler``
+
+Sends ``--messages`` validated messages over one WebSocket, keeping up to
+``--window`` of them outstanding, to handlers that take ``--latency``
+seconds (e.g., a database call) per message, with several
+``max_in_flight``; and, for comparison, the same calls as HTTP requests
+to an ``APIHandler`` over one keep-alive connection. Prints messages per
+second.
+
+    python benchmarks/websocket_throughput.py [--messages 2000]
+                                              [--window 64] [--latency 0.001]
+"""
+# ---- The following so benchmark can be run without having to install package ----#
+import sys
+sys.path.append(".")
+# ---- Can be removed if Tornado-JSON is installed ----#
+
+import json
+import time
+import argparse
+import multiprocessing
+
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient
+from tornado.ioloop import IOLoop
+from tornado.websocket import websocket_connect
+
+from tornado_json import schema
+from tornado_json.application import Application
+from tornado_json.requesthandlers import APIHandler
+from tornado_json.websocket import WebSocketAPIHandler
+
+IN_FLIGHT = (1, 16, 64)
+INPUT_SCHEMA = {
+    "type": "object",
+    "properties": {"make": {"type": "string"}, "year": {"type": "integer"}},
+    "required": ["make", "year"],
+}
+OUTPUT_SCHEMA = {"type": "string"}
+LATENCY = 0
+
+
+@gen.coroutine
+def lookup(body):
+    yield gen.sleep(LATENCY)
+    raise gen.Return("{make} {year}".format(**body))
+
+
+class CarsSocket(WebSocketAPIHandler):
+
+    @schema.validate(input_schema=INPUT_SCHEMA, output_schema=OUTPUT_SCHEMA)
+    def handle_lookup(self):
+        return lookup(self.body)
+
+
+class CarsHandler(APIHandler):
+
+    @schema.validate(input_schema=INPUT_SCHEMA, output_schema=OUTPUT_SCHEMA)
+    def post(self):
+        return lookup(self.body)
+
+
+def serve(port, latency, ready):
+    global LATENCY
+    LATENCY = latency
+    routes = [("/api/cars", CarsHandler)]
+    for n in IN_FLIGHT:
+        routes.append(("/ws/{}".format(n),
+                       type("CarsSocket{}".format(n), (CarsSocket,),
+                            {"max_in_flight": n})))
+    Application(routes=routes, settings={}).listen(port, "127.0.0.1")
+    ready.set()
+    IOLoop.current().start()
+
+
+def make_body(i):
+    return {"make": "Ford", "year": 2000 + i % 20}
+
+
+@gen.coroutine
+def bench_websocket(url, messages, window):
+    conn = yield websocket_connect(url)
+    sent = received = 0
+    while received < messages:
+        while sent < messages and sent - received < window:
+            conn.write_message(json.dumps(
+                {"type": "lookup", "id": sent, "data": make_body(sent)}))
+            sent += 1
+        reply = json.loads((yield conn.read_message()))
+        assert reply["status"] == "success", reply
+        received += 1
+    conn.close()
+
+
+@gen.coroutine
+def bench_http(url, messages):
+    client = AsyncHTTPClient(force_instance=True, max_clients=1)
+    for i in range(messages):
+        response = yield client.fetch(url, method="POST",
+                                      body=json.dumps(make_body(i)))
+        assert json.loads(response.body)["status"] == "success"
+    client.close()
+
+
+def timed(coroutine):
+    start = time.time()
+    IOLoop.current().run_sync(coroutine)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--window", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.001)
+    parser.add_argument("--port", type=int, default=8897)
+    args = parser.parse_args()
+
+    spawn = multiprocessing.get_context("spawn")
+    ready = spawn.Event()
+    server = spawn.Process(target=serve,
+                           args=(args.port, args.latency, ready))
+    server.start()
+    ready.wait()
+    try:
+        print("{:<28} {:>10}".format("transport", "msgs/s"))
+        elapsed = timed(lambda: bench_http(
+            "http://127.0.0.1:{}/api/cars".format(args.port), args.messages))
+        print("{:<28} {:>10.0f}".format("http keep-alive",
+                                        args.messages / elapsed))
+        for n in IN_FLIGHT:
+            elapsed = timed(lambda: bench_websocket(
+                "ws://127.0.0.1:{}/ws/{}".format(args.port, n),
+                args.messages, args.window))
+            print("{:<28} {:>10.0f}".format(
+                "websocket max_in_flight={}".format(n),
+                args.messages / elapsed))
+    finally:
+        server.terminate()
+        server.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -64,7 +64,7 @@ class CarsAPIHandler(APIHandler):
 class MakeListHandler(CarsAPIHandler):
 
     def get(self):
-        self.success(DATA.keys())
+        self.success(list(DATA.keys()))
 
 
 class MakeHandler(CarsAPIHandler):
@@ -1,21 +1,51 @@
+import os
 import sys
+import gzip
 import json
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
 
-from tornado.testing import AsyncHTTPTestCase
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.websocket import WebSocketClientConnection, websocket_connect
 
 from .utils import handle_import_error
 
 try:
     sys.path.append('.')
     from tornado_json import routes
+    from tornado_json import build
     from tornado_json import schema
     from tornado_json import application
+    from tornado_json import concurrency
+    from tornado_json import ratelimit
+    from tornado_json import pubsub
+    from tornado_json import websocket
+    from tornado_json import pagination
+    from tornado_json import utils
+    from tornado_json import bulk
+    from tornado_json import exceptions
+    from tornado_json import datasets
+    from tornado_json import cache
     from tornado_json import requesthandlers
+    from tornado_json.gen import coroutine, moment
+    from tornado_json.constants import TORNADO_MAJOR
+    from tornado_json.registry import register_schema
     sys.path.append('demos/helloworld')
     import helloworld
+    from . import typed_handlers
 except ImportError as err:
     handle_import_error(err)
 
+try:
+    from tornado_json import tasks
+except ImportError:
+    # For tornado<4.2, which has no tornado.queues
+    tasks = None
+
 
 def jd(obj):
     return json.dumps(obj)
@@ -95,16 +125,116 @@ class NotFoundHandler(requesthandlers.APIHandler):
         return {}
 
 
+class LazyHandler(requesthandlers.APIHandler):
+
+    @schema.validate(
+        input_schema={
+            "type": "object",
+            "properties": {
+                "name": {"type": "string"},
+                "tags": {"type": "array", "items": {"type": "string"}},
+            },
+            "required": ["name"]
+        },
+        output_schema={"type": "string"},
+        lazy=True
+    )
+    def post(self):
+        """Reads ``tags`` only if asked to"""
+        if self.get_argument("tags", None):
+            return "{} {}".format(self.body["name"], len(self.body["tags"]))
+        return self.body["name"]
+
+
+POINT_REF = register_schema("func_test.point", {
+    "type": "object",
+    "properties": {
+        "x": {"type": "number"},
+        "y": {"type": "number"},
+    },
+    "required": ["x", "y"]
+})
+
+
+class RefHandler(requesthandlers.APIHandler):
+
+    @schema.validate(
+        input_schema={"type": "array", "items": POINT_REF},
+        output_schema=POINT_REF
+    )
+    def post(self):
+        """Sums up points"""
+        return {
+            "x": sum(p["x"] for p in self.body),
+            "y": sum(p["y"] for p in self.body)
+        }
+
+
+class SpecializedHandler(requesthandlers.APIHandler):
+
+    @schema.validate(output_schema={"type": "string"}, specialize=True)
+    def get(self, kind):
+        """Synchronous"""
+        return kind
+
+    @schema.validate(
+        input_schema={"type": "string"},
+        output_schema={"type": "string"},
+        specialize=True
+    )
+    @coroutine
+    def post(self, kind):
+        """tornado_json.gen.coroutine"""
+        yield moment()
+        if kind == "explode":
+            raise ValueError("Boom")
+        raise gen.Return(self.body if kind == "echo" else 1)
+
+
+if sys.version_info >= (3, 5):
+    # Native coroutines would be a SyntaxError in older versions
+    exec("""
+class NativeHandler(requesthandlers.APIHandler):
+
+    @schema.validate(output_schema={"type": "string"}, specialize=True)
+    async def get(self, name):
+        await gen.moment
+        return "Hello (native) world! My name is {}.".format(name)
+""")
+
+
+class VersionedHandler(requesthandlers.APIHandler):
+
+    version = 1
+    calls = 0
+
+    @schema.validate(
+        output_schema={"type": "number"},
+        etag=lambda self: self.version
+    )
+    def get(self):
+        """Counts calls"""
+        VersionedHandler.calls += 1
+        return self.version
+
+
 class APIFunctionalTest(AsyncHTTPTestCase):
 
     def get_app(self):
         rts = routes.get_routes(helloworld)
+        rts += routes.get_module_routes("tests.typed_handlers")
         rts += [
             ("/api/explodinghandler", ExplodingHandler),
             ("/api/notfoundhandler", NotFoundHandler),
             ("/views/someview", DummyView),
-            ("/api/dbtest", DBTestHandler)
+            ("/api/dbtest", DBTestHandler),
+            ("/api/lazy", LazyHandler),
+            ("/api/ref", RefHandler),
+            ("/api/versioned", VersionedHandler),
+            (r"/api/specialized/(?P<kind>\w+)", SpecializedHandler)
         ]
+        if sys.version_info >= (3, 5):
+            rts.append((r"/api/native/(?P<name>\w+)", NativeHandler))
         return application.Application(
             routes=rts,
             settings={"debug": True},
@@ -201,6 +331,89 @@ class APIFunctionalTest(AsyncHTTPTestCase):
             "error"
         )
 
+    def test_lazy_validation(self):
+        body = jd({"name": "lazy", "tags": [1, 2]})
+        # Invalid ``tags`` is never read, so it is never validated
+        r = self.fetch("/api/lazy", method="POST", body=body)
+        self.assertEqual(r.code, 200)
+        self.assertEqual(jl(r.body)["data"], "lazy")
+        # ... until it is
+        r = self.fetch("/api/lazy?tags=1", method="POST", body=body)
+        self.assertEqual(r.code, 400)
+        self.assertEqual(jl(r.body)["status"], "fail")
+        # Top-level ``required`` is still checked eagerly
+        r = self.fetch("/api/lazy", method="POST", body=jd({"tags": []}))
+        self.assertEqual(r.code, 400)
+        self.assertEqual(jl(r.body)["status"], "fail")
+
+    def test_registered_schema_ref(self):
+        r = self.fetch("/api/ref", method="POST",
+                       body=jd([{"x": 1, "y": 2}, {"x": 3, "y": 4}]))
+        self.assertEqual(r.code, 200)
+        self.assertEqual(jl(r.body)["data"], {"x": 4, "y": 6})
+        r = self.fetch("/api/ref", method="POST", body=jd([{"x": 1}]))
+        self.assertEqual(r.code, 400)
+        self.assertEqual(jl(r.body)["status"], "fail")
+
+    def test_specialized_wrappers(self):
+        r = self.fetch("/api/specialized/sync")
+        self.assertEqual(r.code, 200)
+        self.assertEqual(jl(r.body)["data"], "sync")
+        r = self.fetch("/api/specialized/echo", method="POST",
+                       body=jd("coroutine"))
+        self.assertEqual(r.code, 200)
+        self.assertEqual(jl(r.body)["data"], "coroutine")
+        # Invalid input and output, and exceptions, are handled as usual
+        r = self.fetch("/api/specialized/echo", method="POST", body=jd(1))
+        self.assertEqual(r.code, 400)
+        r = self.fetch("/api/specialized/number", method="POST",
+                       body=jd("coroutine"))
+        self.assertEqual(r.code, 500)
+        r = self.fetch("/api/specialized/explode", method="POST",
+                       body=jd("coroutine"))
+        self.assertEqual(r.code, 500)
+        self.assertEqual(jl(r.body)["status"], "error")
+
+    @unittest.skipIf(not hasattr(gen, "convert_yielded"),
+                     "native coroutines need tornado>=4.3")
+    def test_native_coroutine(self):
+        if sys.version_info < (3, 5):
+            return
+        r = self.fetch("/api/native/name")
+        self.assertEqual(r.code, 200)
+        self.assertEqual(
+            jl(r.body)["data"],
+            "Hello (native) world! My name is name."
+        )
+
+    def test_typed_route_args(self):
+        r = self.fetch("/typed_handlers/typed/Ford/2014/0.5")
+        self.assertEqual(r.code, 200)
+        self.assertEqual(jl(r.body)["data"], 2014.5)
+        r = self.fetch("/typed_handlers/typed/Ford/new/0.5")
+        self.assertEqual(r.code, 404)
+
+    def test_reload_routes(self):
+        self._app.reload_routes([("/api/reloaded", DBTestHandler)])
+        r = self.fetch("/api/reloaded")
+        self.assertEqual(r.code, 200)
+        r = self.fetch("/api/helloworld")
+        self.assertEqual(r.code, 404)
+
+    def test_conditional_get(self):
+        r = self.fetch("/api/versioned")
+        self.assertEqual(r.code, 200)
+        self.assertEqual(r.headers["Etag"], '"1"')
+        calls = VersionedHandler.calls
+        # The method is not called if the client has the current version
+        r = self.fetch("/api/versioned",
+                       headers={"If-None-Match": 'W/"0", "1"'})
+        self.assertEqual(r.code, 304)
+        self.assertEqual(VersionedHandler.calls, calls)
+        r = self.fetch("/api/versioned", headers={"If-None-Match": '"0"'})
+        self.assertEqual(r.code, 200)
+        self.assertEqual(VersionedHandler.calls, calls + 1)
+
     def test_view_db_conn(self):
         r = self.fetch(
             "/views/someview",
@@ -225,3 +438,865 @@ class APIFunctionalTest(AsyncHTTPTestCase):
         self.assertTrue(
             "Nothing to see here." in jl(r.body)["data"]
         )
+
+
+class SizedHandler(requesthandlers.APIHandler):
+
+    @schema.validate(output_schema={"type": "string"})
+    def get(self, size):
+        """Returns ``size`` bytes of data"""
+        return "x" * int(size)
+
+
+@unittest.skipIf(TORNADO_MAJOR < 4, "decompress_response needs tornado>=4.0")
+class CompressionTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.policy = application.CompressionPolicy(
+            min_length=100,
+            levels=[("/api/uncompressed/", 0)],
+            encodings=("gzip",),
+            cacheable=["/api/sized/"]
+        )
+        return application.Application(
+            routes=[(r"/api/(?:sized|uncompressed)/(?P<size>\d+)",
+                     SizedHandler)],
+            settings={},
+            compression=self.policy
+        )
+
+    def fetch_gzipped(self, path):
+        return self.fetch(path, headers={"Accept-Encoding": "gzip"},
+                          decompress_response=False)
+
+    def test_min_length(self):
+        r = self.fetch_gzipped("/api/sized/10")
+        self.assertNotIn("Content-Encoding", r.headers)
+        self.assertEqual(jl(r.body)["data"], "x" * 10)
+        r = self.fetch_gzipped("/api/sized/1000")
+        self.assertEqual(r.headers["Content-Encoding"], "gzip")
+        body = gzip.GzipFile(fileobj=BytesIO(r.body)).read()
+        self.assertEqual(jl(body)["data"], "x" * 1000)
+
+    def test_route_level(self):
+        r = self.fetch_gzipped("/api/uncompressed/1000")
+        self.assertNotIn("Content-Encoding", r.headers)
+
+    def test_cache(self):
+        first = self.fetch_gzipped("/api/sized/2000")
+        self.assertEqual(len(self.policy._cache), 1)
+        second = self.fetch_gzipped("/api/sized/2000")
+        self.assertEqual(first.body, second.body)
+        self.assertEqual(len(self.policy._cache), 1)
+
+
+class GatedHandler(requesthandlers.APIHandler):
+
+    __max_concurrency__ = 1
+
+    @schema.validate(output_schema={"type": "string"})
+    @gen.coroutine
+    def get(self):
+        """Waits for ``gate`` once ``entered`` is set"""
+        if not self.entered.done():
+            self.entered.set_result(None)
+        yield self.gate
+        raise gen.Return("done")
+
+
+class QueuedHandler(GatedHandler):
+
+    __max_concurrency__ = concurrency.ConcurrencyLimit(1, max_queue=1,
+                                                       queue_timeout=None)
+
+
+class ConcurrencyTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        GatedHandler.entered = Future()
+        GatedHandler.gate = Future()
+        return application.Application(
+            routes=[("/api/gated", GatedHandler),
+                    ("/api/queued", QueuedHandler)],
+            settings={"retry_after": 3}
+        )
+
+    def start_first(self, path):
+        first = self.http_client.fetch(self.get_url(path))
+        self.io_loop.add_future(GatedHandler.entered, self.stop)
+        self.wait()
+        return first
+
+    def test_shed(self):
+        first = self.start_first("/api/gated")
+        self.http_client.fetch(self.get_url("/api/gated"), self.stop)
+        r = self.wait()
+        self.assertEqual(r.code, 503)
+        self.assertEqual(r.headers["Retry-After"], "3")
+        self.assertEqual(jl(r.body)["status"], "error")
+        stats = self.get_app_stats()
+        self.assertEqual((stats["active"], stats["shed"]), (1, 1))
+
+        GatedHandler.gate.set_result(None)
+        self.io_loop.add_future(first, self.stop)
+        self.assertEqual(self.wait().result().code, 200)
+        self.assertEqual(self.get_app_stats()["active"], 0)
+
+    def test_queue(self):
+        first = self.start_first("/api/queued")
+        self.http_client.fetch(self.get_url("/api/queued"), self.stop)
+        # Let the second request reach the queue
+        self.io_loop.add_timeout(self.io_loop.time() + 0.05, self.stop)
+        self.wait()
+        stats = self.get_app_stats("QueuedHandler")
+        self.assertEqual((stats["active"], stats["queued"]), (1, 1))
+
+        GatedHandler.gate.set_result(None)
+        self.assertEqual(self.wait().code, 200)
+        self.io_loop.add_future(first, self.stop)
+        self.assertEqual(self.wait().result().code, 200)
+
+    def get_app_stats(self, name="GatedHandler"):
+        stats = self._app.concurrency.get_stats()
+        return stats["routes"]["tests.func_test." + name]
+
+
+class RateLimitedHandler(requesthandlers.APIHandler):
+
+    __rate_limit__ = ratelimit.RateLimit(
+        ratelimit.TokenBucket(0.5, burst=1),
+        key=ratelimit.by_header("X-Api-Key")
+    )
+
+    @schema.validate(input_schema={"type": "object"})
+    def post(self):
+        """Echoes the body"""
+        return self.body
+
+
+class RateLimitTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        return application.Application(
+            routes=[("/api/ratelimited", RateLimitedHandler)],
+            settings={}
+        )
+
+    def post(self, body, key):
+        return self.fetch("/api/ratelimited", method="POST", body=body,
+                          headers={"X-Api-Key": key})
+
+    def test_rate_limit(self):
+        self.assertEqual(self.post(jd({}), "a").code, 200)
+        # Rejected before the (invalid) body is decoded
+        r = self.post("not json", "a")
+        self.assertEqual(r.code, 429)
+        self.assertEqual(r.headers["Retry-After"], "2")
+        self.assertEqual(jl(r.body)["status"], "fail")
+        # Other keys have their own bucket
+        self.assertEqual(self.post(jd({}), "b").code, 200)
+
+
+class DeadlineHandler(requesthandlers.APIHandler):
+
+    @schema.validate(output_schema={"type": "number"}, timeout=0.05)
+    @gen.coroutine
+    def get(self, wait):
+        """Returns the remaining time, after waiting forever if ``wait``"""
+        if wait == "forever":
+            yield Future()
+        raise gen.Return(self.get_remaining_time())
+
+
+@unittest.skipIf(TORNADO_MAJOR < 4, "gen.with_timeout needs tornado>=4.0")
+class DeadlineTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        return application.Application(
+            routes=[(r"/api/deadline/(?P<wait>\w+)", DeadlineHandler)],
+            settings={}
+        )
+
+    def test_timeout(self):
+        r = self.fetch("/api/deadline/forever")
+        self.assertEqual(r.code, 504)
+        self.assertEqual(jl(r.body)["status"], "error")
+        self.assertEqual(
+            self._app.metrics.get_stats(), {"deadline_exceeded": 1})
+
+    def test_header(self):
+        r = self.fetch("/api/deadline/no")
+        self.assertTrue(0 < jl(r.body)["data"] <= 0.05)
+        # The header can only shorten the deadline
+        r = self.fetch("/api/deadline/no",
+                       headers={"X-Request-Deadline": "0.01"})
+        self.assertTrue(0 < jl(r.body)["data"] <= 0.01)
+        r = self.fetch("/api/deadline/no",
+                       headers={"X-Request-Deadline": "10"})
+        self.assertTrue(0.01 < jl(r.body)["data"] <= 0.05)
+        r = self.fetch("/api/deadline/no",
+                       headers={"X-Request-Deadline": "0"})
+        self.assertEqual(r.code, 504)
+        r = self.fetch("/api/deadline/no",
+                       headers={"X-Request-Deadline": "soon"})
+        self.assertEqual(r.code, 400)
+
+
+class EventsHandler(requesthandlers.EventStreamHandler):
+
+    @schema.validate(output_schema={"type": "string"})
+    def get(self, make):
+        """Streams events of ``make``"""
+        return self.stream_events(make)
+
+
+class EventStreamTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        EventsHandler.pubsub = pubsub.PubSub(history=10)
+        return application.Application(
+            routes=[(r"/api/events/(?P<make>\w+)", EventsHandler)],
+            settings={}
+        )
+
+    def open_stream(self, path, headers=None):
+        """Open a stream of ``path`` and wait for its headers"""
+        self.body = b""
+        self.until = None
+
+        def on_chunk(chunk):
+            self.body += chunk
+            if self.until is not None and self.until(self.body):
+                self.until = None
+                self.stop()
+
+        def on_header(line):
+            if line == "\r\n":
+                self.stop()
+
+        self.http_client.fetch(self.get_url(path), headers=headers,
+                               streaming_callback=on_chunk,
+                               header_callback=on_header)
+        self.wait()
+
+    def read_until(self, until):
+        """Wait until ``until(body received so far)``"""
+        if not until(self.body):
+            self.until = until
+            self.wait()
+        return self.body
+
+    def test_sse(self):
+        self.open_stream("/api/events/ford", {"Accept": "text/event-stream"})
+        EventsHandler.pubsub.publish("ford", "Fusion")
+        # Does not match the output_schema, so is skipped
+        EventsHandler.pubsub.publish("ford", 1)
+        EventsHandler.pubsub.publish("chevrolet", "Camaro")
+        EventsHandler.pubsub.publish("ford", "Mustang")
+        body = self.read_until(lambda body: b"Mustang" in body)
+        self.assertEqual(body.decode("utf-8"), (
+            'id: 1\ndata: {"status": "success", "data": "Fusion"}\n\n'
+            'id: 3\ndata: {"status": "success", "data": "Mustang"}\n\n'
+        ))
+
+    def test_chunked_resume(self):
+        for model in ("Fusion", "Focus", "Mustang"):
+            EventsHandler.pubsub.publish("ford", model)
+        self.open_stream("/api/events/ford?last_event_id=1")
+        body = self.read_until(lambda body: body.count(b"\n") == 2)
+        self.assertEqual(
+            [jl(line)["data"] for line in body.splitlines()],
+            ["Focus", "Mustang"]
+        )
+
+
+class ChatHandler(websocket.WebSocketAPIHandler):
+
+    gate = None
+
+    @schema.validate(input_schema={"type": "string"},
+                     output_schema={"type": "string"})
+    def handle_echo(self):
+        """Echoes the message"""
+        return self.body
+
+    @schema.validate(output_schema={"type": "string"})
+    @gen.coroutine
+    def handle_wait(self):
+        """Replies once ``gate`` is set"""
+        yield self.gate
+        raise gen.Return("waited")
+
+
+class WebSocketTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        ChatHandler.gate = Future()
+        return application.Application(routes=[("/ws", ChatHandler)],
+                                       settings={})
+
+    @unittest.skipIf(not hasattr(WebSocketClientConnection, "close"),
+                     "WebSocketClientConnection.close needs tornado>=3.2")
+    @gen_test
+    def test_messages(self):
+        conn = yield websocket_connect(
+            self.get_url("/ws").replace("http", "ws"))
+        conn.write_message(jd({"type": "wait", "id": 1}))
+        conn.write_message(jd({"type": "echo", "id": 2, "data": "Hi"}))
+        conn.write_message(jd({"type": "echo", "id": 3, "data": 1}))
+        conn.write_message(jd({"type": "nope", "id": 4}))
+        conn.write_message("[")
+        # Messages are handled concurrently, so the first is answered last
+        replies = []
+        for _ in range(4):
+            replies.append(json.loads((yield conn.read_message())))
+        self.assertEqual(replies[0],
+                         {"status": "success", "data": "Hi", "id": 2})
+        self.assertEqual([(r["status"], r.get("id")) for r in replies[1:]],
+                         [("fail", 3), ("fail", 4), ("fail", None)])
+        ChatHandler.gate.set_result(None)
+        reply = json.loads((yield conn.read_message()))
+        self.assertEqual(reply, {"status": "success", "data": "waited",
+                                 "id": 1})
+        conn.close()
+
+
+CARS = ["Car {}".format(i) for i in range(5)]
+
+
+class PagedHandler(requesthandlers.APIHandler):
+
+    @schema.validate(
+        output_schema={"type": "array", "items": {"type": "string"}},
+        paginate=pagination.Pagination(default_limit=2, max_limit=3)
+    )
+    def get(self, limit, offset):
+        """Returns a page of cars"""
+        return CARS[offset:offset + limit]
+
+
+class CursorHandler(requesthandlers.APIHandler):
+
+    @schema.validate(
+        output_schema={"type": "array", "items": {"type": "string"}},
+        paginate=pagination.Pagination(default_limit=2, cursor=True)
+    )
+    def get(self, make, limit, cursor):
+        """Returns a page of cars, with the index of the next as cursor"""
+        start = int(cursor or 0)
+        end = start + limit
+        return ([make + " " + car for car in CARS[start:end]],
+                str(end) if end < len(CARS) else None)
+
+
+class PaginationTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        return application.Application(
+            routes=[("/api/paged", PagedHandler),
+                    (r"/api/cursor/(?P<make>\w+)/", CursorHandler)],
+            settings={}
+        )
+
+    def get_pages(self, url):
+        pages = []
+        while url is not None:
+            data = jl(self.fetch(url).body)["data"]
+            pages.append(data["items"])
+            url = data["next"]
+        return pages
+
+    def test_offset(self):
+        self.assertEqual(self.get_pages("/api/paged?sort=1"),
+                         [CARS[:2], CARS[2:4], CARS[4:]])
+        self.assertEqual(
+            jl(self.fetch("/api/paged?sort=1&limit=10").body)["data"],
+            {"items": CARS[:3], "next": "/api/paged?sort=1&limit=3&offset=3"}
+        )
+        self.assertEqual(self.fetch("/api/paged?offset=-1").code, 400)
+
+    def test_cursor(self):
+        # Page arguments are not taken for URL arguments
+        self.assertEqual(utils.get_route_args(vars(CursorHandler)["get"]),
+                         [("make", None)])
+        pages = self.get_pages("/api/cursor/Ford/?limit=3")
+        self.assertEqual(pages, [["Ford " + c for c in CARS[:3]],
+                                 ["Ford " + c for c in CARS[3:]]])
+
+
+class ProjectedHandler(requesthandlers.APIHandler):
+
+    @schema.validate(
+        output_schema={
+            "type": "object",
+            "properties": {"make": {"type": "string"},
+                           "models": {"type": "array",
+                                      "items": {"type": "object"}}},
+            "required": ["make", "models"]
+        },
+        fields=True
+    )
+    def get(self):
+        """Returns a make and its models"""
+        return {"make": "Ford", "models": [{"name": "Fusion", "year": 2014},
+                                          {"name": "Focus", "year": 2015}]}
+
+
+class ProjectionTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        return application.Application(
+            routes=[("/api/projected", ProjectedHandler)], settings={})
+
+    def test_fields(self):
+        r = self.fetch("/api/projected?fields=models.name")
+        self.assertEqual(jl(r.body)["data"],
+                         {"models": [{"name": "Fusion"}, {"name": "Focus"}]})
+        r = self.fetch("/api/projected")
+        self.assertEqual(len(jl(r.body)["data"]), 2)
+        self.assertEqual(self.fetch("/api/projected?fields=,").code, 400)
+
+
+class BulkHandler(requesthandlers.APIHandler):
+
+    batches = []
+
+    @schema.validate(
+        input_schema={"type": "object",
+                      "properties": {"make": {"type": "string"}},
+                      "required": ["make"]},
+        output_schema={"type": "integer"},
+        input_example={"make": "Ford"},
+        output_example=1,
+        bulk=bulk.Bulk(batch_size=2, chunk_size=2)
+    )
+    def post(self):
+        """Imports cars in batches"""
+        if any(item["make"] == "Nope" for item in self.body):
+            raise exceptions.APIError(400, "Batch rejected.")
+        BulkHandler.batches.append([item["make"] for item in self.body])
+        return [len(item["make"]) for item in self.body]
+
+
+class BulkTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        BulkHandler.batches = []
+        return application.Application(
+            routes=[("/api/bulk", BulkHandler)], settings={})
+
+    def test_array(self):
+        r = self.fetch("/api/bulk", method="POST", body=jd(
+            [{"make": "Ford"}, {}, {"make": "Kia"}, {"make": "Audi"}]))
+        data = jl(r.body)["data"]
+        self.assertEqual((data["succeeded"], data["failed"]), (3, 1))
+        self.assertEqual([res["status"] for res in data["results"]],
+                         ["success", "fail", "success", "success"])
+        self.assertEqual(data["results"][2]["data"], 3)
+        self.assertEqual(BulkHandler.batches, [["Ford", "Kia"], ["Audi"]])
+        r = self.fetch("/api/bulk", method="POST", body=jd({}))
+        self.assertEqual(r.code, 400)
+
+    def test_ndjson(self):
+        body = "\n".join([jd({"make": "Nope"}), "{", jd({"make": "Kia"}),
+                          jd({"make": "VW"}), ""])
+        r = self.fetch("/api/bulk", method="POST", body=body,
+                       headers={"Content-Type": "application/x-ndjson"})
+        results = jl(r.body)["data"]["results"]
+        self.assertEqual(
+            [(res["status"], res["data"]) for res in results],
+            [("fail", "Batch rejected."),
+             ("fail", "Input is malformed; could not decode JSON object."),
+             ("fail", "Batch rejected."), ("success", 2)]
+        )
+
+
+if hasattr(requesthandlers, "NDJSONHandler"):
+    class NDJSONEchoHandler(requesthandlers.NDJSONHandler):
+
+        @schema.validate(
+            input_schema={"type": "object", "required": ["make"]},
+            output_schema={"type": "string"},
+            ndjson=True
+        )
+        def post(self):
+            return (car["make"].upper() for car in self.body)
+else:
+    # For tornado 3.x.x, which cannot stream request bodies
+    NDJSONEchoHandler = None
+
+
+class NDJSONBufferedHandler(requesthandlers.APIHandler):
+
+    @schema.validate(input_schema={"type": "integer"},
+                     output_schema={"type": "integer"}, ndjson=True)
+    def post(self):
+        return [n * 2 for n in self.body]
+
+
+class NDJSONTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        rts = [("/api/buffered", NDJSONBufferedHandler)]
+        if NDJSONEchoHandler is not None:
+            rts.append(("/api/echo", NDJSONEchoHandler))
+        return application.Application(routes=rts, settings={})
+
+    @unittest.skipIf(NDJSONEchoHandler is None,
+                     "stream_request_body needs tornado>=4.0")
+    def test_streamed(self):
+        chunks = [b'{"make": "Fo', b'rd"}\n\n{"make"', b': "Kia"}']
+
+        @gen.coroutine
+        def body_producer(write):
+            for chunk in chunks:
+                yield write(chunk)
+
+        self.http_client.fetch(self.get_url("/api/echo"), self.stop,
+                               method="POST", body_producer=body_producer)
+        r = self.wait()
+        self.assertEqual(r.headers["Content-Type"], "application/x-ndjson")
+        self.assertEqual(r.body, b'"FORD"\n"KIA"\n')
+
+        r = self.fetch("/api/echo", method="POST",
+                       body=b'{"make": "Kia"}\n{}\n')
+        self.assertEqual(r.code, 400)
+        self.assertIn("Line 2", jl(r.body)["data"])
+
+    def test_buffered(self):
+        r = self.fetch("/api/buffered", method="POST", body=b"1\n2\n3")
+        self.assertEqual(r.body, b"2\n4\n6\n")
+        r = self.fetch("/api/buffered", method="POST", body=b"1\n[")
+        self.assertEqual(r.code, 400)
+
+
+class AllErrorsHandler(requesthandlers.APIHandler):
+
+    @schema.validate(
+        input_schema={
+            "type": "object",
+            "properties": {"make": {"type": "string"},
+                           "year": {"type": "integer"}},
+            "required": ["make", "year"]
+        },
+        all_errors=True
+    )
+    def post(self):
+        return self.body["make"]
+
+
+class AllErrorsTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        return application.Application(
+            routes=[("/api/car", AllErrorsHandler)], settings={})
+
+    def test_all_errors(self):
+        r = self.fetch("/api/car", method="POST",
+                       body=jd({"make": 1, "year": "x"}))
+        self.assertEqual(r.code, 400)
+        data = jl(r.body)["data"]
+        self.assertEqual(sorted(data["errors"]), ["/make", "/year"])
+        self.assertIn("is not of type", data["errors"]["/year"][0])
+        self.assertFalse(data["truncated"])
+        r = self.fetch("/api/car", method="POST",
+                       body=jd({"make": "Ford", "year": 1999}))
+        self.assertEqual(jl(r.body)["data"], "Ford")
+
+
+class CoercedHandler(requesthandlers.APIHandler):
+
+    @schema.validate(
+        input_schema={
+            "type": "object",
+            "properties": {
+                "sold": {"type": "string", "format": "date-time"},
+                "color": {"type": "string", "default": "black"}
+            }
+        },
+        coerce=True
+    )
+    def post(self):
+        return [self.body["sold"].hour, self.body["color"]]
+
+
+class CoercionTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        return application.Application(
+            routes=[("/api/sale", CoercedHandler)], settings={})
+
+    def test_coerce(self):
+        r = self.fetch("/api/sale", method="POST",
+                       body=jd({"sold": "2017-01-02T03:04:05-02:00"}))
+        self.assertEqual(jl(r.body)["data"], [5, "black"])
+        r = self.fetch("/api/sale", method="POST",
+                       body=jd({"sold": "yesterday"}))
+        self.assertEqual(r.code, 400)
+
+
+class SearchHandler(requesthandlers.APIHandler):
+
+    @schema.validate(
+        query_schema={
+            "type": "object",
+            "properties": {
+                "year": {"type": "integer", "minimum": 1900},
+                "used": {"type": "boolean", "default": False},
+                "color": {"type": "array", "items": {"type": "string"}}
+            },
+            "additionalProperties": False
+        },
+        path_schema={
+            "type": "object",
+            "properties": {"page": {"type": "integer", "minimum": 1}}
+        }
+    )
+    def get(self, page):
+        return [page, self.query]
+
+
+class PagedSearchHandler(requesthandlers.APIHandler):
+
+    @schema.validate(
+        output_schema={"type": "array", "items": {
+            "type": "object", "properties": {"name": {"type": "string"}}}},
+        query_schema={
+            "type": "object",
+            "properties": {"make": {"type": "string"}},
+            "additionalProperties": False
+        },
+        paginate=pagination.Pagination(default_limit=2),
+        fields=True
+    )
+    def get(self, limit, offset):
+        return [{"name": self.query["make"] + " " + car, "year": 2000}
+                for car in CARS[offset:offset + limit]]
+
+
+class ArgsSchemaTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        return application.Application(
+            routes=[(r"/api/search/(?P<page>[^/]+)/?$", SearchHandler),
+                    ("/api/pagedsearch", PagedSearchHandler)],
+            settings={})
+
+    def test_own_args(self):
+        """Tests that arguments of paginate and fields are not validated
+        against query_schema"""
+        url = "/api/pagedsearch?make=Ford&fields=name"
+        names = []
+        while url is not None:
+            r = self.fetch(url)
+            self.assertEqual(r.code, 200, url)
+            data = jl(r.body)["data"]
+            names.extend(item["name"] for item in data["items"])
+            url = data["next"]
+        self.assertEqual(names, ["Ford " + car for car in CARS])
+
+    def test_args(self):
+        r = self.fetch("/api/search/2?year=1999&color=red&color=blue")
+        self.assertEqual(jl(r.body)["data"], [2, {
+            "year": 1999, "used": False, "color": ["red", "blue"]}])
+        for url in ("/api/search/0", "/api/search/x",
+                    "/api/search/1?year=1800", "/api/search/1?year=new",
+                    "/api/search/1?make=Ford"):
+            r = self.fetch(url)
+            self.assertEqual(r.code, 400, url)
+
+
+class DatasetHandler(requesthandlers.APIHandler):
+
+    @schema.validate(output_schema={"type": "object"})
+    def get(self, make):
+        return datasets.get_dataset("func_test_cars").get_raw(make)
+
+
+class DatasetTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        return application.Application(
+            routes=[(r"/api/cars/(?P<make>\w+)", DatasetHandler)],
+            settings={})
+
+    def test_raw(self):
+        with tempfile.NamedTemporaryFile(suffix=".jsonl") as f:
+            f.write(b'{"make": "Ford", "year": 1999}\n')
+            f.flush()
+            datasets.register_dataset("func_test_cars", f.name, key="make")
+            r = self.fetch("/api/cars/Ford")
+        self.assertEqual(r.headers["Content-Type"], "application/json")
+        self.assertEqual(jl(r.body), {"status": "success", "data": {
+            "make": "Ford", "year": 1999}})
+
+
+class CachedHandler(requesthandlers.APIHandler):
+
+    lookups = []
+
+    @coroutine
+    def load(self, make):
+        CachedHandler.lookups.append(make)
+        yield moment()
+        raise gen.Return(make.upper())
+
+    @schema.validate(output_schema={"type": "string"})
+    @gen.coroutine
+    def get(self, make):
+        # Hits are yielded, too
+        car = yield self.cache.get("cars", make, self.load)
+        raise gen.Return(car)
+
+    @schema.validate()
+    def delete(self, make):
+        self.cache.invalidate("cars", make)
+
+
+class CacheTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        CachedHandler.lookups = []
+        self.channel_dir = tempfile.mkdtemp()
+        self.cache = cache.ReadThroughCache(
+            channel=cache.InvalidationChannel(self.channel_dir, "a"))
+        self.cache.channel.start()
+        return application.Application(
+            routes=[(r"/api/cars/(?P<make>\w+)", CachedHandler)],
+            settings={}, cache=self.cache)
+
+    def tearDown(self):
+        self.cache.channel.close()
+        shutil.rmtree(self.channel_dir, ignore_errors=True)
+        super(CacheTest, self).tearDown()
+
+    def test_read_through(self):
+        for _ in range(2):
+            r = self.fetch("/api/cars/ford")
+            self.assertEqual(jl(r.body)["data"], "FORD")
+        self.assertEqual(CachedHandler.lookups, ["ford"])
+        self.fetch("/api/cars/ford", method="DELETE")
+        self.fetch("/api/cars/ford")
+        self.assertEqual(CachedHandler.lookups, ["ford", "ford"])
+        metrics = self._app.metrics
+        self.assertEqual((metrics.get("cache_hits"),
+                          metrics.get("cache_misses")), (1, 2))
+        self.assertEqual(self.cache.get_stats()["cars"]["size"], 1)
+
+    def test_channel(self):
+        """Tests invalidations from another worker"""
+        other = cache.ReadThroughCache(
+            channel=cache.InvalidationChannel(self.channel_dir, "b"))
+        other.channel.start()
+        try:
+            self.fetch("/api/cars/kia")
+            self.cache.add_listener(lambda *args: self.stop(args))
+            other.invalidate("cars", "kia")
+            self.assertEqual(self.wait(), ("cars", "kia"))
+            self.assertEqual(len(self.cache.get_namespace("cars")), 0)
+        finally:
+            other.channel.close()
+
+
+class AuditedHandler(requesthandlers.APIHandler):
+
+    @schema.validate(output_schema={"type": "string"})
+    def put(self, make):
+        self.tasks.check()
+        AuditedHandler.saved.append(make)
+        self.tasks.enqueue(self.audit, make)
+        return make
+
+    @staticmethod
+    @gen.coroutine
+    def audit(make):
+        yield gen.moment
+        AuditedHandler.attempts.append(make)
+        if len(AuditedHandler.attempts) < 2:
+            raise RuntimeError("Audit log is down")
+
+
+@unittest.skipIf(tasks is None, "tornado.queues needs tornado>=4.2")
+class TasksTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        AuditedHandler.saved = []
+        AuditedHandler.attempts = []
+        return application.Application(
+            routes=[(r"/api/cars/(?P<make>\w+)", AuditedHandler)],
+            settings={}, tasks=tasks.TaskQueue(max_size=1, retry_delay=0))
+
+    def test_tasks(self):
+        r = self.fetch("/api/cars/ford", method="PUT", body="")
+        self.assertEqual(jl(r.body)["data"], "ford")
+        self._app.shutdown(timeout=5).add_done_callback(self.stop)
+        self.assertTrue(self.wait().result())
+        self.assertEqual(AuditedHandler.attempts, ["ford", "ford"])
+        metrics = self._app.metrics
+        self.assertEqual((metrics.get("tasks_retried"),
+                          metrics.get("tasks_done")), (1, 1))
+        # No more tasks are taken once draining
+        r = self.fetch("/api/cars/kia", method="PUT", body="")
+        self.assertEqual(r.code, 503)
+        # ...and requests are rejected before their side effects
+        self.assertEqual(AuditedHandler.saved, ["ford"])
+
+    @gen_test
+    def test_full(self):
+        queue = tasks.TaskQueue(workers=1, max_size=1)
+        self.assertFalse(queue.full())
+        queue.enqueue(gen.sleep, 0.01)
+        # The first task is not running yet
+        self.assertTrue(queue.full())
+        with self.assertRaises(exceptions.Overloaded):
+            queue.check()
+        with self.assertRaises(exceptions.Overloaded):
+            queue.enqueue(gen.sleep, 0.01)
+        self.assertEqual(queue.get_stats()["queued"], 1)
+        drained = yield queue.drain()
+        self.assertTrue(drained)
+        self.assertTrue(queue.full())
+
+
+class BuildTest(AsyncHTTPTestCase):
+
+    HANDLERS = (
+        "from tornado_json.requesthandlers import APIHandler\n"
+        "\n"
+        "\n"
+        "class TypedHandler(APIHandler):\n"
+        "\n"
+        "    def get(self, year):\n"
+        "        self.success(year + 1)\n"
+        "    get.__annotations__ = {'year': int}\n"
+    )
+
+    def get_app(self):
+        self.tmpdir = tempfile.mkdtemp()
+        package_dir = os.path.join(self.tmpdir, "typedbuild")
+        os.mkdir(package_dir)
+        open(os.path.join(package_dir, "__init__.py"), "w").close()
+        with open(os.path.join(package_dir, "handlers.py"), "w") as f:
+            f.write(self.HANDLERS)
+        sys.path.insert(0, self.tmpdir)
+        build_dir = os.path.join(self.tmpdir, "build")
+        build.build("typedbuild", build_dir)
+        package = sys.modules["typedbuild"]
+        handler = sys.modules["typedbuild.handlers"].TypedHandler
+        # As in a new process, where routes are only loaded
+        del vars(handler)["get"].__route_converters__
+        rts = build.load_routes(package, build_dir)
+        self.assertIsNotNone(rts)
+        return application.Application(routes=rts, settings={})
+
+    def tearDown(self):
+        sys.path.remove(self.tmpdir)
+        for modname in ("typedbuild", "typedbuild.handlers"):
+            sys.modules.pop(modname, None)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+        super(BuildTest, self).tearDown()
+
+    def test_typed_route_args(self):
+        r = self.fetch("/handlers/typed/2014")
+        self.assertEqual(r.code, 200)
+        self.assertEqual(jl(r.body)["data"], 2015)
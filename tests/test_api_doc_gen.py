@@ -12,6 +12,8 @@ try:
     from tornado_json.api_doc_gen import get_api_docs
     from tornado_json.api_doc_gen import _get_notes
     from tornado_json.routes import get_routes
+    from tornado_json import schema
+    from tornado_json.requesthandlers import APIHandler
     sys.path.append("demos/helloworld")
     import helloworld
 except ImportError as err:
@@ -58,3 +60,33 @@ def test___get_notes():
         pass
 
     assert test_doc.__doc__ in _get_notes(test_doc)
+
+
+def test__get_api_docs_paginated():
+    class PagedHandler(APIHandler):
+        @schema.validate(output_schema={"type": "array"},
+                         output_example=["Ford"], paginate=True)
+        def get(self, limit, offset):
+            pass
+
+    docs = get_api_docs([("/api/paged", PagedHandler)])
+    assert "**Pagination**" in docs
+    assert '"next": {' in docs
+    assert '"next": null' in docs
+
+
+def test__get_api_docs_args_schemas():
+    class SearchHandler(APIHandler):
+        @schema.validate(
+            query_schema={"type": "object",
+                          "properties": {"year": {"type": "integer"}}},
+            path_schema={"type": "object",
+                         "properties": {"make": {"enum": ["Ford"]}}}
+        )
+        def get(self, make):
+            pass
+
+    docs = get_api_docs([(r"/api/search/(?P<make>\w+)", SearchHandler)])
+    assert docs.index("**Path Schema**") < docs.index("**Query Schema**") \
+        < docs.index("**Input Schema**")
+    assert '"enum": [' in docs
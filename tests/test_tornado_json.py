@@ -1,6 +1,17 @@
+import os
 import sys
+import json
+from datetime import date, datetime
 
 import pytest
+import tornado.gen
+from jsonschema import ValidationError
+try:
+    from tornado.httputil import HTTPServerRequest
+except ImportError:
+    # For tornado 3.x.x
+    from tornado.httpserver import HTTPRequest as HTTPServerRequest
+from tornado.ioloop import IOLoop
 
 from .utils import handle_import_error
 
@@ -10,10 +21,20 @@ try:
     from tornado_json import schema
     from tornado_json import exceptions
     from tornado_json import jsend
+    from tornado_json import registry
+    from tornado_json import build
+    from tornado_json import application
+    from tornado_json import ratelimit
+    from tornado_json import requesthandlers
+    from tornado_json import projection
+    from tornado_json import validation
+    from tornado_json import datasets
+    from tornado_json import cache
     sys.path.append('demos/helloworld')
     sys.path.append('demos/rest_api')
     import helloworld
     import cars
+    from . import typed_handlers
 except ImportError as err:
     handle_import_error(err)
 
@@ -83,6 +104,84 @@ class TestRoutes(TestTornadoJSONBase):
         ])
 
 
+    def test_get_module_routes_typed(self):
+        """Tests routes.get_module_routes with annotated arguments"""
+        assert routes.get_module_routes("tests.typed_handlers") == [
+            ("/typed_handlers/typed/(?P<make>[a-zA-Z0-9_\\-]+)/"
+             "(?P<year>[0-9]+)/(?P<rating>[0-9]+(?:\\.[0-9]+)?)/?$",
+             typed_handlers.TypedHandler)
+        ]
+        assert typed_handlers.TypedHandler.get.__route_converters__ == {
+            "year": int, "rating": float
+        }
+
+
+    def test_route_cache(self, tmpdir):
+        """Tests routes.RouteCache"""
+        tmpdir.join("reloadable").mkdir()
+        package_dir = tmpdir.join("reloadable")
+        package_dir.join("__init__.py").write("")
+        handler = (
+            "from tornado_json.requesthandlers import APIHandler\n"
+            "from tornado_json.registry import register_schema\n"
+            "register_schema(__name__, {{'title': '{0}'}})\n"
+            "class {0}Handler(APIHandler):\n"
+            "    def get(self):\n"
+            "        pass\n"
+        )
+        package_dir.join("a.py").write(handler.format("A"))
+        package_dir.join("b.py").write(handler.format("B"))
+        sys.path.insert(0, str(tmpdir))
+        try:
+            import reloadable
+            cache = routes.RouteCache(reloadable)
+            assert [url for url, rh in cache.get_routes()] == \
+                ["/a/a/?", "/b/b/?"]
+            assert cache.changed == ["reloadable.a", "reloadable.b"]
+
+            # Only changed and new modules are regenerated
+            package_dir.join("b.py").write(handler.format("C"))
+            package_dir.join("b.py").setmtime(
+                package_dir.join("b.py").mtime() + 10)
+            package_dir.join("d.py").write(handler.format("D"))
+            assert [url for url, rh in cache.get_routes()] == \
+                ["/a/a/?", "/b/c/?", "/d/d/?"]
+            assert cache.changed == ["reloadable.b", "reloadable.d"]
+            # Reloaded modules may register their schemas with changes
+            assert registry.default_registry.get("reloadable.b") == \
+                {"title": "C"}
+
+            assert cache.get_routes()
+            assert cache.changed == []
+        finally:
+            sys.path.remove(str(tmpdir))
+
+
+class TestBuild(TestTornadoJSONBase):
+    """Tests the build module"""
+
+    def test_build(self, tmpdir):
+        """Tests routes.get_routes with a build manifest"""
+        build_dir = str(tmpdir)
+        path = build.build("helloworld", build_dir)
+        assert os.path.exists(path)
+        assert sorted(routes.get_routes(helloworld, build_dir)) == \
+            sorted(routes.get_routes(helloworld))
+
+        # An outdated manifest is ignored
+        with open(path) as f:
+            manifest = f.read()
+        with open(path, "w") as f:
+            f.write(manifest.replace(build.get_source_hash(helloworld), "0"))
+        assert build.load_routes(helloworld, build_dir) is None
+        assert sorted(routes.get_routes(helloworld, build_dir)) == \
+            sorted(routes.get_routes(helloworld))
+
+        # As is a missing one
+        assert build.load_routes(helloworld, str(tmpdir.join("none"))) \
+            is None
+
+
 class TestUtils(TestTornadoJSONBase):
     """Tests the utils module"""
 
@@ -154,6 +253,191 @@ class TestUtils(TestTornadoJSONBase):
     #         rh.post()
 
 
+class TestSchemaRegistry(TestTornadoJSONBase):
+    """Tests the registry module"""
+
+    def test_ref_resolution(self):
+        """Tests $ref to registered schemas and local definitions"""
+        reg = registry.SchemaRegistry()
+        ref = reg.register("car", {
+            "type": "object",
+            "properties": {"make": {"$ref": "#/definitions/name"}},
+            "definitions": {"name": {"type": "string"}}
+        })
+        assert ref == {"$ref": "car"}
+        schema = {"type": "array", "items": ref}
+
+        reg.validate([{"make": "Ford"}], schema)
+        with pytest.raises(ValidationError):
+            reg.validate([{"make": 1}], schema)
+        assert reg.get_refs(schema) == ["car"]
+
+    def test_validator_reuse(self):
+        """Tests that equal schemas share a compiled validator"""
+        reg = registry.SchemaRegistry()
+        validator = reg.get_validator({"type": "number"})
+        assert reg.get_validator({"type": "number"}) is validator
+        assert reg.get_validator({"type": "string"}) is not validator
+
+    def test_register_conflict(self):
+        """Tests re-registering an id"""
+        reg = registry.SchemaRegistry()
+        reg.register("id", {"type": "number"})
+        reg.register("id", {"type": "number"})
+        with pytest.raises(ValueError):
+            reg.register("id", {"type": "string"})
+
+    def test_replacing(self):
+        """Tests replacing a schema drops validators referring to it"""
+        reg = registry.SchemaRegistry()
+        schema = {"type": "array", "items": reg.register(
+            "id", {"type": "number"})}
+        reg.validate([1], schema)
+        with reg.replacing():
+            reg.register("id", {"type": "string"})
+        assert reg.get("id") == {"type": "string"}
+        reg.validate(["a"], schema)
+        with pytest.raises(ValidationError):
+            reg.validate([1], schema)
+
+
+class TestApplication(TestTornadoJSONBase):
+    """Tests the application module"""
+
+    def test_get_server_settings(self):
+        """Tests server profiles and overriding their settings"""
+        assert application.get_server_settings() == {}
+        settings = application.get_server_settings("low_latency",
+                                                   xheaders=True,
+                                                   body_timeout=1)
+        assert settings["xheaders"] is True
+        assert settings["body_timeout"] == 1
+        assert settings["max_body_size"] == 1024 * 1024
+        # Profiles are not modified by overrides
+        assert application.SERVER_PROFILES["low_latency"]["body_timeout"] == 5
+        with pytest.raises(ValueError):
+            application.get_server_settings("fastest")
+
+
+class TestRateLimit(TestTornadoJSONBase):
+    """Tests the ratelimit module"""
+
+    def test_token_bucket(self):
+        """Tests bursts and refilling"""
+        bucket = ratelimit.TokenBucket(2, burst=3, max_keys=1)
+        assert [bucket.consume("a", now=0) for _ in range(4)] == [0, 0, 0, 0.5]
+        assert bucket.consume("a", now=0.5) == 0
+        assert bucket.consume("b", now=0.5) == 0
+        # Only the most recently used key is kept
+        assert list(bucket._buckets) == ["b"]
+
+    def test_shared_token_bucket(self, tmpdir):
+        """Tests that buckets are shared through the file"""
+        path = str(tmpdir.join("buckets"))
+        first = ratelimit.SharedTokenBucket(path, 1, burst=2, slots=16)
+        second = ratelimit.SharedTokenBucket(path, 1, burst=2, slots=16)
+        assert first.consume("a", now=0) == 0
+        assert second.consume("a", now=0) == 0
+        assert first.consume("a", now=0) == 1
+        assert second.consume("b", now=0) == 0
+        first.close()
+        second.close()
+
+
+class TestBaseHandler(TestTornadoJSONBase):
+    """Tests requesthandlers.BaseHandler"""
+
+    def test_state(self):
+        """Tests that per-request state is only kept once it is set"""
+        class Connection(object):
+            stream = xheaders = no_keep_alive = None
+
+            def set_close_callback(self, callback):
+                pass
+
+        handler = requesthandlers.BaseHandler(
+            application.Application(routes=[], settings={}),
+            HTTPServerRequest("GET", "/", connection=Connection()))
+        names = ["body", "query", "deadline", "timings",
+                 "concurrency_slots"]
+        assert not set(names) & set(vars(handler))
+        assert handler.body is None and handler.timings is None
+        handler.mark("queued")
+        assert list(handler.timings) == ["queued"]
+
+
+class TestProjection(TestTornadoJSONBase):
+    """Tests the projection module"""
+
+    CAR = {
+        "type": "object",
+        "properties": {
+            "make": {"type": "string"},
+            "engine": {
+                "type": "object",
+                "properties": {"power": {"type": "number"},
+                               "fuel": {"type": "string"}},
+                "required": ["power", "fuel"]
+            }
+        },
+        "required": ["make", "engine"]
+    }
+
+    def test_parse_fields(self):
+        assert projection.parse_fields("a, b.c,b.d.e") == \
+            {"a": True, "b": {"c": True, "d": {"e": True}}}
+        assert projection.parse_fields("b,b.c") == {"b": True}
+        with pytest.raises(exceptions.APIError):
+            projection.parse_fields("a..b")
+
+    def test_projection(self):
+        """Tests pruning and validation against the derived schema"""
+        proj = projection.Projection("engine.power",
+                                     {"type": "array", "items": self.CAR})
+        cars = [{"make": "Ford", "engine": {"power": 100, "fuel": "gas"}}]
+        assert proj(cars) == [{"engine": {"power": 100}}]
+        proj.validator.validate(proj(cars))
+        with pytest.raises(ValidationError):
+            proj.validator.validate([{"engine": {"power": "high"}}])
+
+    def test_projection_not_registered(self):
+        """Tests that validators of projections are not kept in the
+        registry"""
+        validators = len(registry.default_registry._validators)
+        projection.Projection("engine.fuel", self.CAR)
+        assert len(registry.default_registry._validators) == validators
+
+    def test_project_schema_fallback(self):
+        """Tests that schemas that might not hold are not projected"""
+        schema = dict(self.CAR, minProperties=2)
+        assert projection.project_schema(schema, {"make": True}) is None
+        assert projection.Projection("make", schema).validator is None
+
+    def test_project_schema_additional(self):
+        """Tests that fields of additionalProperties or patternProperties
+        are not pruned against their unprojected schemas"""
+        schema = {
+            "type": "object",
+            "properties": {"make": {"type": "string"},
+                           "engine": self.CAR["properties"]["engine"]},
+            "additionalProperties": self.CAR["properties"]["engine"],
+        }
+        assert projection.project_schema(schema, {"extra": True}) == \
+            dict(schema, properties={})
+        assert projection.project_schema(
+            schema, {"extra": {"power": True}}) is None
+        assert projection.project_schema(
+            schema, {"engine": {"power": True}}) is not None
+        schema = {
+            "type": "object",
+            "patternProperties": {"^e": self.CAR["properties"]["engine"]},
+        }
+        assert projection.project_schema(
+            schema, {"engine": {"power": True}}) is None
+        assert projection.project_schema(
+            schema, {"make": {"name": True}}) == schema
+
+
 class TestJSendMixin(TestTornadoJSONBase):
     """Tests the JSendMixin module"""
 
@@ -193,3 +477,218 @@ class TestJSendMixin(TestTornadoJSONBase):
         self.jsend_rh.error(message=message, data=data, code=code)
         assert self.jsend_rh._buffer == {
             'status': 'error', 'message': message, 'data': data, 'code': code}
+
+
+class TestValidation(TestTornadoJSONBase):
+    """Tests the validation module"""
+
+    CARS = {
+        "type": "array",
+        "items": {"type": "object",
+                  "properties": {"year": {"type": "integer"}},
+                  "required": ["make"]}
+    }
+
+    def test_get_pointer(self):
+        assert validation.get_pointer([]) == ""
+        assert validation.get_pointer(["a/b", 0, "c~"]) == "/a~1b/0/c~0"
+
+    def test_collect(self):
+        validator = registry.default_registry.get_validator(self.CARS)
+        cars = [{"make": "Ford", "year": "x"}, {}, {"make": "Kia"}]
+        collector = validation.ErrorCollector()
+        errors, truncated = collector.collect(validator, cars)
+        assert sorted(errors) == ["/0/year", "/1"]
+        assert len(errors["/1"]) == 1
+        assert not truncated
+
+        with pytest.raises(exceptions.InvalidInput) as e:
+            collector.validate(validator, cars)
+        assert e.value.status_code == 400
+        assert e.value.data == {"errors": errors, "truncated": False}
+
+        errors, truncated = validation.ErrorCollector(max_errors=1).collect(
+            validator, cars)
+        assert len(errors) == 1 and truncated
+
+
+    def test_parse_date_time(self):
+        assert validation.parse_date_time("2017-01-02T03:04:05.5+01:30") == \
+            datetime(2017, 1, 2, 1, 34, 5, 500000)
+        assert validation.parse_date_time("2017-01-02T03:04:05Z") == \
+            datetime(2017, 1, 2, 3, 4, 5)
+        with pytest.raises(ValueError):
+            validation.parse_date_time("2017-01-02")
+
+    def test_coercion(self):
+        """Tests that defaults and coercion are applied while validating"""
+        schema = {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "sold": {"type": "string", "format": "date"},
+                    "year": {"type": "integer"},
+                    "tags": {"type": "array", "default": []}
+                }
+            }
+        }
+        coercion = validation.Coercion(types=True)
+        validator = registry.default_registry.get_validator(
+            schema, coerce=coercion)
+        cars = [{"sold": "2017-05-06", "year": "1999"}]
+        validator.validate(cars)
+        assert cars == [{"sold": date(2017, 5, 6), "year": 1999, "tags": []}]
+        assert cars[0]["tags"] is not schema["items"]["properties"]["tags"][
+            "default"]
+
+        with pytest.raises(ValidationError) as e:
+            validator.validate([{"sold": "2017-13-01"}])
+        assert list(e.value.absolute_path) == [0, "sold"]
+
+    def test_coercion_combinators(self):
+        """Tests that failed branches of combinators do not coerce"""
+        schema = {"anyOf": [
+            {"properties": {"t": {"type": "string", "format": "date-time"}},
+             "required": ["x"]},
+            {"properties": {"t": {"type": "string"}}}
+        ]}
+        validator = registry.default_registry.get_validator(
+            schema, coerce=validation.Coercion())
+        instance = {"t": "2020-01-01T00:00:00Z"}
+        validator.validate(instance)
+        assert instance == {"t": "2020-01-01T00:00:00Z"}
+
+        validator = registry.default_registry.get_validator(
+            {"properties": {"cars": schema}}, coerce=validation.Coercion())
+        with pytest.raises(ValidationError) as e:
+            validator.validate({"cars": {"t": 1}})
+        assert list(e.value.absolute_path) == ["cars"]
+
+
+class TestDatasets(TestTornadoJSONBase):
+    """Tests the datasets module"""
+
+    def test_document(self, tmpdir):
+        path = tmpdir.join("cars.json")
+        path.write_binary(
+            u'{"ford" : {"model": "F\u00e9", "year": 1999},\n'
+            u' "k\\u00efa": [1, 2] }'.encode("utf-8"))
+        cars = datasets.Dataset(str(path))
+        assert cars.keys() == [u"ford", u"k\u00efa"]
+        assert cars.get(u"ford") == {"model": u"F\u00e9", "year": 1999}
+        assert cars.get_raw(u"k\u00efa").data == b"[1, 2]"
+        assert json.loads(cars.get_raw_slice().data.decode("utf-8")) == \
+            [{"model": u"F\u00e9", "year": 1999}, [1, 2]]
+
+        path.write_binary(b'[{"make": "Ford"}, {"make": "Kia"}]')
+        cars = datasets.Dataset(str(path), key="make")
+        assert cars.get_raw_slice(1).data == b'[{"make": "Kia"}]'
+        path.write_binary(b'[{"make": "Ford"} {"make": "Kia"}]')
+        with pytest.raises(ValueError):
+            datasets.Dataset(str(path))
+
+    def test_lines(self, tmpdir):
+        path = tmpdir.join("cars.jsonl")
+        path.write_binary(b'{"make": "Ford"}\r\n\n  {"make": "Kia"}')
+        cars = datasets.register_dataset("cars", str(path), key="make",
+                                         schema={"required": ["make"]})
+        assert datasets.get_dataset("cars") is cars
+        assert "Kia" in cars and len(cars) == 2
+        assert cars.get_raw("Kia").data == b'{"make": "Kia"}'
+        path.write_binary(b'{"make": "Ford"}\n{}')
+        with pytest.raises(ValidationError):
+            datasets.Dataset(str(path), key="make",
+                             schema={"required": ["make"]})
+
+
+class TestCache(TestTornadoJSONBase):
+    """Tests the cache module"""
+
+    def test_namespace(self, monkeypatch):
+        now = [100.0]
+        monkeypatch.setattr(cache.time, "time", lambda: now[0])
+        namespace = cache.Namespace(max_size=2, ttl=10)
+        namespace.set("a", 1)
+        namespace.set("b", 2)
+        assert namespace.get("a") == 1
+        namespace.set("c", 3)
+        # "b" was the least recently used
+        assert namespace.get("b") is None
+        now[0] += 10
+        assert namespace.get("a") is None
+        assert namespace.get_stats() == {"size": 1, "max_size": 2, "hits": 1,
+                                         "misses": 2, "evictions": 1}
+
+    def test_read_through(self):
+        lookups = []
+        c = cache.ReadThroughCache({"cars": {"max_size": 1}})
+        load = lambda key: lookups.append(key) or key.upper()
+        assert c.get("cars", "kia", load) == "KIA"
+        assert c.get("cars", "kia", load) == "KIA"
+        c.invalidate("cars")
+        assert c.get("cars", "kia", load) == "KIA"
+        assert lookups == ["kia", "kia"]
+        assert c.get_namespace("cars").max_size == 1
+        assert c.get_namespace("trucks").max_size == 1000
+
+    def test_failed_load(self):
+        """Tests that a failed lookup fails all of its waiters and is not
+        cached"""
+        lookups = []
+        c = cache.ReadThroughCache()
+
+        @tornado.gen.coroutine
+        def load(key):
+            lookups.append(key)
+            raise KeyError(key)
+
+        @tornado.gen.coroutine
+        def get_twice():
+            first = c.get("cars", "kia", load)
+            assert c.get("cars", "kia", load) is first
+            with pytest.raises(KeyError):
+                yield first
+            with pytest.raises(KeyError):
+                yield c.get("cars", "kia", load)
+
+        IOLoop.current().run_sync(get_twice, timeout=5)
+        assert lookups == ["kia", "kia"]
+
+
+class TestLazyBody(TestTornadoJSONBase):
+    """Tests schema.LazyBody"""
+
+    def make_body(self):
+        validator = registry.default_registry.get_validator(
+            {"type": "integer"})
+        return schema.LazyBody({"n": "x", "m": 1}, {"n": validator,
+                                                    "m": validator})
+
+    def test_reads_validate(self):
+        """Tests that every way of reading values validates them"""
+        reads = [
+            dict, lambda b: b.copy(), lambda b: dict(**b),
+            lambda b: b.setdefault("n"), lambda b: b.pop("n"),
+            lambda b: b == {"n": "x", "m": 1}, lambda b: list(b.items()),
+            lambda b: list(b.values()), lambda b: b.get("n"),
+        ]
+        if sys.version_info[0] == 2:
+            reads.extend([lambda b: list(b.iteritems()),
+                          lambda b: list(b.itervalues())])
+        for read in reads:
+            with pytest.raises(ValidationError):
+                read(self.make_body())
+        body = self.make_body()
+        while True:
+            # Popped in any order; "n" raises when it comes up
+            try:
+                body.popitem()
+            except ValidationError:
+                break
+
+    def test_lazy(self):
+        body = self.make_body()
+        assert body["m"] == 1 and "n" in body and len(body) == 2
+        body["n"] = "set by the handler"
+        assert body.copy() == {"n": "set by the handler", "m": 1}
@@ -0,0 +1,15 @@
+"""Handlers with annotated arguments, for testing route generation
+
+Annotations are set after the fact so that this module can be imported
+in Python 2 as well.
+"""
+from tornado_json.requesthandlers import APIHandler
+from tornado_json import schema
+
+
+class TypedHandler(APIHandler):
+
+    def get(self, make, year, rating):
+        return year + rating
+    get.__annotations__ = {"year": int, "rating": float}
+    get = schema.validate(output_schema={"type": "number"})(get)
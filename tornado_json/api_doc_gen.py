@@ -7,10 +7,11 @@ except ImportError:
     pass
 
 import tornado.web
-from jsonschema import validate, ValidationError
+from jsonschema import ValidationError
 
 from tornado_json.utils import is_method
 from tornado_json.constants import HTTP_METHODS
+from tornado_json.registry import default_registry
 from tornado_json.requesthandlers import APIHandler
 
 
@@ -27,7 +28,7 @@ def _validate_example(rh, method, example_type):
         return None
 
     try:
-        validate(example, schema)
+        default_registry.validate(example, schema)
     except ValidationError as e:
         raise ValidationError(
             "{}_example for {}.{} could not be validated.\n{}".format(
@@ -149,10 +150,33 @@ def _get_input_schema_doc(method):
     return _get_schema_doc(method.input_schema, "input")
 
 
+def _get_args_schema_doc(method):
+    """Document the ``path_schema`` and ``query_schema`` of ``method``, if
+    any"""
+    docs = []
+    for type in ("path", "query"):
+        schema = getattr(method, type + "_schema", None)
+        if schema is not None:
+            docs.append(_get_schema_doc(schema, type))
+    return "\n".join(docs)
+
+
 def _get_output_schema_doc(method):
     return _get_schema_doc(method.output_schema, "output")
 
 
+def _get_pagination_doc(method):
+    pagination = getattr(method, "pagination", None)
+    if pagination is None:
+        return ""
+    res = """
+    **Pagination**
+
+    {}
+    """.format(pagination.get_doc())
+    return _cleandoc(res)
+
+
 def _get_notes(method):
     doc = inspect.getdoc(method)
     if doc is None:
@@ -175,9 +199,11 @@ def _get_method_doc(rh, method_name, method):
     {notes}
     """.format(
         method_name=method_name.upper(),
-        input_schema=_get_input_schema_doc(method),
+        input_schema="\n".join(filter(None, [
+            _get_args_schema_doc(method), _get_input_schema_doc(method)])),
         output_schema=_get_output_schema_doc(method),
-        notes=_get_notes(method) or "",
+        notes="\n".join(filter(None, [_get_pagination_doc(method),
+                                      _get_notes(method)])),
         input_example=_get_input_example(rh, method),
         output_example=_get_output_example(rh, method),
     )
@@ -212,6 +238,48 @@ def _get_route_doc(url, rh):
     return _cleandoc(route_doc)
 
 
+def _get_registered_schema_doc(schema_id):
+    res = """
+    # {schema_id}
+
+    ```json
+    {schema}
+    ```
+    """.format(
+        schema_id=_escape_markdown_literals(schema_id),
+        schema=_add_indent(
+            json.dumps(default_registry.get(schema_id), indent=4,
+                       sort_keys=True),
+            4
+        )
+    )
+    return _cleandoc(res)
+
+
+def _get_registered_schemas_doc(rhs):
+    """Document registered schemas referenced (through ``$ref``) by
+    methods of ``rhs``
+
+    :returns: Documentation, or ``None`` if no schemas are referenced
+    """
+    schema_ids = []
+    for rh in rhs:
+        for method_name, method in _get_rh_methods(rh):
+            for schema in (method.input_schema, method.output_schema,
+                           getattr(method, "query_schema", None),
+                           getattr(method, "path_schema", None)):
+                schema_ids.extend(
+                    s for s in default_registry.get_refs(schema)
+                    if s not in schema_ids
+                )
+    if not schema_ids:
+        return None
+    return "\n\n".join(
+        ["**Referenced Schemas**"] +
+        [_get_registered_schema_doc(s) for s in sorted(schema_ids)]
+    )
+
+
 def _write_docs_to_file(documentation):
     # Documentation is written to the root folder
     with open("API_Documentation.md", "w+") as f:
@@ -232,9 +300,15 @@ def get_api_docs(routes):
     routes = map(_get_tuple_from_route, routes)
 
     documentation = []
+    rhs = []
     for url, rh in sorted(routes, key=lambda a: a[0]):
         if issubclass(rh, APIHandler):
             documentation.append(_get_route_doc(url, rh))
+            rhs.append(rh)
+
+    registered_schemas_doc = _get_registered_schemas_doc(rhs)
+    if registered_schemas_doc is not None:
+        documentation.append(registered_schemas_doc)
 
     documentation = (
         "**This documentation is automatically generated.**\n\n" +
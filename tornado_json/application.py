@@ -1,8 +1,254 @@
+import re
+import zlib
+import threading
+from collections import OrderedDict
+
+import tornado.gen
 import tornado.web
+from tornado.escape import native_str
 
 from tornado_json.api_doc_gen import api_doc_gen
+from tornado_json.concurrency import ConcurrencyLimits
+from tornado_json.metrics import Metrics
 from tornado_json.constants import TORNADO_MAJOR
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class _Compressor(object):
+    """Streaming compressor for ``encoding`` with a common interface"""
+
+    MAX_LEVELS = {"br": 11, "zstd": 22, "gzip": 9}
+
+    def __init__(self, encoding, level):
+        level = min(level, self.MAX_LEVELS[encoding])
+        self._encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=level)
+        elif encoding == "zstd":
+            self._compressor = zstandard.ZstdCompressor(
+                level=level).compressobj()
+        else:
+            # wbits offset by 16 gives the gzip container
+            self._compressor = zlib.compressobj(
+                level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, chunk, finishing):
+        c = self._compressor
+        if self._encoding == "br":
+            return c.process(chunk) + (c.finish() if finishing else c.flush())
+        if self._encoding == "zstd":
+            return c.compress(chunk) + (
+                c.flush() if finishing
+                else c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK))
+        return c.compress(chunk) + (
+            c.flush() if finishing else c.flush(zlib.Z_SYNC_FLUSH))
+
+
+class _CompressionTransform(tornado.web.OutputTransform):
+    """Applies the content encoding chosen by a ``CompressionPolicy``"""
+
+    def __init__(self, policy, request):
+        self._policy = policy
+        self._request = request
+        self._encoding = policy.choose_encoding(
+            request.headers.get("Accept-Encoding", ""))
+        self._compressor = None
+
+    def transform_first_chunk(self, status_code, headers, chunk, finishing):
+        if 'Vary' in headers:
+            headers['Vary'] += ', Accept-Encoding'
+        else:
+            headers['Vary'] = 'Accept-Encoding'
+
+        policy = self._policy
+        ctype = native_str(headers.get("Content-Type", "")).split(";")[0]
+        level = policy.get_level(self._request.path)
+        if not all([
+            self._encoding,
+            level,
+            status_code not in (204, 304),
+            policy.compressible_type(ctype),
+            not finishing or len(chunk) >= policy.min_length,
+            "Content-Encoding" not in headers
+        ]):
+            return status_code, headers, chunk
+
+        headers["Content-Encoding"] = self._encoding
+        if finishing and policy.is_cacheable(self._request, headers):
+            chunk = policy.get_compressed(
+                (self._request.uri, headers["Etag"], self._encoding, level),
+                chunk
+            )
+        else:
+            self._compressor = _Compressor(self._encoding, level)
+            chunk = self.transform_chunk(chunk, finishing)
+        if "Content-Length" in headers:
+            # The original content length is no longer correct.
+            # If this is the last (and only) chunk, we can set the new
+            # content-length; otherwise we remove it and fall back to
+            # chunked encoding.
+            if finishing:
+                headers["Content-Length"] = str(len(chunk))
+            else:
+                del headers["Content-Length"]
+        return status_code, headers, chunk
+
+    def transform_chunk(self, chunk, finishing):
+        if self._compressor is not None:
+            chunk = self._compressor.compress(chunk, finishing)
+        return chunk
+
+
+class CompressionPolicy(object):
+    """Policy for compressing responses, used in place of
+    ``compress_response`` by passing it as ``Application(compression=...)``
+
+    - Responses shorter than ``min_length`` (in a single chunk) are not
+      compressed, as the overhead is not worth it
+    - The compression level can be set per route
+    - Brotli (``br``) and Zstandard (``zstd``) are used when the client
+      accepts them and the ``brotli`` or ``zstandard`` packages are
+      installed; ``gzip`` otherwise
+    - Cacheable responses, i.e., responses with an ``Etag`` to GETs of
+      routes matching ``cacheable``, are compressed only once; the
+      compressed body is kept in an LRU cache keyed by URI, ``Etag``,
+      encoding and level
+
+    :type  min_length: int
+    :param min_length: Minimum length in bytes of a response to compress
+    :type  level: int
+    :param level: Default compression level; levels above the maximum of an
+        encoding (9 for gzip, 11 for brotli and 22 for zstd) are capped
+    :type  levels: [(str, int), ...]
+    :param levels: ``(pattern, level)`` pairs; the level of the first
+        pattern that matches the path of a request is used, with 0
+        disabling compression
+    :type  encodings: [str, ...]
+    :param encodings: Encodings in order of preference
+    :type  cacheable: [str, ...]
+    :param cacheable: Patterns of paths whose responses can be cached
+        compressed
+    :type  cache_size: int
+    :param cache_size: Maximum number of cached compressed responses
+    """
+
+    CONTENT_TYPES = tornado.web.GZipContentEncoding.CONTENT_TYPES
+
+    def __init__(self, min_length=1024, level=6, levels=(),
+                 encodings=("br", "zstd", "gzip"), cacheable=(),
+                 cache_size=256):
+        available = {"br": brotli, "zstd": zstandard, "gzip": zlib}
+        self.min_length = min_length
+        self.level = level
+        self.levels = [(re.compile(p), l) for p, l in levels]
+        self.encodings = [e for e in encodings if available.get(e)]
+        self.cacheable = [re.compile(p) for p in cacheable]
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def __call__(self, request):
+        """Create the output transform for ``request``
+
+        This is what lets the policy be given to
+        ``tornado.web.Application`` as a transform.
+        """
+        return _CompressionTransform(self, request)
+
+    def choose_encoding(self, accept_encoding):
+        """:returns: Preferred encoding in ``accept_encoding``, or ``None``
+        """
+        accepted = set(
+            e.split(";")[0].strip() for e in accept_encoding.split(",")
+            if not e.replace(" ", "").endswith(";q=0")
+        )
+        for encoding in self.encodings:
+            if encoding in accepted:
+                return encoding
+        return None
+
+    def compressible_type(self, ctype):
+        return ctype.startswith('text/') or ctype in self.CONTENT_TYPES
+
+    def get_level(self, path):
+        for pattern, level in self.levels:
+            if pattern.match(path):
+                return level
+        return self.level
+
+    def is_cacheable(self, request, headers):
+        return all([
+            request.method == "GET",
+            "Etag" in headers,
+            any(p.match(request.path) for p in self.cacheable)
+        ])
+
+    def get_compressed(self, key, chunk):
+        """Get ``chunk`` compressed as per ``key``, from the cache if
+        it is there
+        """
+        compressed = self._cache.pop(key, None)
+        if compressed is None:
+            url, etag, encoding, level = key
+            compressed = _Compressor(encoding, level).compress(chunk, True)
+            if len(self._cache) >= self.cache_size:
+                self._cache.popitem(last=False)
+        self._cache[key] = compressed
+        return compressed
+
+
+# Presets of ``HTTPServer`` settings (requires ``tornado>=4``) for
+#   ``Application.listen(profile=...)``
+SERVER_PROFILES = {
+    # Tornado's own defaults; as of 4.5, idle keep-alive connections are
+    #   kept for an hour, reads are 64KB at a time, buffers and bodies are
+    #   limited to 100MB and there is no body timeout
+    "default": {},
+    # Same as default except that gzipped request bodies are accepted
+    #   (``decompress_request``), so clients can send less data; answering
+    #   requests is no faster than with the defaults
+    "high_throughput": {
+        "decompress_request": True,
+    },
+    # Same as default except that, to free resources held by slow or idle
+    #   clients, idle connections are closed after a minute and slow bodies
+    #   after 5 seconds, bodies and buffers are limited to 1MB, and reads
+    #   are 16KB at a time
+    "low_latency": {
+        "idle_connection_timeout": 60,
+        "body_timeout": 5,
+        "chunk_size": 16 * 1024,
+        "max_body_size": 1024 * 1024,
+        "max_buffer_size": 1024 * 1024,
+    },
+}
+
+
+def get_server_settings(profile="default", **overrides):
+    """Get ``HTTPServer`` keyword arguments for ``profile``
+
+    :type  profile: str
+    :param profile: Name of a profile in ``SERVER_PROFILES``
+    :param overrides: Settings overriding those of ``profile``, e.g.,
+        ``xheaders=True`` when behind a reverse proxy
+    :rtype: dict
+    :raises ValueError: If there is no such profile
+    """
+    try:
+        settings = dict(SERVER_PROFILES[profile])
+    except KeyError:
+        raise ValueError("Unknown server profile `{}`; expected one of {}"
+                         .format(profile, sorted(SERVER_PROFILES)))
+    settings.update(overrides)
+    return settings
+
 
 class Application(tornado.web.Application):
     """Entry-point for the app
@@ -18,24 +264,130 @@ class Application(tornado.web.Application):
     :param bool generate_docs: If set, will generate API documentation for
         provided ``routes``. Documentation is written as API_Documentation.md
         in the cwd.
+    :type  compression: CompressionPolicy
+    :param compression: Policy to compress responses with, instead of
+        Tornado's ``compress_response``
+    :type  cache: cache.ReadThroughCache
+    :param cache: Cache of lookups, e.g., of ``db_conn``, available to
+        handlers as ``self.cache``
+    :type  tasks: tasks.TaskQueue
+    :param tasks: Queue of background tasks, available to handlers as
+        ``self.tasks``
+
+    Concurrency limits (see ``tornado_json.concurrency``) are set with the
+    ``max_concurrency``, ``concurrency_queue``, ``concurrency_timeout`` and
+    ``retry_after`` settings.
     """
 
     def __init__(self, routes, settings, db_conn=None,
-                 generate_docs=False):
+                 generate_docs=False, compression=None, cache=None,
+                 tasks=None):
+        self.generate_docs = generate_docs
         if generate_docs:
             # Generate API Documentation
             api_doc_gen(routes)
 
-        # Unless compress_response was specifically set to False in
-        # settings, enable it
-        compress_response = "compress_response" if TORNADO_MAJOR >= 4 else "gzip"
-        if compress_response not in settings:
-            settings[compress_response] = True
+        transforms = None
+        if compression is not None:
+            transforms = [compression]
+            if TORNADO_MAJOR < 4:
+                transforms.append(tornado.web.ChunkedTransferEncoding)
+        else:
+            # Unless compress_response was specifically set to False in
+            # settings, enable it
+            compress_response = "compress_response" if TORNADO_MAJOR >= 4 \
+                else "gzip"
+            if compress_response not in settings:
+                settings[compress_response] = True
 
         tornado.web.Application.__init__(
             self,
             routes,
+            transforms=transforms,
             **settings
         )
 
         self.db_conn = db_conn
+        self.metrics = Metrics()
+        self.cache = cache
+        if cache is not None:
+            cache.metrics = self.metrics
+        self.tasks = tasks
+        if tasks is not None:
+            tasks.metrics = self.metrics
+        self.concurrency = ConcurrencyLimits(
+            max_concurrency=settings.get("max_concurrency"),
+            max_queue=settings.get("concurrency_queue", 0),
+            queue_timeout=settings.get("concurrency_timeout", 1.0),
+            retry_after=settings.get("retry_after", 1)
+        )
+
+    @tornado.gen.coroutine
+    def shutdown(self, timeout=None):
+        """Drain the queue of background tasks, if any; call this once
+        servers have stopped taking requests, before stopping the
+        ``IOLoop``
+
+        :param float timeout: Seconds to wait for tasks at most
+        :returns: Whether all tasks were done
+        :rtype: bool
+        """
+        if self.tasks is None:
+            raise tornado.gen.Return(True)
+        drained = yield self.tasks.drain(timeout)
+        raise tornado.gen.Return(drained)
+
+    def listen(self, port, address="", profile="default", **kwargs):
+        """Start an HTTP server for this application on ``port``, with
+        settings from ``profile`` (see ``SERVER_PROFILES``)
+
+        :param kwargs: Settings overriding those of ``profile``
+        :returns: The ``HTTPServer``
+        """
+        return tornado.web.Application.listen(
+            self, port, address, **get_server_settings(profile, **kwargs))
+
+    def reload_routes(self, routes):
+        """Replace the routes of the running application with ``routes``
+
+        The new rule table is built first and then swapped in with a single
+        assignment, so requests are routed with either the old or the new
+        routes, and requests in flight are not affected. Handlers for
+        ``static_path`` are kept. If ``generate_docs`` was set, API
+        documentation is regenerated in a background thread.
+
+        Must be called from the IOLoop thread, e.g., with routes from
+        ``routes.RouteCache.get_routes``.
+
+        :type  routes: [(url, RequestHandler), ...]
+        :param routes: New list of routes for the app
+        """
+        static_handler_class = self.settings.get(
+            "static_handler_class", tornado.web.StaticFileHandler)
+
+        def is_static(handler_class):
+            return bool(self.settings.get("static_path")) and \
+                handler_class is static_handler_class
+
+        if hasattr(self, "wildcard_router"):
+            # tornado>=4.5
+            router = type(self.wildcard_router)(self, routes)
+            rules = [r for r in self.wildcard_router.rules
+                     if is_static(r.target)] + router.rules
+            self.wildcard_router.rules, self.wildcard_router.named_rules = \
+                rules, router.named_rules
+        else:
+            specs = [tornado.web.URLSpec(*r) if isinstance(r, (tuple, list))
+                     else r for r in routes]
+            for i, (host_pattern, host_specs) in enumerate(self.handlers):
+                if host_pattern.pattern == ".*$":
+                    self.handlers[i] = (host_pattern, [
+                        s for s in host_specs if is_static(s.handler_class)
+                    ] + specs)
+            self.named_handlers.update(
+                (s.name, s) for s in specs if s.name)
+
+        if self.generate_docs:
+            thread = threading.Thread(target=api_doc_gen, args=(routes,))
+            thread.daemon = True
+            thread.start()
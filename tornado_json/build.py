@@ -0,0 +1,142 @@
+"""Ahead-of-time build of routes and schemas for deployment
+
+Running::
+
+    python -m tornado_json.build mywebapp --build-dir build/
+
+walks ``mywebapp`` with ``routes.get_routes`` and writes a manifest of
+the generated routes and of every schema compiled while importing the
+handlers to ``build/mywebapp.json``. Passing the same ``build_dir`` to
+``routes.get_routes`` at startup then skips both route discovery (which
+parses the source of every submodule) and meta-schema checks, as long as
+the sources of the package have not changed since the build.
+"""
+import os
+import sys
+import json
+import hashlib
+import argparse
+import pkgutil
+import importlib
+
+import tornado_json
+from tornado_json.constants import HTTP_METHODS
+from tornado_json.registry import default_registry
+from tornado_json.routes import set_route_converters
+from tornado_json.utils import is_method
+
+
+def _get_source_paths(package):
+    """Get paths of the sources of ``package`` and all of its submodules
+
+    :rtype: [str, ...]
+    """
+    paths = [package.__file__]
+    for importer, modname, ispkg in pkgutil.walk_packages(
+            path=package.__path__,
+            prefix=package.__name__ + '.',
+            onerror=lambda x: None):
+        if hasattr(importer, "find_spec"):
+            path = importer.find_spec(modname).origin
+        else:
+            path = importer.find_module(modname).get_filename()
+        paths.append(path)
+    # We want the sources rather than any compiled files
+    return sorted(p[:-1] if p.endswith((".pyc", ".pyo")) else p
+                  for p in paths)
+
+
+def get_source_hash(package):
+    """Get a hash of the sources of ``package`` (and of the version of
+    Tornado-JSON, as that determines how routes are generated)
+
+    :rtype: str
+    """
+    h = hashlib.sha1(tornado_json.__version__.encode("utf-8"))
+    for path in _get_source_paths(package):
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def get_manifest_path(package_name, build_dir):
+    return os.path.join(build_dir, package_name + ".json")
+
+
+def build(package_name, build_dir):
+    """Generate routes for ``package_name`` and write them, along with the
+    keys of all checked schemas, to a manifest in ``build_dir``
+
+    :type  package_name: str
+    :type  build_dir: str
+    :returns: Path of the written manifest
+    :rtype: str
+    """
+    from tornado_json.routes import get_routes
+
+    package = importlib.import_module(package_name)
+    routes = get_routes(package)
+    manifest = {
+        "source_hash": get_source_hash(package),
+        "routes": [(url, rh.__module__, rh.__name__) for url, rh in routes],
+        "schemas": default_registry.get_checked(),
+    }
+
+    if not os.path.isdir(build_dir):
+        os.makedirs(build_dir)
+    path = get_manifest_path(package_name, build_dir)
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return path
+
+
+def load_routes(package, build_dir):
+    """Load routes for ``package`` from its manifest in ``build_dir``
+
+    Schemas in the manifest are always marked as checked, as they were
+    valid at build time no matter what has changed since.
+
+    :returns: List of routes, or ``None`` if there is no manifest or it
+        is out of date
+    :rtype: [(url, RequestHandler), ... ] or None
+    """
+    path = get_manifest_path(package.__name__, build_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    default_registry.add_checked(manifest["schemas"])
+
+    if manifest["source_hash"] != get_source_hash(package):
+        return None
+    routes = [
+        (url, getattr(importlib.import_module(modname), cls_name))
+        for url, modname, cls_name in manifest["routes"]
+    ]
+    # As when routes are generated, for the annotated arguments of methods
+    for url, cls in routes:
+        for name in HTTP_METHODS:
+            method = vars(cls).get(name)
+            if is_method(method):
+                set_route_converters(method)
+    return routes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m tornado_json.build",
+        description="Build the route and schema manifest of a package"
+    )
+    parser.add_argument("package", help="Package containing RequestHandlers")
+    parser.add_argument("--build-dir", default="build",
+                        help="Directory to write the manifest to")
+    parser.add_argument("--path", action="append", default=[],
+                        help="Directory to add to sys.path")
+    args = parser.parse_args(argv)
+
+    sys.path[:0] = [os.getcwd()] + args.path
+    print(build(args.package, args.build_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""Bulk writes, for ``schema.validate(bulk=...)``
+
+In bulk mode, ``input_schema`` describes a single item and the body is
+a JSON array of items or, with a ``Content-Type`` of
+``application/x-ndjson``, one item per line. Items are validated one by
+one, and the valid ones are handed to the decorated method in batches,
+as ``self.body``; the method returns the list of results of the items of
+the batch (or ``None``), each validated against ``output_schema``. The
+response has the result of every item, in the order they were sent::
+
+    {"status": "success", "data": {
+        "results": [
+            {"status": "success", "data": 1},
+            {"status": "fail", "data": "'year' is a required property"}
+        ],
+        "succeeded": 1,
+        "failed": 1
+    }}
+
+An ``APIError`` raised by the method fails just the items of its batch.
+"""
+import json
+
+import jsonschema
+import tornado.gen
+
+from tornado_json.exceptions import APIError
+from tornado_json.gen import is_future, moment
+from tornado_json.ndjson import NDJSON_TYPE
+
+
+def _fail(message):
+    return {"status": "fail", "data": message}
+
+
+class Bulk(object):
+    """Bulk mode options
+
+    :type  batch_size: int
+    :param batch_size: Items passed to the method at once
+    :type  chunk_size: int
+    :param chunk_size: Items validated before letting the ``IOLoop`` run
+        other callbacks, so big imports do not hold up other requests
+    """
+
+    def __init__(self, batch_size=100, chunk_size=500):
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+
+    def decode(self, request, results):
+        """Decode the items of the body of ``request``
+
+        Lines of NDJSON that cannot be decoded fail on their own.
+
+        :type  results: dict
+        :param results: Results of items that failed are added to it, by
+            index
+        :returns: The items; ``None`` for those that failed
+        :raises ValidationError: If the body is not a JSON array
+        """
+        body = request.body.decode("UTF-8")
+        if request.headers.get("Content-Type", "").startswith(NDJSON_TYPE):
+            items = []
+            for line in body.splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    results[len(items)] = _fail(
+                        "Input is malformed; could not decode JSON object.")
+                    items.append(None)
+            return items
+
+        try:
+            items = json.loads(body)
+        except ValueError:
+            raise jsonschema.ValidationError(
+                "Input is malformed; could not decode JSON object."
+            )
+        if not isinstance(items, list):
+            raise jsonschema.ValidationError("Input is not an array.")
+        return items
+
+    @tornado.gen.coroutine
+    def validate_items(self, items, validator, results):
+        """Validate ``items`` with ``validator``, failing invalid ones in
+        ``results``
+
+        :returns: ``[(index, item), ...]`` of valid items
+        """
+        valid = []
+        for start in range(0, len(items), self.chunk_size):
+            if start:
+                yield moment()
+            for index in range(start, min(start + self.chunk_size,
+                                          len(items))):
+                if results[index] is not None:
+                    continue
+                item = items[index]
+                if validator is not None:
+                    try:
+                        validator.validate(item)
+                    except jsonschema.ValidationError as e:
+                        results[index] = _fail(e.message)
+                        continue
+                valid.append((index, item))
+        raise tornado.gen.Return(valid)
+
+    @tornado.gen.coroutine
+    def run(self, handler, method, args, kwargs, input_validator,
+            output_validator):
+        """Validate the items of the request to ``handler`` and pass the
+        valid ones to ``method`` in batches
+
+        :returns: The bulk response
+        :rtype: dict
+        """
+        # Results by index of item, once known
+        results = {}
+        items = self.decode(handler.request, results)
+        results = [results.get(i) for i in range(len(items))]
+        valid = yield self.validate_items(items, input_validator, results)
+
+        for start in range(0, len(valid), self.batch_size):
+            batch = valid[start:start + self.batch_size]
+            handler.body = [item for _, item in batch]
+            try:
+                output = method(handler, *args, **kwargs)
+                if is_future(output):
+                    output = yield output
+            except APIError as e:
+                for index, _ in batch:
+                    results[index] = _fail(e.log_message)
+                continue
+
+            if output is None:
+                output = [None] * len(batch)
+            if not isinstance(output, list) or len(output) != len(batch):
+                raise TypeError("Bulk methods must return one result per "
+                                "item of the batch.")
+            for (index, _), result in zip(batch, output):
+                if output_validator is not None:
+                    try:
+                        output_validator.validate(result)
+                    except jsonschema.ValidationError as e:
+                        # A fault on our end; see ``schema.validate``
+                        raise TypeError(str(e))
+                results[index] = {"status": "success", "data": result}
+
+        succeeded = sum(1 for r in results if r["status"] == "success")
+        raise tornado.gen.Return({
+            "results": results,
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+        })
+
+    def get_input_schema(self, input_schema):
+        """Get the schema of bulk bodies given the ``input_schema`` of an
+        item"""
+        return {"type": "array",
+                "items": input_schema if input_schema is not None else {}}
+
+    def get_output_schema(self, output_schema):
+        """Get the schema of bulk responses given the ``output_schema`` of
+        the result of an item"""
+        return {
+            "type": "object",
+            "properties": {
+                "results": {
+                    "type": "array",
+                    "items": {"anyOf": [
+                        {"properties": {
+                            "status": {"enum": ["success"]},
+                            "data": output_schema
+                            if output_schema is not None else {}
+                        }},
+                        {"properties": {
+                            "status": {"enum": ["fail"]},
+                            "data": {"type": "string"}
+                        }},
+                    ]}
+                },
+                "succeeded": {"type": "integer"},
+                "failed": {"type": "integer"},
+            },
+            "required": ["results", "succeeded", "failed"],
+        }
+
+    def get_input_example(self, input_example):
+        if input_example is None:
+            return None
+        return [input_example]
+
+    def get_output_example(self, output_example):
+        if output_example is None:
+            return None
+        return {
+            "results": [{"status": "success", "data": output_example}],
+            "succeeded": 1,
+            "failed": 0,
+        }
@@ -0,0 +1,308 @@
+"""Read-through cache of lookups, e.g., of ``db_conn``
+
+Values are cached by namespace and key, each namespace an LRU of at most
+``max_size`` values that are kept for ``ttl`` seconds::
+
+    app = Application(routes, settings, db_conn=db,
+                      cache=ReadThroughCache({"cars": {"max_size": 500}}))
+
+    class CarHandler(APIHandler):
+
+        @schema.validate(output_schema=CAR_SCHEMA)
+        @gen.coroutine
+        def get(self, make):
+            car = yield self.cache.get("cars", make, self.db_conn.get_car)
+            raise gen.Return(car)
+
+        @schema.validate(input_schema=CAR_SCHEMA)
+        def put(self, make):
+            self.db_conn.put_car(make, self.body)
+            self.cache.invalidate("cars", make)
+
+With a coroutine function as the lookup (e.g., ``get_car`` above),
+``get`` returns a Future for hits, too (on tornado 3.x.x, only if it is
+decorated with ``tornado_json.gen.coroutine``). Concurrent misses of the same key
+share one lookup. Hits and misses are counted in the ``Metrics`` of the
+application (``cache_hits`` and ``cache_misses``) and by namespace in
+``get_stats``. With an ``InvalidationChannel``, invalidations are sent to
+the caches of the other worker processes of the application, too.
+"""
+import errno
+import json
+import os
+import socket
+import time
+from collections import OrderedDict
+
+from tornado.concurrent import Future, chain_future
+from tornado.ioloop import IOLoop
+from tornado.log import app_log
+
+from tornado_json.gen import is_coroutine_function, is_future
+
+
+class Namespace(object):
+    """LRU of values that expire ``ttl`` seconds after they are added
+
+    :type  max_size: int
+    :type  ttl: float
+    """
+
+    def __init__(self, max_size=1000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = self.misses = self.evictions = 0
+        # (expires, value) by key, least recently used first
+        self._values = OrderedDict()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key, default=None):
+        """Get the value of ``key``, if it has not expired"""
+        entry = self._values.pop(key, None)
+        if entry is None or entry[0] <= time.time():
+            self.misses += 1
+            return default
+        self._values[key] = entry
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        self._values.pop(key, None)
+        self._values[key] = (time.time() + self.ttl, value)
+        while len(self._values) > self.max_size:
+            self._values.popitem(last=False)
+            self.evictions += 1
+
+    def discard(self, key):
+        self._values.pop(key, None)
+
+    def clear(self):
+        self._values.clear()
+
+    def get_stats(self):
+        """:rtype: dict"""
+        return {
+            "size": len(self),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+_MISSING = object()
+
+
+class ReadThroughCache(object):
+    """Cache of values looked up by namespace and key
+
+    :type  namespaces: dict
+    :param namespaces: Keyword arguments of ``Namespace`` (``max_size``,
+        ``ttl``) by name; other namespaces get the defaults
+    :type  max_size: int
+    :param max_size: Default ``max_size`` of namespaces
+    :type  ttl: float
+    :param ttl: Default ``ttl`` of namespaces
+    :type  channel: InvalidationChannel
+    :param channel: Channel to the caches of other worker processes
+    :ivar metrics: ``Metrics`` to count hits and misses in; set by
+        ``Application``
+    """
+
+    def __init__(self, namespaces=None, max_size=1000, ttl=60,
+                 channel=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.metrics = None
+        self._namespaces = {}
+        for name, options in (namespaces or {}).items():
+            self._namespaces[name] = Namespace(**options)
+        # Lookups in progress by (namespace, key)
+        self._pending = {}
+        self._listeners = []
+        self.channel = channel
+        if channel is not None:
+            channel.on_message = self._on_remote_invalidate
+
+    def get_namespace(self, name):
+        """:rtype: Namespace"""
+        namespace = self._namespaces.get(name)
+        if namespace is None:
+            namespace = self._namespaces[name] = Namespace(self.max_size,
+                                                           self.ttl)
+        return namespace
+
+    def _count(self, name):
+        if self.metrics is not None:
+            self.metrics.incr(name)
+
+    def get(self, namespace, key, load):
+        """Get the value of ``key`` in ``namespace``, looked up with
+        ``load(key)`` if it is not cached
+
+        :param load: Lookup of values; may return a Future
+        :returns: A Future of the value if ``load`` is a coroutine
+            function (so that hits can be yielded like misses), else the
+            value, or a Future of it if ``load`` returned one (or another
+            lookup of ``key`` is in progress)
+        """
+        value = self.get_namespace(namespace).get(key, _MISSING)
+        if value is not _MISSING:
+            self._count("cache_hits")
+            if is_coroutine_function(load):
+                future = Future()
+                future.set_result(value)
+                return future
+            return value
+        self._count("cache_misses")
+
+        pending = self._pending.get((namespace, key))
+        if pending is not None:
+            return pending
+        value = load(key)
+        if not is_future(value):
+            self.get_namespace(namespace).set(key, value)
+            return value
+
+        future = self._pending[(namespace, key)] = Future()
+
+        def on_loaded(loaded):
+            # Unless invalidated while loading, it may be stale
+            if self._pending.get((namespace, key)) is future:
+                del self._pending[(namespace, key)]
+                if loaded.exception() is None:
+                    self.get_namespace(namespace).set(key, loaded.result())
+            chain_future(loaded, future)
+        IOLoop.current().add_future(value, on_loaded)
+        return future
+
+    def add_listener(self, callback):
+        """Call ``callback(namespace, key)`` on every invalidation, local
+        or from other workers, e.g., to drop values derived from them"""
+        self._listeners.append(callback)
+
+    def _invalidate(self, namespace, key):
+        if key is None:
+            self.get_namespace(namespace).clear()
+            for pending in [p for p in self._pending if p[0] == namespace]:
+                del self._pending[pending]
+        else:
+            self.get_namespace(namespace).discard(key)
+            self._pending.pop((namespace, key), None)
+        for callback in self._listeners:
+            callback(namespace, key)
+
+    def invalidate(self, namespace, key=None):
+        """Drop ``key`` (or, if ``None``, all keys) of ``namespace``, here
+        and in the caches of other workers
+
+        Call this once the write has been done, so that the value cannot
+        be looked up again before it has changed.
+        """
+        self._invalidate(namespace, key)
+        if self.channel is not None:
+            self.channel.send([namespace, key])
+
+    def _on_remote_invalidate(self, message):
+        namespace, key = message
+        self._invalidate(namespace, key)
+
+    def get_stats(self):
+        """Get the stats of each namespace
+
+        :rtype: dict
+        """
+        return dict((name, namespace.get_stats())
+                    for name, namespace in self._namespaces.items())
+
+
+class InvalidationChannel(object):
+    """Channel of invalidations between the workers of an application,
+    through Unix datagram sockets in ``path``
+
+    Each worker binds a socket of its own in the directory when it calls
+    ``start`` (after forking), and sends to those of all the others.
+    Invalidated keys have to be JSON-serializable (and strings or numbers,
+    to be the same keys once decoded).
+
+    :type  path: str
+    :param path: Directory shared by the workers
+    :type  name: str
+    :param name: Name of the socket of this worker; its pid by default
+    :ivar on_message: Called with each message from other workers; set by
+        ``ReadThroughCache``
+    """
+
+    def __init__(self, path, name=None):
+        self.path = path
+        self.name = name
+        self.on_message = None
+        self._socket = None
+        self._address = None
+        self._io_loop = None
+
+    def start(self):
+        """Bind the socket of this worker and receive messages on the
+        current ``IOLoop``"""
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self._address = os.path.join(
+            self.path, "{}.sock".format(self.name or os.getpid()))
+        if os.path.exists(self._address):
+            os.unlink(self._address)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+        self._socket.bind(self._address)
+        self._io_loop = IOLoop.current()
+        self._io_loop.add_handler(self._socket.fileno(), self._on_readable,
+                                  IOLoop.READ)
+
+    def _on_readable(self, fd, events):
+        while True:
+            try:
+                data = self._socket.recv(65536)
+            except socket.error as e:
+                if e.args[0] in (errno.EWOULDBLOCK, errno.EAGAIN):
+                    return
+                raise
+            if self.on_message is not None:
+                try:
+                    self.on_message(json.loads(data.decode("UTF-8")))
+                except Exception:
+                    app_log.error("Invalid invalidation message %r", data,
+                                  exc_info=True)
+
+    def send(self, message):
+        """Send ``message`` (JSON-serializable) to all other workers"""
+        if self._socket is None:
+            return
+        data = json.dumps(message).encode("UTF-8")
+        for name in os.listdir(self.path):
+            address = os.path.join(self.path, name)
+            if address == self._address or not name.endswith(".sock"):
+                continue
+            try:
+                self._socket.sendto(data, address)
+            except socket.error as e:
+                if e.args[0] == errno.ECONNREFUSED:
+                    # Its worker is gone
+                    try:
+                        os.unlink(address)
+                    except OSError:
+                        pass
+                elif e.args[0] not in (errno.ENOENT, errno.EAGAIN,
+                                       errno.EWOULDBLOCK):
+                    raise
+
+    def close(self):
+        if self._socket is None:
+            return
+        self._io_loop.remove_handler(self._socket.fileno())
+        self._socket.close()
+        self._socket = None
+        try:
+            os.unlink(self._address)
+        except OSError:
+            pass
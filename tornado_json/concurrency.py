@@ -0,0 +1,167 @@
+"""Concurrency limits and load shedding
+
+Limits are set globally with the ``max_concurrency`` setting of
+``Application`` and per route with the ``__max_concurrency__`` attribute
+of a handler, e.g.::
+
+    class SlowHandler(APIHandler):
+
+        __url_names__ = ["slow"]
+        __max_concurrency__ = 10
+
+Requests over a limit wait in a queue (``concurrency_queue`` setting,
+empty by default) for up to ``concurrency_timeout`` seconds; requests
+that do not fit in the queue or time out in it are shed with a 503 and a
+``Retry-After`` of ``retry_after`` seconds. Queue depth and shed counts
+are available from ``Application.concurrency.get_stats()``.
+"""
+from collections import deque
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from tornado_json.exceptions import Overloaded
+
+
+class ConcurrencyLimit(object):
+    """Limit on the number of requests handled at once
+
+    :type  max_concurrency: int
+    :param max_concurrency: Requests handled at once
+    :type  max_queue: int
+    :param max_queue: Requests waiting for a slot at once
+    :type  queue_timeout: float or None
+    :param queue_timeout: Seconds a request may wait for a slot; forever
+        if ``None``
+    :type  retry_after: int
+    :param retry_after: ``Retry-After`` of shed requests
+    """
+
+    def __init__(self, max_concurrency, max_queue=0, queue_timeout=1.0,
+                 retry_after=1):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.active = 0
+        self.shed = 0
+        self._waiters = deque()
+
+    @property
+    def queue_depth(self):
+        return len(self._waiters)
+
+    def acquire(self):
+        """Take a slot
+
+        :returns: ``None`` if a slot was taken, else a ``Future`` resolved
+            once one is (or failed with ``Overloaded`` on timeout)
+        :raises Overloaded: If there is no room left in the queue
+        """
+        if self.active < self.max_concurrency:
+            self.active += 1
+            return None
+        if len(self._waiters) >= self.max_queue:
+            self.shed += 1
+            raise Overloaded(self.retry_after)
+
+        waiter = Future()
+        self._waiters.append(waiter)
+        if self.queue_timeout is not None:
+            io_loop = IOLoop.current()
+
+            def on_timeout():
+                if waiter.done():
+                    # Given a slot since; its done callbacks, which remove
+                    #   this timeout, may run on a later iteration
+                    return
+                self._waiters.remove(waiter)
+                self.shed += 1
+                waiter.set_exception(Overloaded(self.retry_after))
+
+            timeout = io_loop.add_timeout(io_loop.time() + self.queue_timeout,
+                                          on_timeout)
+            waiter.add_done_callback(lambda f: io_loop.remove_timeout(timeout))
+        return waiter
+
+    def release(self):
+        """Give back a slot, handing it straight to the next queued request
+        if there is one"""
+        if self._waiters:
+            self._waiters.popleft().set_result(None)
+        else:
+            self.active -= 1
+
+    def get_stats(self):
+        """:rtype: dict"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "queued": self.queue_depth,
+            "shed": self.shed,
+        }
+
+
+class ConcurrencyLimits(object):
+    """Concurrency limits of an application: an optional global limit,
+    shared by all handlers, and a limit for each handler with a
+    ``__max_concurrency__``
+
+    ``__max_concurrency__`` is either a number of requests, queued as set
+    by the other arguments, or a ``ConcurrencyLimit``.
+
+    :param max_concurrency: Global limit, if any
+    :param max_queue: See ``ConcurrencyLimit``
+    :param queue_timeout: See ``ConcurrencyLimit``
+    :param retry_after: See ``ConcurrencyLimit``
+    """
+
+    def __init__(self, max_concurrency=None, max_queue=0, queue_timeout=1.0,
+                 retry_after=1):
+        self._defaults = dict(max_queue=max_queue,
+                              queue_timeout=queue_timeout,
+                              retry_after=retry_after)
+        self.global_limit = ConcurrencyLimit(
+            max_concurrency, **self._defaults
+        ) if max_concurrency else None
+        self._routes = {}
+        # Limits that apply to each handler class
+        self._limits = {}
+
+    def get_limits(self, handler_class):
+        """Get the limits that apply to requests to ``handler_class``, in
+        the order they should be acquired (the route's own limit first, so
+        queued requests do not hold global slots)
+
+        :rtype: [ConcurrencyLimit, ...]
+        """
+        limits = self._limits.get(handler_class)
+        if limits is None:
+            limits = []
+            limit = getattr(handler_class, "__max_concurrency__", None)
+            if limit:
+                if not isinstance(limit, ConcurrencyLimit):
+                    limit = ConcurrencyLimit(limit, **self._defaults)
+                self._routes[handler_class] = limit
+                limits.append(limit)
+            if self.global_limit is not None:
+                limits.append(self.global_limit)
+            self._limits[handler_class] = limits
+        return limits
+
+    def get_stats(self):
+        """Get slots in use, queue depth and shed count of all limits
+
+        Routes are included once they have been requested.
+
+        :rtype: dict
+        """
+        return {
+            "global": self.global_limit.get_stats()
+            if self.global_limit is not None else None,
+            "routes": dict(
+                ("{}.{}".format(cls.__module__, cls.__name__),
+                 limit.get_stats())
+                for cls, limit in self._routes.items()
+            )
+        }
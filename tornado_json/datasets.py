@@ -0,0 +1,230 @@
+"""Read-only JSON datasets served from memory-mapped files
+
+A dataset is a JSON file of an object (of items by key) or an array, or
+a JSON-lines file of one item per line. It is memory-mapped and indexed
+(by key, to the byte range of each item) once, when it is registered;
+requests are then served the bytes of items, spliced as they are into
+the JSend envelope, rather than having the items rebuilt and encoded
+again each time::
+
+    register_dataset("cars", "data/cars.jsonl", key="make",
+                     schema=CAR_SCHEMA)
+
+    class CarHandler(APIHandler):
+
+        @schema.validate(output_schema=CAR_SCHEMA)
+        def get(self, make):
+            cars = get_dataset("cars")
+            api_assert(make in cars, 404, "No such car.")
+            return cars.get_raw(make)
+
+Items are validated against ``schema`` when the dataset is loaded, so
+``schema.validate`` writes back the ``RawJSON`` of them without
+validating them again. Datasets registered before forking worker
+processes (e.g., ``tornado.process.fork_processes``) share both the
+index and the pages of the file.
+"""
+import json
+import mmap
+import re
+from array import array
+
+from tornado_json.registry import default_registry
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class RawJSON(object):
+    """Already encoded (and validated) JSON
+
+    Returned by handler methods decorated with ``schema.validate`` to be
+    written back as it is; see ``JSendMixin.success_raw``.
+
+    :type  data: bytes
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+
+class Dataset(object):
+    """Memory-mapped JSON dataset
+
+    :type  path: str
+    :param path: JSON file of an object or an array, or JSON-lines file
+    :type  key: str or None
+    :param key: Field of items (of an array or JSON lines) that is their
+        key; items are keyed by index if it is not given
+    :type  schema: dict or None
+    :param schema: Schema of an item, which all items are validated
+        against when the dataset is loaded
+    :type  lines: bool or None
+    :param lines: Whether the file is JSON lines; by default, if its name
+        ends with ``.jsonl`` or ``.ndjson``
+    :raises ValueError: If the file is not valid JSON (or JSON lines)
+    :raises ValidationError: If an item does not validate against
+        ``schema``
+    """
+
+    def __init__(self, path, key=None, schema=None, lines=None):
+        if lines is None:
+            lines = path.endswith((".jsonl", ".ndjson"))
+        self.path = path
+        self._key = key
+        self._validator = default_registry.get_validator(schema) \
+            if schema is not None else None
+        # Index of item by key, and byte ranges of items by index
+        self._index = {}
+        self._starts = array("l")
+        self._ends = array("l")
+
+        with open(path, "rb") as f:
+            try:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped
+                self._mm = b""
+        if lines:
+            self._index_lines()
+        else:
+            self._index_document()
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def keys(self):
+        """Get the keys of the items, in the order of the file
+
+        :rtype: list
+        """
+        keys = [None] * len(self)
+        for key, i in self._index.items():
+            keys[i] = key
+        return keys
+
+    def _decode(self, start, end):
+        return json.loads(self._mm[start:end].decode("UTF-8"))
+
+    def _add(self, start, end, key=None, item=None):
+        """Index the item at ``start:end``, ``item`` if already decoded"""
+        if item is None and (self._validator is not None or
+                             (key is None and self._key is not None)):
+            item = self._decode(start, end)
+        if self._validator is not None:
+            self._validator.validate(item)
+        if key is None:
+            key = item[self._key] if self._key is not None else len(self)
+        self._index[key] = len(self)
+        self._starts.append(start)
+        self._ends.append(end)
+
+    def _index_lines(self):
+        mm = self._mm
+        start = 0
+        while start < len(mm):
+            end = mm.find(b"\n", start)
+            if end == -1:
+                end = len(mm)
+            line = mm[start:end]
+            if line.strip():
+                # The item without surrounding whitespace
+                stripped = line.lstrip()
+                item_start = start + len(line) - len(stripped)
+                item_end = item_start + len(stripped.rstrip())
+                self._add(item_start, item_end,
+                          item=self._decode(item_start, item_end))
+            start = end + 1
+
+    def _index_document(self):
+        # Decoded as Latin-1, characters are at the offsets of their bytes;
+        #   only positions are taken from it, while keys and items are
+        #   decoded from the UTF-8 bytes
+        text = self._mm[:].decode("latin-1")
+        decoder = json.JSONDecoder()
+        skip = lambda pos: _WHITESPACE.match(text, pos).end()
+        pos = skip(0)
+        if text[pos:pos + 1] not in ("[", "{"):
+            raise ValueError("{} is not a JSON object or array.".format(
+                self.path))
+        is_object = text[pos] == "{"
+        close = "}" if is_object else "]"
+        pos = skip(pos + 1)
+        if text[pos:pos + 1] == close:
+            return
+        while True:
+            key = None
+            if is_object:
+                _, key_end = decoder.raw_decode(text, pos)
+                key = self._decode(pos, key_end)
+                pos = skip(key_end)
+                if text[pos:pos + 1] != ":":
+                    raise ValueError("Expected ':' at byte {}.".format(pos))
+                pos = skip(pos + 1)
+            _, end = decoder.raw_decode(text, pos)
+            self._add(pos, end, key=key)
+            pos = skip(end)
+            if text[pos:pos + 1] == close:
+                return
+            if text[pos:pos + 1] != ",":
+                raise ValueError("Expected ',' at byte {}.".format(pos))
+            pos = skip(pos + 1)
+
+    def get(self, key):
+        """Get the item ``key``, decoded
+
+        :raises KeyError: If there is no such item
+        """
+        i = self._index[key]
+        return self._decode(self._starts[i], self._ends[i])
+
+    def get_raw(self, key):
+        """Get the item ``key``, as it is in the file
+
+        :rtype: RawJSON
+        :raises KeyError: If there is no such item
+        """
+        i = self._index[key]
+        return RawJSON(self._mm[self._starts[i]:self._ends[i]])
+
+    def get_raw_slice(self, start=0, stop=None):
+        """Get the array of the items ``start:stop`` (in the order of the
+        file), e.g., for a page of them
+
+        :rtype: RawJSON
+        """
+        starts = self._starts[start:stop]
+        ends = self._ends[start:stop]
+        return RawJSON(b"[" + b",".join(
+            self._mm[s:e] for s, e in zip(starts, ends)) + b"]")
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+
+
+_datasets = {}
+
+
+def register_dataset(name, path, **kwargs):
+    """Load the dataset at ``path`` (see ``Dataset``) as ``name``,
+    replacing any dataset already registered as ``name`` (which is left
+    open for requests still using it)
+
+    :rtype: Dataset
+    """
+    dataset = _datasets[name] = Dataset(path, **kwargs)
+    return dataset
+
+
+def get_dataset(name):
+    """Get the dataset registered as ``name``
+
+    :rtype: Dataset
+    :raises KeyError: If there is no such dataset
+    """
+    return _datasets[name]
@@ -5,6 +5,51 @@ class APIError(HTTPError):
     """Equivalent to ``RequestHandler.HTTPError`` except for in name"""
 
 
+class InvalidInput(APIError):
+    """Raised with all the errors found validating input (see
+    ``validation.ErrorCollector``)
+
+    Written back by ``APIHandler`` as a JSend ``fail`` with status 400
+    and ``data`` as its data.
+
+    :type  errors: dict
+    :param errors: Error messages by JSON pointer to where they are in
+        the input
+    :type  truncated: bool
+    :param truncated: Whether validation was stopped early, so there may
+        be more errors
+    """
+
+    def __init__(self, errors, truncated=False, *args, **kwargs):
+        APIError.__init__(self, 400, "Input is invalid.", *args, **kwargs)
+        self.data = {"errors": errors, "truncated": truncated}
+
+
+class Overloaded(HTTPError):
+    """Raised when a request is shed because of a concurrency limit
+
+    Written back by ``APIHandler`` as a JSend ``error`` with status 503
+    and a ``Retry-After`` header.
+
+    :type  retry_after: int
+    :param retry_after: Seconds after which the client may retry
+    """
+
+    def __init__(self, retry_after=1, log_message=None, *args, **kwargs):
+        HTTPError.__init__(self, 503, log_message, *args, **kwargs)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(HTTPError):
+    """Raised when a request is not handled before its deadline
+
+    Written back by ``APIHandler`` as a JSend ``error`` with status 504.
+    """
+
+    def __init__(self, log_message="Deadline exceeded.", *args, **kwargs):
+        HTTPError.__init__(self, 504, log_message, *args, **kwargs)
+
+
 def api_assert(condition, *args, **kwargs):
     """Assertion to fail with if not ``condition``
 
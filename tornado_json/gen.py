@@ -1,8 +1,24 @@
+import sys
 import inspect
 
 from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.concurrent import Future
 
 from tornado_json.constants import TORNADO_MAJOR
+from tornado_json.utils import get_route_args
+
+try:
+    from tornado.concurrent import is_future
+except ImportError:
+    # For tornado 3.x.x
+    is_future = lambda x: isinstance(x, Future)
+try:
+    from tornado.concurrent import future_set_exc_info
+except ImportError:
+    # For tornado<5
+    def future_set_exc_info(future, exc_info):
+        future.set_exc_info(exc_info)
 
 
 def coroutine(func, replace_callback=True):
@@ -13,7 +29,68 @@ def coroutine(func, replace_callback=True):
     # gen.coroutine in tornado 3.x.x has a different signature from 4.x.x
     if TORNADO_MAJOR == 3:
         wrapper = gen.coroutine(func)
+        # Only set by gen.coroutine itself from tornado 4.0 on; see
+        #   is_coroutine_function
+        wrapper.__tornado_coroutine__ = True
     else:
         wrapper = gen.coroutine(func, replace_callback)
-    wrapper.__argspec_args = inspect.getargspec(func).args
+    wrapper.__argspec_args = ["self"] + [a for a, t in get_route_args(func)]
     return wrapper
+
+
+def moment():
+    """Get a Future to yield to let the ``IOLoop`` run other callbacks"""
+    if hasattr(gen, "moment"):
+        return gen.moment
+    # For tornado 3.x.x
+    future = Future()
+    IOLoop.current().add_callback(future.set_result, None)
+    return future
+
+
+def is_coroutine_function(func):
+    """Determine whether ``func`` is a coroutine function, i.e., either
+    a native ``async def`` function or decorated with ``gen.coroutine``
+
+    :rtype: bool
+    """
+    return bool(
+        getattr(func, "__tornado_coroutine__", False) or
+        getattr(inspect, "iscoroutinefunction", lambda f: False)(func)
+    )
+
+
+def then(future, callback):
+    """Chain ``callback`` onto ``future``
+
+    :returns: Future that resolves to ``callback(future.result())`` once
+        ``future`` resolves, or to whatever exception either raises
+    :rtype: Future
+    """
+    result = Future()
+
+    def on_done(f):
+        try:
+            result.set_result(callback(f.result()))
+        except Exception:
+            future_set_exc_info(result, sys.exc_info())
+
+    if isinstance(future, Future):
+        future.add_done_callback(on_done)
+    else:
+        # e.g., a concurrent.futures.Future, whose callbacks would run on
+        #   whichever thread resolves it
+        IOLoop.current().add_future(future, on_done)
+    return result
+
+
+def flush(handler):
+    """Flush the output buffer of ``handler``
+
+    :returns: Something to yield until the buffer is written out; before
+        tornado 4.0, ``RequestHandler.flush`` only takes a callback
+    """
+    # flush in tornado 3.x.x returns None rather than a Future
+    if TORNADO_MAJOR == 3:
+        return gen.Task(handler.flush)
+    return handler.flush()
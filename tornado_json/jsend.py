@@ -20,6 +20,18 @@ class JSendMixin(object):
         self.write({'status': 'success', 'data': data})
         self.finish()
 
+    def success_raw(self, data):
+        """Like ``success``, with ``data`` already encoded as JSON, e.g.,
+        from a ``datasets.Dataset``; it is spliced into the envelope as it
+        is
+
+        :type  data: bytes
+        """
+        self.write(b'{"status": "success", "data": ')
+        self.write(data)
+        self.write(b"}")
+        self.finish()
+
     def fail(self, data):
         """There was a problem with the data submitted, or some pre-condition
         of the API call wasn't satisfied.
@@ -0,0 +1,34 @@
+from collections import defaultdict
+
+
+class Metrics(object):
+    """Counters of events in an application, e.g., ``deadline_exceeded``
+
+    Available as ``Application.metrics``.
+    """
+
+    def __init__(self):
+        self._counters = defaultdict(int)
+
+    def incr(self, name, value=1):
+        """Add ``value`` to counter ``name``"""
+        self._counters[name] += value
+
+    def get(self, name):
+        """:rtype: int"""
+        return self._counters.get(name, 0)
+
+    def get_stats(self):
+        """Get all counters
+
+        :rtype: dict
+        """
+        return dict(self._counters)
+
+
+def incr(handler, name, value=1):
+    """Add ``value`` to counter ``name`` of the application of ``handler``,
+    if it keeps ``Metrics``"""
+    metrics = getattr(handler.application, "metrics", None)
+    if metrics is not None:
+        metrics.incr(name, value)
@@ -0,0 +1,79 @@
+"""Newline-delimited JSON (NDJSON), for ``schema.validate(ndjson=True)``
+
+In NDJSON mode, the body is one item per line, each validated against
+``input_schema``, and ``self.body`` is the list of items. The method
+returns an iterable (e.g., a generator) of items, each validated against
+``output_schema`` and written back as a line of an
+``application/x-ndjson`` response, which is flushed every
+``FLUSH_EVERY`` lines so clients get the first items early and the
+whole response is never buffered.
+
+With an ``NDJSONHandler``, the body is decoded line by line as it
+streams in, and each item is passed to ``NDJSONHandler.on_item``, so it
+is not buffered either.
+"""
+import json
+
+import jsonschema
+import tornado.gen
+from tornado.escape import json_encode
+
+from tornado_json.gen import flush
+
+NDJSON_TYPE = "application/x-ndjson"
+# Lines written between flushes of the response
+FLUSH_EVERY = 100
+
+
+def decode_line(line, validator, lineno):
+    """Decode and validate ``line``
+
+    :type  line: bytes
+    :returns: The item
+    :raises ValidationError: If ``line`` is malformed or invalid
+    """
+    try:
+        item = json.loads(line.decode("UTF-8"))
+    except ValueError:
+        raise jsonschema.ValidationError(
+            "Input is malformed; could not decode JSON object on line "
+            "{}.".format(lineno)
+        )
+    if validator is not None:
+        try:
+            validator.validate(item)
+        except jsonschema.ValidationError as e:
+            raise jsonschema.ValidationError(
+                "Line {}: {}".format(lineno, e.message))
+    return item
+
+
+def decode(body, validator):
+    """Decode and validate the lines of ``body``
+
+    :rtype: list
+    """
+    return [decode_line(line, validator, lineno)
+            for lineno, line in enumerate(body.split(b"\n"), 1)
+            if line.strip()]
+
+
+@tornado.gen.coroutine
+def write_lines(handler, items, validator):
+    """Validate ``items`` and write them back from ``handler``, one per
+    line, then finish the response
+
+    :raises TypeError: If an item is invalid
+    """
+    handler.set_header("Content-Type", NDJSON_TYPE)
+    for count, item in enumerate(items, 1):
+        if validator is not None:
+            try:
+                validator.validate(item)
+            except jsonschema.ValidationError as e:
+                # A fault on our end; see ``schema.validate``
+                raise TypeError(str(e))
+        handler.write(json_encode(item) + "\n")
+        if count % FLUSH_EVERY == 0:
+            yield flush(handler)
+    handler.finish()
@@ -0,0 +1,150 @@
+"""Paginated list responses, for ``schema.validate(paginate=...)``
+
+The decorated method is asked for one page at a time: it is called with
+a ``limit`` keyword argument and either ``offset`` or, with
+``cursor=True``, ``cursor`` (``None`` for the first page), as read from
+the query arguments of the same names. It returns just the items of the
+page or, with ``cursor=True``, ``(items, next_cursor)``. Only the page is
+validated against the ``output_schema`` of the method, and it is written
+back as ``{"items": [...], "next": "<url of the next page>"}`` (``next``
+is ``null`` on the last page)::
+
+    class CarsHandler(APIHandler):
+
+        @schema.validate(output_schema={"type": "array"}, paginate=True)
+        def get(self, limit, offset):
+            return CARS[offset:offset + limit]
+"""
+try:
+    from urllib.parse import urlencode  # py3
+except ImportError:
+    from urllib import urlencode  # py2
+
+from tornado_json.exceptions import APIError
+
+
+class Pagination(object):
+    """Pagination options
+
+    :type  default_limit: int
+    :param default_limit: Items per page if there is no ``limit``
+    :type  max_limit: int
+    :param max_limit: Largest ``limit`` allowed; larger ones are lowered
+    :type  cursor: bool
+    :param cursor: Paginate with opaque cursors given by the method rather
+        than with offsets
+    """
+
+    def __init__(self, default_limit=20, max_limit=100, cursor=False):
+        self.default_limit = default_limit
+        self.max_limit = max_limit
+        self.cursor = cursor
+
+    @property
+    def arg_names(self):
+        """Names of the keyword arguments passed to the method"""
+        return ("limit", "cursor") if self.cursor else ("limit", "offset")
+
+    def _get_int_argument(self, handler, name, default, minimum):
+        value = handler.get_argument(name, None)
+        if value is None:
+            return default
+        try:
+            value = int(value)
+        except ValueError:
+            value = minimum - 1
+        if value < minimum:
+            raise APIError(400, "Invalid value for `{}`.".format(name))
+        return value
+
+    def get_page_args(self, handler):
+        """Get the keyword arguments for the page requested from
+        ``handler``
+
+        :rtype: dict
+        :raises APIError: If ``limit`` or ``offset`` is invalid
+        """
+        limit = min(self._get_int_argument(
+            handler, "limit", self.default_limit, 1), self.max_limit)
+        if self.cursor:
+            return {"limit": limit,
+                    "cursor": handler.get_argument("cursor", None)}
+        return {"limit": limit,
+                "offset": self._get_int_argument(handler, "offset", 0, 0)}
+
+    def split_output(self, output):
+        """Split what the method returned into the items of the page and
+        the cursor of the next page (``None`` without ``cursor``)"""
+        if self.cursor:
+            return output
+        return output, None
+
+    def get_next_url(self, handler, page_args, items, next_cursor):
+        """Get the URL of the page after ``items``, with the other query
+        arguments of the request kept, or ``None`` if it is the last"""
+        if self.cursor:
+            if next_cursor is None:
+                return None
+            next_args = {"cursor": next_cursor}
+        else:
+            # A full page may be followed by an empty one, but this saves
+            #   asking the method for one item more than it returns
+            if len(items) < page_args["limit"]:
+                return None
+            next_args = {"offset": page_args["offset"] + len(items)}
+        next_args["limit"] = page_args["limit"]
+
+        # For tornado<3.2, ``arguments`` are those of the query (and of
+        #   form-encoded bodies)
+        arguments = getattr(handler.request, "query_arguments",
+                            handler.request.arguments)
+        query = [
+            (name, value)
+            for name, values in sorted(arguments.items())
+            if name not in next_args
+            for value in values
+        ]
+        query.extend(sorted(next_args.items()))
+        return "{}?{}".format(handler.request.path, urlencode(query))
+
+    def wrap(self, handler, page_args, items, next_cursor):
+        """:returns: The paginated response for ``items``"""
+        return {
+            "items": items,
+            "next": self.get_next_url(handler, page_args, items, next_cursor)
+        }
+
+    def get_output_schema(self, output_schema):
+        """Get the schema of paginated responses given the ``output_schema``
+        of the items of a page
+
+        :rtype: dict
+        """
+        return {
+            "type": "object",
+            "properties": {
+                "items": output_schema if output_schema is not None
+                else {"type": "array"},
+                "next": {"type": ["string", "null"]},
+            },
+            "required": ["items", "next"],
+        }
+
+    def get_output_example(self, output_example):
+        """Get the example of a paginated response given ``output_example``
+        of the items of a page"""
+        if output_example is None:
+            return None
+        return {"items": output_example, "next": None}
+
+    def get_doc(self):
+        """Describe the query arguments of paginated methods
+
+        :rtype: str
+        """
+        return (
+            "Query arguments `limit` (items per page; {} by default, at most "
+            "{}) and `{}`; follow `next` for the next page.".format(
+                self.default_limit, self.max_limit,
+                "cursor" if self.cursor else "offset")
+        )
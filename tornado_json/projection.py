@@ -0,0 +1,157 @@
+"""Sparse fieldsets, for ``schema.validate(fields=True)``
+
+A request for ``?fields=make,engine.power`` gets only those fields of
+the output (through any arrays in it), e.g.,
+``{"make": "Ford", "engine": {"power": 100}}``. Each distinct ``fields``
+is parsed once into a ``Projection``: a compiled function pruning the
+output, and the sub-schema of ``output_schema`` describing what is left,
+which is what the pruned output is validated against.
+"""
+import re
+
+from tornado_json.exceptions import APIError
+from tornado_json.registry import default_registry
+
+# Keywords of object and array schemas that still hold for a projection
+#   of an instance; schemas with any other keyword are not projected
+_OBJECT_KEYWORDS = frozenset([
+    "type", "properties", "required", "additionalProperties",
+    "patternProperties", "title", "description", "definitions", "default",
+    "$schema", "id", "$id",
+])
+_ARRAY_KEYWORDS = frozenset([
+    "type", "items", "minItems", "maxItems", "title", "description",
+    "definitions", "default", "$schema", "id", "$id",
+])
+
+
+def parse_fields(fields):
+    """Parse ``fields`` into a tree of ``{field: True or subtree}``
+
+    :type  fields: str
+    :param fields: Comma-separated field paths, e.g., ``"a,b.c"``
+    :rtype: dict
+    :raises APIError: If a path has an empty field
+    """
+    tree = {}
+    for path in fields.split(","):
+        names = path.strip().split(".")
+        if not all(names):
+            raise APIError(400, "Invalid value for `fields`.")
+        node = tree
+        for name in names[:-1]:
+            child = node.setdefault(name, {})
+            if child is True:
+                # The whole field is already projected
+                break
+            node = child
+        else:
+            node[names[-1]] = True
+    return tree
+
+
+def compile_projector(tree):
+    """Compile ``tree`` into a function projecting an instance onto it
+
+    :rtype: callable
+    """
+    fields = [(name, None if sub is True else compile_projector(sub))
+              for name, sub in tree.items()]
+
+    def project(value):
+        if isinstance(value, list):
+            return [project(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+        projected = {}
+        for name, project_field in fields:
+            if name in value:
+                projected[name] = value[name] if project_field is None \
+                    else project_field(value[name])
+        return projected
+
+    return project
+
+
+def project_schema(schema, tree):
+    """Derive the schema of projections onto ``tree`` of instances of
+    ``schema``
+
+    :returns: The derived schema, or ``None`` if ``schema`` uses keywords
+        that might not hold for projections (e.g., ``$ref`` or
+        ``minProperties``), or ``tree`` prunes fields described by
+        ``additionalProperties`` or ``patternProperties``
+    :rtype: dict or None
+    """
+    keywords = set(schema)
+    if "items" in schema or schema.get("type") == "array":
+        if not keywords <= _ARRAY_KEYWORDS or \
+                not isinstance(schema.get("items", {}), dict):
+            return None
+        items = project_schema(schema.get("items", {}), tree)
+        if items is None:
+            return None
+        derived = dict(schema)
+        if "items" in schema:
+            derived["items"] = items
+        return derived
+
+    if not keywords <= _OBJECT_KEYWORDS:
+        return None
+    properties = schema.get("properties", {})
+    patterns = schema.get("patternProperties", {})
+    derived = dict(schema)
+    if "properties" in schema:
+        derived["properties"] = {}
+    for name, sub in tree.items():
+        if sub is not True:
+            # Only the schemas in ``properties`` are projected; those of
+            #   ``additionalProperties`` and ``patternProperties`` might
+            #   not hold for the pruned field
+            if (name not in properties and
+                    "additionalProperties" in schema) or \
+                    any(re.search(pattern, name) for pattern in patterns):
+                return None
+        if name not in properties:
+            continue
+        field_schema = properties[name]
+        if sub is not True:
+            field_schema = project_schema(field_schema, sub)
+            if field_schema is None:
+                return None
+        derived["properties"][name] = field_schema
+    if "required" in schema:
+        derived["required"] = [name for name in schema["required"]
+                               if name in tree]
+        if not derived["required"]:
+            # Draft 4 requires at least one element
+            del derived["required"]
+    return derived
+
+
+class Projection(object):
+    """Projection of outputs onto ``fields``
+
+    :type  fields: str
+    :param fields: See ``parse_fields``
+    :type  output_schema: dict or None
+    :param output_schema: Schema of the output before projection
+    :ivar validator: Validator of projected outputs, or ``None`` if there
+        is no output schema or none could be derived (in which case
+        outputs have to be validated before they are projected)
+    """
+
+    def __init__(self, fields, output_schema=None):
+        tree = parse_fields(fields)
+        self.project = compile_projector(tree)
+        self.validator = None
+        if output_schema is not None:
+            schema = project_schema(output_schema, tree)
+            if schema is not None:
+                # Not cached in the registry, so that it is dropped along
+                #   with the projection
+                self.validator = default_registry.compile(
+                    schema, referrer=output_schema)
+
+    def __call__(self, output):
+        return self.project(output)
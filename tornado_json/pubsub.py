@@ -0,0 +1,124 @@
+"""In-process publish/subscribe of events, for ``EventStreamHandler``
+
+Publishing appends an event to its channel and resolves a single Future
+that every subscriber of the channel is waiting on, so an event reaches
+any number of subscribers without being queued for each of them.
+"""
+from collections import deque
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+
+class Event(object):
+    """Event published to a ``Channel``
+
+    Frames of the event (e.g., its validated and encoded JSend envelope)
+    are cached on it, so they are built once no matter how many
+    subscribers it is sent to.
+    """
+
+    __slots__ = ("id", "data", "_frames")
+
+    def __init__(self, id, data):
+        self.id = id
+        self.data = data
+        self._frames = {}
+
+    def get_frame(self, key, make_frame):
+        """Get the frame ``key`` of the event, made with
+        ``make_frame(event)`` the first time"""
+        try:
+            return self._frames[key]
+        except KeyError:
+            frame = self._frames[key] = make_frame(self)
+            return frame
+
+
+class Channel(object):
+    """Channel of events, of which the last ``history`` are kept for
+    subscribers that fall behind (or reconnect)
+
+    :type  history: int
+    :type  heartbeat: float
+    :param heartbeat: Seconds after which waiting subscribers are woken up
+        even if nothing was published, e.g., to check their connection
+    """
+
+    def __init__(self, history=100, heartbeat=15):
+        self.heartbeat = heartbeat
+        self.last_id = 0
+        self._events = deque(maxlen=history)
+        self._next = Future()
+        self._timeout = None
+
+    def publish(self, data):
+        """Publish ``data`` to subscribers
+
+        :returns: Id of the event
+        :rtype: int
+        """
+        self.last_id += 1
+        self._events.append(Event(self.last_id, data))
+        if self._timeout is not None:
+            IOLoop.current().remove_timeout(self._timeout)
+        self._wake()
+        return self.last_id
+
+    def get_events(self, last_id):
+        """Get events published after event ``last_id`` that are still kept
+
+        :rtype: [Event, ...]
+        """
+        if last_id >= self.last_id:
+            return []
+        return [event for event in self._events if event.id > last_id]
+
+    def wait(self):
+        """Get a Future resolved on the next publish, or after
+        ``heartbeat`` seconds at the latest"""
+        if self._timeout is None and self.heartbeat:
+            io_loop = IOLoop.current()
+            self._timeout = io_loop.add_timeout(
+                io_loop.time() + self.heartbeat, self._wake)
+        return self._next
+
+    def _wake(self):
+        self._timeout = None
+        waiting, self._next = self._next, Future()
+        waiting.set_result(None)
+
+
+class PubSub(object):
+    """Named channels, created on first use
+
+    :param history: See ``Channel``
+    :param heartbeat: See ``Channel``
+    """
+
+    def __init__(self, history=100, heartbeat=15):
+        self._channel_kwargs = dict(history=history, heartbeat=heartbeat)
+        self._channels = {}
+
+    def get_channel(self, name):
+        """:rtype: Channel"""
+        channel = self._channels.get(name)
+        if channel is None:
+            channel = self._channels[name] = Channel(**self._channel_kwargs)
+        return channel
+
+    def publish(self, name, data):
+        """Publish ``data`` to channel ``name``
+
+        :returns: Id of the event
+        """
+        return self.get_channel(name).publish(data)
+
+
+default_pubsub = PubSub()
+
+
+def publish(name, data):
+    """Publish ``data`` to channel ``name`` of the default ``PubSub``,
+    which is used by ``EventStreamHandler``"""
+    return default_pubsub.publish(name, data)
@@ -0,0 +1,198 @@
+"""Per-client rate limiting
+
+Limits are set per route with the ``__rate_limit__`` attribute of an
+``APIHandler`` and for all routes with the ``rate_limit`` setting of
+``Application``, e.g.::
+
+    class CarsHandler(APIHandler):
+
+        # 10 requests per second per client IP, in bursts of up to 20
+        __rate_limit__ = RateLimit(TokenBucket(10, burst=20), key=by_ip)
+
+They are checked in ``APIHandler.prepare``, before the body is decoded,
+and requests over them get a 429 JSend ``fail`` with a ``Retry-After``.
+
+``TokenBucket`` keeps its buckets in the memory of the process;
+``SharedTokenBucket`` keeps them in a memory-mapped file, so that all
+(e.g., pre-forked) processes of a host using the same file share quotas.
+"""
+import os
+import math
+import mmap
+import time
+import struct
+import hashlib
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from tornado_json.exceptions import APIError
+
+
+class RateLimited(APIError):
+    """Raised when a request is over a rate limit
+
+    Written back by ``APIHandler`` as a JSend ``fail`` with status 429 and
+    a ``Retry-After`` header.
+
+    :type  retry_after: int
+    :param retry_after: Seconds after which the client may retry
+    """
+
+    def __init__(self, retry_after=1, log_message="Rate limit exceeded.",
+                 *args, **kwargs):
+        # Not all versions of httplib know of 429
+        kwargs.setdefault("reason", "Too Many Requests")
+        APIError.__init__(self, 429, log_message, *args, **kwargs)
+        self.retry_after = retry_after
+
+
+def _refill(tokens, last, now, rate, burst):
+    """Take a token from a bucket holding ``tokens`` at ``last``
+
+    :returns: Tokens left at ``now`` and seconds to wait for a token (0 if
+        one was taken)
+    """
+    tokens = min(burst, tokens + (now - last) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+class TokenBucket(object):
+    """In-process token buckets, one per key
+
+    :type  rate: float
+    :param rate: Tokens added to each bucket per second
+    :type  burst: int
+    :param burst: Size of each bucket; ``rate`` rounded up if not given
+    :type  max_keys: int
+    :param max_keys: Buckets kept; the least recently used are dropped
+        (i.e., refilled) beyond that
+    """
+
+    def __init__(self, rate, burst=None, max_keys=10000):
+        self.rate = float(rate)
+        self.burst = burst or int(math.ceil(rate))
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    def consume(self, key, now=None):
+        """Take a token from the bucket of ``key``
+
+        :returns: 0 if a token was taken, else seconds until one is
+            available
+        :rtype: float
+        """
+        if now is None:
+            now = time.time()
+        tokens, last = self._buckets.pop(key, (self.burst, now))
+        tokens, wait = _refill(tokens, last, now, self.rate, self.burst)
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class SharedTokenBucket(object):
+    """Token buckets in a memory-mapped file, shared by all processes that
+    use the same ``path``
+
+    Keys are hashed to one of ``slots`` fixed-size slots; a key taking
+    over a slot from another starts with a full bucket. Each update locks
+    just its slot (with ``fcntl.lockf``, so on Unix only).
+
+    :type  path: str
+    :param path: File to map; created if it does not exist
+    :param rate: See ``TokenBucket``
+    :param burst: See ``TokenBucket``
+    :type  slots: int
+    """
+
+    _SLOT = struct.Struct("<Qdd")  # key hash, tokens, last update
+
+    def __init__(self, path, rate, burst=None, slots=4096):
+        if fcntl is None:
+            raise RuntimeError("SharedTokenBucket requires fcntl.")
+        self.rate = float(rate)
+        self.burst = burst or int(math.ceil(rate))
+        self.slots = slots
+        size = slots * self._SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+    def consume(self, key, now=None):
+        """See ``TokenBucket.consume``"""
+        if now is None:
+            now = time.time()
+        # Python's hash() is randomized per process
+        digest = hashlib.sha1(key.encode("utf-8")).digest()
+        key_hash = struct.unpack("<Q", digest[:8])[0] | 1  # 0 is empty
+        offset = (key_hash % self.slots) * self._SLOT.size
+
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, self._SLOT.size, offset)
+        try:
+            slot_hash, tokens, last = self._SLOT.unpack_from(self._map,
+                                                             offset)
+            if slot_hash != key_hash:
+                tokens, last = self.burst, now
+            tokens, wait = _refill(tokens, last, now, self.rate, self.burst)
+            self._SLOT.pack_into(self._map, offset, key_hash, tokens, now)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, self._SLOT.size, offset)
+        return wait
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+def by_ip(handler):
+    """Key requests by client IP"""
+    return handler.request.remote_ip
+
+
+def by_route(handler):
+    """Key requests by route, i.e., limit all clients of a route together"""
+    return "{}.{}".format(type(handler).__module__, type(handler).__name__)
+
+
+def by_header(name):
+    """Key requests by the value of header ``name`` (e.g., an API key);
+    requests without it are not limited"""
+    def key(handler):
+        return handler.request.headers.get(name)
+    return key
+
+
+class RateLimit(object):
+    """Rate limit of requests
+
+    :type  bucket: TokenBucket or SharedTokenBucket
+    :param bucket: Buckets of the limit
+    :type  key: callable
+    :param key: Function of the handler giving the key of the request
+        (see ``by_ip``, ``by_route``, ``by_header``), or ``None`` for
+        requests that should not be limited
+    """
+
+    def __init__(self, bucket, key=by_ip):
+        self.bucket = bucket
+        self.key = key
+
+    def check(self, handler):
+        """Take a token for the request of ``handler``
+
+        :raises RateLimited: If there is none left
+        """
+        key = self.key(handler)
+        if key is None:
+            return
+        wait = self.bucket.consume(key)
+        if wait:
+            raise RateLimited(int(math.ceil(wait)))
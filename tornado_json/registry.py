@@ -0,0 +1,213 @@
+import json
+from contextlib import contextmanager
+
+from jsonschema import RefResolver
+from jsonschema.validators import validator_for
+from tornado.util import basestring_type
+
+
+class _RegistryResolver(RefResolver):
+    """``RefResolver`` that looks up otherwise unresolvable URIs in a
+    ``SchemaRegistry`` rather than fetching them"""
+
+    def __init__(self, registry, *args, **kwargs):
+        self._registry = registry
+        RefResolver.__init__(self, *args, **kwargs)
+
+    def resolve_remote(self, uri):
+        if uri in self._registry:
+            return self._registry.get(uri)
+        return RefResolver.resolve_remote(self, uri)
+
+
+def _schema_key(schema):
+    """Canonical (hashable) representation of ``schema``
+
+    :rtype: str
+    """
+    return json.dumps(schema, sort_keys=True)
+
+
+class SchemaRegistry(object):
+    """Store of schemas by id and of compiled validators
+
+    Schemas registered with ``register`` can be referenced from any other
+    schema with ``{"$ref": "<schema_id>"}`` (or
+    ``"<schema_id>#/json/pointer"``). All validators handed out by the
+    registry resolve references through the same in-memory store, and
+    one validator is compiled (and its schema checked) per distinct
+    schema, no matter how many handlers use it.
+    """
+
+    def __init__(self):
+        self._schemas = {}
+        self._validators = {}
+        # Keys of schemas that have been checked against their meta-schema
+        self._checked = set()
+        self._replacing = False
+
+    def __contains__(self, schema_id):
+        return schema_id in self._schemas
+
+    def register(self, schema_id, schema):
+        """Register ``schema`` as ``schema_id``
+
+        :type  schema_id: str
+        :type  schema: dict
+        :returns: ``{"$ref": schema_id}``, for use in other schemas
+        :raises ValueError: If a different schema is already registered
+            as ``schema_id``, unless ``replacing``
+        """
+        registered = self._schemas.get(schema_id)
+        changed = registered is not None and registered != schema
+        if changed and not self._replacing:
+            raise ValueError(
+                "A different schema is already registered as `{}`.".format(
+                    schema_id)
+            )
+        validator_for(schema).check_schema(schema)
+        self._schemas[schema_id] = schema
+        if changed:
+            # Validators compiled since might have resolved it already
+            for key, validator in list(self._validators.items()):
+                if schema_id in self.get_refs(
+                        [validator.schema, validator.resolver.referrer]):
+                    del self._validators[key]
+        return {"$ref": schema_id}
+
+    @contextmanager
+    def replacing(self):
+        """Let schemas be registered again with changes within this
+        context, e.g., while modules registering them are reloaded (see
+        ``routes.RouteCache``)
+
+        Cached validators referring to a replaced schema are dropped, but
+        validators already handed out (e.g., to handlers of modules that
+        are not reloaded) keep validating against the old one.
+        """
+        self._replacing = True
+        try:
+            yield
+        finally:
+            self._replacing = False
+
+    def get(self, schema_id):
+        """Get the schema registered as ``schema_id``
+
+        :raises KeyError: If no such schema is registered
+        """
+        return self._schemas[schema_id]
+
+    def get_validator(self, schema, format_checker=None, referrer=None,
+                      check_schema=True, coerce=None):
+        """Get a compiled validator for ``schema``
+
+        :type  schema: dict
+        :type  format_checker: jsonschema.FormatChecker or None
+        :type  referrer: dict or None
+        :param referrer: Document that local references (``#/...``) in
+            ``schema`` point into; ``schema`` itself if not given
+        :param bool check_schema: Check ``schema`` against its meta-schema
+            when it is first compiled
+        :type  coerce: validation.Coercion or None
+        :param coerce: Coerce instances as they are validated
+        :rtype: jsonschema.IValidator
+        """
+        if referrer is None:
+            referrer = schema
+        key = (_schema_key(schema), _schema_key(referrer), id(format_checker),
+               id(coerce))
+        validator = self._validators.get(key)
+        if validator is None:
+            if check_schema and key[0] not in self._checked:
+                validator_for(referrer).check_schema(schema)
+                self._checked.add(key[0])
+            validator = self._validators[key] = self.compile(
+                schema, format_checker, referrer, coerce)
+        return validator
+
+    def compile(self, schema, format_checker=None, referrer=None,
+                coerce=None):
+        """Compile a validator for ``schema`` that resolves references
+        through the registry, without checking ``schema`` or caching the
+        validator (e.g., for schemas derived per request, which would
+        otherwise be kept for good)
+
+        See ``get_validator`` for the arguments.
+
+        :rtype: jsonschema.IValidator
+        """
+        if referrer is None:
+            referrer = schema
+        cls = validator_for(referrer)
+        if coerce is not None:
+            cls = coerce.extend(cls)
+        return cls(
+            schema,
+            resolver=_RegistryResolver(
+                self,
+                referrer.get(u"$id", referrer.get(u"id", u"")),
+                referrer
+            ),
+            format_checker=format_checker
+        )
+
+    def get_checked(self):
+        """Get keys of all schemas that have been checked so far
+
+        :rtype: [str, ...]
+        """
+        return sorted(self._checked)
+
+    def add_checked(self, schema_keys):
+        """Mark schemas as already checked so that compiling them does not
+        check them again, e.g., with keys from ``get_checked`` saved by
+        ``tornado_json.build``
+
+        :type  schema_keys: [str, ...]
+        """
+        self._checked.update(schema_keys)
+
+    def validate(self, instance, schema, format_checker=None):
+        """Validate ``instance`` against ``schema``
+
+        :raises jsonschema.ValidationError: If ``instance`` is invalid
+        """
+        self.get_validator(schema, format_checker).validate(instance)
+
+    def get_refs(self, schema):
+        """Get ids of all registered schemas that ``schema`` refers to,
+        directly or through other registered schemas
+
+        :rtype: [str, ...]
+        """
+        refs = []
+
+        def walk(node):
+            if isinstance(node, dict):
+                ref = node.get("$ref")
+                if isinstance(ref, basestring_type):
+                    schema_id = ref.split("#", 1)[0]
+                    if schema_id in self and schema_id not in refs:
+                        refs.append(schema_id)
+                        walk(self.get(schema_id))
+                for value in node.values():
+                    walk(value)
+            elif isinstance(node, list):
+                for value in node:
+                    walk(value)
+
+        walk(schema)
+        return refs
+
+
+default_registry = SchemaRegistry()
+
+
+def register_schema(schema_id, schema):
+    """Register ``schema`` as ``schema_id`` in the default registry,
+    which is used by ``schema.validate`` and ``api_doc_gen``
+
+    :returns: ``{"$ref": schema_id}``, for use in other schemas
+    """
+    return default_registry.register(schema_id, schema)
@@ -1,8 +1,23 @@
+import tornado.gen
+from tornado.escape import json_encode
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.log import app_log
 from tornado.web import RequestHandler
 from jsonschema import ValidationError
 
+from tornado_json import ndjson
 from tornado_json.jsend import JSendMixin
 from tornado_json.exceptions import APIError
+from tornado_json.gen import flush
+from tornado_json.pubsub import default_pubsub
+from tornado_json.registry import default_registry
+
+try:
+    from tornado.web import stream_request_body
+except ImportError:
+    # For tornado 3.x.x, which cannot stream request bodies
+    stream_request_body = None
 
 
 class BaseHandler(RequestHandler):
@@ -11,6 +26,97 @@ class BaseHandler(RequestHandler):
     __url_names__ = ["__self__"]
     __urls__ = []
 
+    # Per-request state, kept as class-level defaults so that requests
+    #   without it add nothing to the ``__dict__`` of their handler
+    #: Decoded request body (see ``schema.validate``)
+    body = None
+    #: Validated query arguments (see the ``query_schema`` of
+    #:  ``schema.validate``)
+    query = None
+    #: ``IOLoop`` time by which the request has to be handled, if any (see
+    #:  the ``timeout`` of ``schema.validate``)
+    deadline = None
+    #: Times since the start of the request by name (see ``mark``)
+    timings = None
+    #: Concurrency limits a slot of which the request holds
+    concurrency_slots = ()
+
+    def prepare(self):
+        """Convert URL arguments of the method to be called to the types
+        they were annotated with (see ``routes.get_module_routes``), and
+        take a slot of each concurrency limit of the request (see
+        ``tornado_json.concurrency``)
+
+        Subclasses overriding this should call it and return (or yield)
+        its result, which is a ``Future`` if the request has to wait for
+        a slot.
+        """
+        method = getattr(self, self.request.method.lower(), None)
+        converters = getattr(method, "__route_converters__", None)
+        if converters:
+            for name, convert in converters.items():
+                if name in self.path_kwargs:
+                    try:
+                        self.path_kwargs[name] = convert(
+                            self.path_kwargs[name])
+                    except ValueError:
+                        raise APIError(
+                            400, "Invalid value for `{}`.".format(name))
+
+        concurrency = getattr(self.application, "concurrency", None)
+        limits = concurrency.get_limits(type(self)) if concurrency else ()
+        if limits:
+            slots = self.concurrency_slots = []
+            for i, limit in enumerate(limits):
+                waiter = limit.acquire()
+                if waiter is not None:
+                    return self._wait_for_slots(waiter, limits[i:])
+                slots.append(limit)
+
+    @tornado.gen.coroutine
+    def _wait_for_slots(self, waiter, limits):
+        """Wait for ``waiter``, the slot of ``limits[0]``, then take a slot
+        of each of the remaining ``limits``; the time at which all are
+        taken is marked as ``queued`` in ``timings``"""
+        for limit in limits:
+            if waiter is None:
+                waiter = limit.acquire()
+            if waiter is not None:
+                yield waiter
+                waiter = None
+            if self._finished:
+                limit.release()
+                return
+            self.concurrency_slots.append(limit)
+        self.mark("queued")
+
+    def on_finish(self):
+        """Give back slots taken in ``prepare``
+
+        Subclasses overriding this should call it.
+        """
+        for limit in self.concurrency_slots:
+            limit.release()
+        self.concurrency_slots = ()
+
+    def mark(self, name):
+        """Record the time since the start of the request as ``name`` in
+        ``timings``"""
+        if self.timings is None:
+            self.timings = {}
+        self.timings[name] = self.request.request_time()
+
+    def get_remaining_time(self):
+        """Get the seconds left before ``deadline``, e.g., to pass on as
+        the timeout of calls to other services
+
+        :returns: Seconds left, or ``None`` if there is no deadline
+        :rtype: float or None
+        """
+        if self.deadline is None:
+            return None
+        return max(0, self.deadline - IOLoop.current().time())
+
     @property
     def db_conn(self):
         """Returns database connection abstraction
@@ -22,6 +128,30 @@ class BaseHandler(RequestHandler):
             raise AttributeError("No database connection was provided.")
         return db_conn
 
+    @property
+    def cache(self):
+        """Returns the read-through cache of the application (see
+        ``tornado_json.cache``)
+
+        If no cache is available, raises an AttributeError
+        """
+        cache = getattr(self.application, "cache", None)
+        if cache is None:
+            raise AttributeError("No cache was provided.")
+        return cache
+
+    @property
+    def tasks(self):
+        """Returns the queue of background tasks of the application (see
+        ``tornado_json.tasks``)
+
+        If no queue is available, raises an AttributeError
+        """
+        tasks = getattr(self.application, "tasks", None)
+        if tasks is None:
+            raise AttributeError("No task queue was provided.")
+        return tasks
+
 
 class ViewHandler(BaseHandler):
     """Handler for views"""
@@ -47,6 +177,19 @@ class APIHandler(BaseHandler, JSendMixin):
         """
         self.set_header("Content-Type", "application/json")
 
+    def prepare(self):
+        """Check the rate limits of the request (see
+        ``tornado_json.ratelimit``), before anything else is done with it,
+        then ``BaseHandler.prepare``
+
+        Subclasses overriding this should call it.
+        """
+        for limit in (self.settings.get("rate_limit"),
+                      getattr(self, "__rate_limit__", None)):
+            if limit is not None:
+                limit.check(self)
+        return BaseHandler.prepare(self)
+
     def write_error(self, status_code, **kwargs):
         """Override of RequestHandler.write_error
 
@@ -60,8 +203,13 @@ class APIHandler(BaseHandler, JSendMixin):
             return exception.log_message if \
                 hasattr(exception, "log_message") else str(exception)
 
+        exception = kwargs["exc_info"][1]
         self.clear()
-        self.set_status(status_code)
+        self.set_status(status_code, getattr(exception, "reason", None))
+
+        retry_after = getattr(exception, "retry_after", None)
+        if retry_after is not None:
+            self.set_header("Retry-After", retry_after)
 
         # Any APIError exceptions raised will result in a JSend fail written
         # back with the log_message as data. Hence, log_message should NEVER
@@ -70,12 +218,13 @@ class APIHandler(BaseHandler, JSendMixin):
         # __str__ representation.
         # All other exceptions result in a JSend error being written back,
         # with log_message only written if debug mode is enabled
-        exception = kwargs["exc_info"][1]
         if any(isinstance(exception, c) for c in [APIError, ValidationError]):
             # ValidationError is always due to a malformed request
             if isinstance(exception, ValidationError):
                 self.set_status(400)
-            self.fail(get_exc_message(exception))
+            # Some carry structured data, e.g., ``InvalidInput``
+            self.fail(getattr(exception, "data", None) or
+                      get_exc_message(exception))
         else:
             self.error(
                 message=self._reason,
@@ -83,3 +232,167 @@ class APIHandler(BaseHandler, JSendMixin):
                 else None,
                 code=status_code
             )
+
+
+class EventStreamHandler(APIHandler):
+    """APIHandler that holds the connection open and pushes the events of
+    a channel of ``pubsub`` as they are published
+
+    Methods are decorated with ``schema.validate`` as usual and return
+    ``self.stream_events(channel)``. Each event is validated against the
+    ``output_schema`` of the method and written as a JSend ``success``
+    envelope: as a Server-Sent Event if the client accepts
+    ``text/event-stream``, else as a line of a chunked response. Events
+    that do not validate are logged and skipped.
+
+    Streams start after the last event published when they are opened,
+    or after the event of the ``Last-Event-ID`` header (sent by SSE
+    clients when they reconnect) or of the ``last_event_id`` argument.
+    """
+
+    pubsub = default_pubsub
+
+    def on_connection_close(self):
+        self._stream_closed = True
+        APIHandler.on_connection_close(self)
+
+    def _get_last_event_id(self, channel):
+        last_id = self.request.headers.get("Last-Event-ID") or \
+            self.get_argument("last_event_id", None)
+        if last_id is None:
+            return channel.last_id
+        try:
+            return int(last_id)
+        except ValueError:
+            raise APIError(400, "Invalid last event id.")
+
+    def _make_frame(self, event, validator, sse):
+        """Validate ``event`` and encode it in its JSend envelope
+
+        :returns: The frame, or ``None`` if ``event`` is invalid
+        """
+        if validator is not None:
+            try:
+                validator.validate(event.data)
+            except ValidationError as e:
+                app_log.error("Invalid event %s: %s", event.id, e)
+                return None
+        envelope = json_encode({"status": "success", "data": event.data})
+        if sse:
+            return "id: {}\ndata: {}\n\n".format(event.id, envelope)
+        return envelope + "\n"
+
+    @tornado.gen.coroutine
+    def stream_events(self, channel):
+        """Write events published to ``channel`` until the client goes away
+
+        :type  channel: str
+        :param channel: Name of the channel in ``pubsub``
+        """
+        channel = self.pubsub.get_channel(channel)
+        last_id = self._get_last_event_id(channel)
+        sse = "text/event-stream" in self.request.headers.get("Accept", "")
+        method = getattr(self, self.request.method.lower())
+        output_schema = getattr(method, "output_schema", None)
+        validator = default_registry.get_validator(output_schema) \
+            if output_schema is not None else None
+        # Frames are cached on events by validator and framing
+        frame_key = (id(validator), sse)
+
+        self.set_header("Content-Type", "text/event-stream" if sse
+                        else ndjson.NDJSON_TYPE)
+        self.set_header("Cache-Control", "no-cache")
+        self._stream_closed = False
+        while not self._stream_closed:
+            events = channel.get_events(last_id)
+            for event in events:
+                frame = event.get_frame(
+                    frame_key,
+                    lambda e: self._make_frame(e, validator, sse)
+                )
+                if frame is not None:
+                    self.write(frame)
+            if events:
+                last_id = events[-1].id
+            elif self._headers_written:
+                # Woken up by the heartbeat of the channel; write something
+                #   to find out whether the client is still there
+                self.write(":\n\n" if sse else "\n")
+            try:
+                yield flush(self)
+            except StreamClosedError:
+                break
+            yield channel.wait()
+        if not self._finished:
+            self.finish()
+
+
+if stream_request_body is not None:
+    # Only with tornado 4.0 and later
+    @stream_request_body
+    class NDJSONHandler(APIHandler):
+        """APIHandler that decodes NDJSON bodies line by line as they stream
+        in, for methods decorated with ``schema.validate(ndjson=True)``
+
+        Each line is validated against the ``input_schema`` of the method and
+        passed to ``on_item`` as soon as it arrives, so bodies are never
+        buffered whole; by default, items are collected in ``self.body``.
+        Lines after a malformed or invalid one are skipped, and the request
+        fails once the whole body is in.
+        """
+
+        streams_ndjson = True
+
+        def prepare(self):
+            self.body = []
+            self._buffer = b""
+            self._lineno = 0
+            # Raised once the whole body is in; errors raised while it streams
+            #   in would drop the connection without a response
+            self._item_error = None
+            method = getattr(self, self.request.method.lower(), None)
+            input_schema = getattr(method, "input_schema", None)
+            self._item_validator = default_registry.get_validator(
+                input_schema) if input_schema is not None else None
+            return APIHandler.prepare(self)
+
+        def on_item(self, item):
+            """Handle an item of the body
+
+            Override this to process items as they arrive; returning a Future
+            stops reading the body until it is done.
+            """
+            self.body.append(item)
+
+        @tornado.gen.coroutine
+        def _receive_lines(self, lines):
+            for line in lines:
+                self._lineno += 1
+                if self._item_error is not None or not line.strip():
+                    continue
+                try:
+                    result = self.on_item(ndjson.decode_line(
+                        line, self._item_validator, self._lineno))
+                    if result is not None:
+                        yield result
+                except Exception as e:
+                    self._item_error = e
+
+        def data_received(self, chunk):
+            lines = (self._buffer + chunk).split(b"\n")
+            self._buffer = lines.pop()
+            return self._receive_lines(lines)
+
+        @tornado.gen.coroutine
+        def finish_items(self):
+            """Handle the last line of the body, if it has no trailing newline
+
+            Called by ``schema.validate`` once the whole body is in.
+
+            :raises ValidationError: If a line was malformed or invalid (or
+                whatever ``on_item`` raised)
+            """
+            lines, self._buffer = [self._buffer], b""
+            yield self._receive_lines(lines)
+            if self._item_error is not None:
+                raise self._item_error
@@ -1,15 +1,42 @@
+import os
+import sys
 import pyclbr
 import pkgutil
 import importlib
-import inspect
 from itertools import chain
 from functools import reduce
 
 from tornado_json.constants import HTTP_METHODS
-from tornado_json.utils import extract_method, is_method, is_handler_subclass
+from tornado_json.registry import default_registry
+from tornado_json.utils import get_route_args, is_method, is_handler_subclass
 
 
-def get_routes(package):
+# Patterns for method arguments annotated with these types; values
+#   are converted to the type before being passed to the method
+TYPE_PATTERNS = {
+    int: r'(?P<{}>[0-9]+)',
+    float: r'(?P<{}>[0-9]+(?:\.[0-9]+)?)',
+}
+
+
+def set_route_converters(method, type_patterns=None):
+    """Annotate ``method`` with converters of its arguments annotated
+    with a type in ``type_patterns`` (``TYPE_PATTERNS`` by default), as
+    ``__route_converters__``, so that ``BaseHandler.prepare`` can convert
+    them without introspection
+
+    :returns: ``{name: type}``
+    :rtype: dict
+    """
+    if type_patterns is None:
+        type_patterns = TYPE_PATTERNS
+    method.__route_converters__ = dict(
+        (a, t) for a, t in get_route_args(method) if t in type_patterns
+    )
+    return method.__route_converters__
+
+
+def get_routes(package, build_dir=None):
     """
     This will walk ``package`` and generates routes from any and all
     ``APIHandler`` and ``ViewHandler`` subclasses it finds. If you need to
@@ -19,13 +46,92 @@ def get_routes(package):
     :type  package: package
     :param package: The package containing RequestHandlers to generate
         routes from
+    :type  build_dir: str
+    :param build_dir: Directory that ``python -m tornado_json.build`` wrote
+        the manifest of ``package`` to. If the manifest is up to date with
+        the sources of ``package``, routes are loaded from it instead.
     :returns: List of routes for all submodules of ``package``
     :rtype: [(url, RequestHandler), ... ]
     """
+    if build_dir is not None:
+        from tornado_json.build import load_routes
+        routes = load_routes(package, build_dir)
+        if routes is not None:
+            return routes
     return list(chain(*[get_module_routes(modname) for modname in
                         gen_submodule_names(package)]))
 
 
+try:
+    from importlib import reload
+except ImportError:
+    # PY2
+    pass
+
+
+class RouteCache(object):
+    """Generates routes for ``package`` like ``get_routes``, except that
+    routes of each submodule are cached along with the mtime of its
+    source; later calls to ``get_routes`` only reload and regenerate
+    routes for submodules that were added or changed since. Schemas that
+    reloaded submodules register again with changes replace those
+    registered before (see ``SchemaRegistry.replacing``).
+
+    :type  package: package
+    :param package: The package containing RequestHandlers to generate
+        routes from
+    :param route_kwargs: Keyword arguments for ``get_module_routes``
+    """
+
+    def __init__(self, package, **route_kwargs):
+        self.package = package
+        self.route_kwargs = route_kwargs
+        # {modname: (mtime, routes)}
+        self._modules = {}
+        #: Names of submodules whose routes were (re)generated by the
+        #:  last call to ``get_routes``
+        self.changed = []
+
+    def _get_mtime(self, modname):
+        path = getattr(sys.modules[modname], "__file__", None)
+        if not path:
+            return None
+        if path.endswith((".pyc", ".pyo")) and os.path.exists(path[:-1]):
+            path = path[:-1]
+        return os.path.getmtime(path)
+
+    def get_routes(self):
+        """
+        :returns: List of routes for all submodules of ``package``
+        :rtype: [(url, RequestHandler), ... ]
+        """
+        if hasattr(importlib, "invalidate_caches"):
+            # So that new submodules are found
+            importlib.invalidate_caches()
+
+        modules = {}
+        modnames = list(gen_submodule_names(self.package))
+        self.changed = []
+        for modname in modnames:
+            cached = self._modules.get(modname)
+            if cached is not None:
+                mtime = self._get_mtime(modname)
+                if mtime == cached[0]:
+                    modules[modname] = cached
+                    continue
+                # Its schemas may have changed, too
+                with default_registry.replacing():
+                    reload(sys.modules[modname])
+                # pyclbr caches what it reads from each module
+                pyclbr._modules.pop(modname, None)
+            routes = get_module_routes(modname, **self.route_kwargs)
+            modules[modname] = (self._get_mtime(modname), routes)
+            self.changed.append(modname)
+
+        self._modules = modules
+        return list(chain(*[modules[m][1] for m in modnames]))
+
+
 def gen_submodule_names(package):
     """Walk package and yield names of all submodules
 
@@ -42,7 +148,8 @@ def gen_submodule_names(package):
 
 
 def get_module_routes(module_name, custom_routes=None, exclusions=None,
-                      arg_pattern=r'(?P<{}>[a-zA-Z0-9_\-]+)'):
+                      arg_pattern=r'(?P<{}>[a-zA-Z0-9_\-]+)',
+                      type_patterns=None):
     """Create and return routes for module_name
 
     Routes are (url, RequestHandler) tuples
@@ -61,6 +168,10 @@ def get_module_routes(module_name, custom_routes=None, exclusions=None,
         argument. The aforementioned regex will match ONLY values
         with alphanumeric, hyphen and underscore characters. You can provide
         your own pattern by setting a ``arg_pattern`` param.
+        Arguments annotated with a type in ``TYPE_PATTERNS`` (or
+        ``type_patterns``) get that type's pattern instead, e.g.,
+        ``def get(self, year: int)`` matches ``(?P<year>[0-9]+)``, and
+        are converted to that type before being passed to the method.
     :rtype: [(url, RequestHandler), ... ]
     :type  module_name: str
     :param module_name: Name of the module to get routes for
@@ -72,6 +183,9 @@ def get_module_routes(module_name, custom_routes=None, exclusions=None,
         generated for
     :type  arg_pattern: str
     :param arg_pattern: Default pattern for extra arguments of any method
+    :type  type_patterns: {type: str}
+    :param type_patterns: Patterns for annotated arguments, in addition to
+        (or overriding) ``TYPE_PATTERNS``
     """
     def has_method(module, cls_name, method_name):
         return all([
@@ -79,24 +193,25 @@ def get_module_routes(module_name, custom_routes=None, exclusions=None,
             is_method(reduce(getattr, [module, cls_name, method_name]))
         ])
 
+    type_patterns = dict(TYPE_PATTERNS, **(type_patterns or {}))
+
     def yield_args(module, cls_name, method_name):
         """Get signature of ``module.cls_name.method_name``
 
         Confession: This function doesn't actually ``yield`` the arguments,
             just returns a list. Trust me, it's better that way.
 
-        :returns: List of arg names from method_name except ``self``
+        The signature is computed once and cached on the method (see
+        ``utils.get_route_args``), and so are converters for annotated
+        arguments (see ``set_route_converters``).
+
+        :returns: List of ``(name, annotation)`` from method_name
+            except ``self``
         :rtype: list
         """
-        wrapped_method = reduce(getattr, [module, cls_name, method_name])
-        method = extract_method(wrapped_method)
-
-        # If using tornado_json.gen.coroutine, original args are annotated...
-        argspec_args = getattr(method, "__argspec_args",
-                               # otherwise just grab them from the method
-                               inspect.getargspec(method).args)
-
-        return [a for a in argspec_args if a not in ["self"]]
+        method = vars(getattr(module, cls_name))[method_name]
+        set_route_converters(method, type_patterns)
+        return get_route_args(method)
 
     def generate_auto_route(module, module_name, cls_name, method_name, url_name):
         """Generate URL for auto_route
@@ -128,10 +243,11 @@ def get_module_routes(module_name, custom_routes=None, exclusions=None,
                 If there are no arguments given, returns ``""``.
             :rtype: str
             """
-            if yield_args(module, cls_name, method_name):
+            route_args = yield_args(module, cls_name, method_name)
+            if route_args:
                 return "/{}/?$".format("/".join(
-                    [arg_pattern.format(argname) for argname
-                     in yield_args(module, cls_name, method_name)]
+                    [type_patterns.get(annotation, arg_pattern).format(argname)
+                     for argname, annotation in route_args]
                 ))
             return r"/?"
 
@@ -3,29 +3,485 @@ from functools import wraps
 
 import jsonschema
 import tornado.gen
+from tornado.ioloop import IOLoop
 
-from tornado_json.exceptions import APIError
+try:
+    from collections.abc import MutableMapping  # py3
+except ImportError:
+    from collections import MutableMapping  # py2
+
+from tornado_json import metrics
+from tornado_json import ndjson as ndjson_
+from tornado_json.exceptions import APIError, DeadlineExceeded
 
 try:
-    from tornado.concurrent import is_future
+    from tornado.gen import convert_yielded
 except ImportError:
-    # For tornado 3.x.x
-    from tornado.concurrent import Future
-    is_future = lambda x: isinstance(x, Future)
+    # For tornado<4.3; ``specialize`` falls back to gen.coroutine
+    convert_yielded = None
+
+from tornado_json.bulk import Bulk
+from tornado_json.datasets import RawJSON
+from tornado_json.gen import is_coroutine_function, is_future, then
+from tornado_json.pagination import Pagination
+from tornado_json.projection import Projection
+from tornado_json.registry import default_registry
+from tornado_json.utils import container, get_route_args
+from tornado_json.validation import (ErrorCollector, default_coercion,
+                                     type_coercion)
+
+
+_UNDECODED = object()
+# Projections cached per decorated method
+_MAX_PROJECTIONS = 256
+
+
+class LazyBody(MutableMapping):
+    """Mapping of a decoded request body whose values are validated
+    against their ``properties`` sub-schema the first time they are read
+
+    Reading a value that does not validate raises a
+    ``jsonschema.ValidationError``, exactly as eager validation would.
+    Every way of reading values (including ``dict(body)``, ``**body``,
+    ``copy``, ``items`` and ``==``) goes through ``__getitem__``; values
+    set by the handler are not validated. It is not a ``dict``, so use
+    ``copy()`` to get a (fully validated) one, e.g., to return it.
+    """
+
+    def __init__(self, input_, validators):
+        self._data = dict(input_)
+        # Validators of keys which are present but not yet validated
+        self._pending = dict(
+            (k, v) for k, v in validators.items() if k in input_
+        )
+
+    def __getitem__(self, key):
+        value = self._data[key]
+        validator = self._pending.pop(key, None)
+        if validator is not None:
+            validator.validate(value)
+        return value
 
-from tornado_json.utils import container
+    def __setitem__(self, key, value):
+        self._pending.pop(key, None)
+        self._data[key] = value
+
+    def __delitem__(self, key):
+        self._pending.pop(key, None)
+        del self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __repr__(self):
+        return "LazyBody({!r})".format(self._data)
+
+    def validate_all(self):
+        """Validate any values that have not been read yet"""
+        for key in list(self._pending):
+            self[key]
+
+    def copy(self):
+        """:returns: A ``dict`` of the values, all validated"""
+        self.validate_all()
+        return dict(self._data)
+
+
+def _shallow_schema(schema):
+    """Return a copy of ``schema`` with its ``properties`` sub-schemas
+    replaced by ``{}``; everything else (``type``, ``required``,
+    ``additionalProperties``, etc.) is still checked
+
+    :rtype: dict
+    """
+    shallow = dict(schema)
+    shallow["properties"] = dict((k, {}) for k in schema["properties"])
+    return shallow
+
+
+def _etag_matches(if_none_match, etag):
+    """Determine whether ``etag`` matches the ``If-None-Match`` header
+
+    :type  if_none_match: str
+    :type  etag: str
+    :rtype: bool
+    """
+    if if_none_match.strip() == "*":
+        return True
+    strip_weak = lambda e: e[2:] if e.startswith("W/") else e
+    return strip_weak(etag) in (
+        strip_weak(e.strip()) for e in if_none_match.split(",")
+    )
+
+
+def _not_modified(self, etag, args, kwargs):
+    """Set the ``Etag`` header to the version ``etag(self, *args, **kwargs)``
+    and, if the client has it already, send back a 304
+
+    :returns: Whether a 304 was sent
+    :rtype: bool
+    """
+    if self.request.method not in ("GET", "HEAD"):
+        return False
+    version = etag(self, *args, **kwargs)
+    if version is None:
+        return False
+    version = str(version)
+    if not version.startswith(('"', 'W/"')):
+        version = '"{}"'.format(version)
+    # With the header set, Tornado also does not hash the response body
+    #   to compute one
+    self.set_header("Etag", version)
+    if_none_match = self.request.headers.get("If-None-Match")
+    if if_none_match and _etag_matches(if_none_match, version):
+        self.set_status(304)
+        self.finish()
+        return True
+    return False
+
+
+def _get_deadline(self, timeout):
+    """Get the deadline of the request, ``timeout`` seconds from now or the
+    budget (in seconds) in its ``X-Request-Deadline`` header, whichever is
+    earlier, and set it as ``self.deadline``
+
+    :returns: ``IOLoop`` time of the deadline, or ``None`` if there is none
+    :raises DeadlineExceeded: If there is no time left already
+    """
+    budget = self.request.headers.get("X-Request-Deadline")
+    if budget is not None:
+        try:
+            budget = float(budget)
+        except ValueError:
+            raise APIError(400, "Invalid X-Request-Deadline.")
+        timeout = budget if timeout is None else min(timeout, budget)
+    if timeout is None:
+        return None
+    if timeout <= 0:
+        metrics.incr(self, "deadline_exceeded")
+        raise DeadlineExceeded()
+    self.deadline = IOLoop.current().time() + timeout
+    return self.deadline
+
+
+@tornado.gen.coroutine
+def _with_deadline(self, future, deadline):
+    """Wait for ``future`` until ``deadline``
+
+    Past the deadline, the method that returned ``future`` keeps running
+    (there is no cancelling a coroutine) but its output is dropped.
+
+    :raises DeadlineExceeded: If ``future`` is not done by ``deadline``
+    """
+    try:
+        output = yield tornado.gen.with_timeout(deadline, future)
+    except tornado.gen.TimeoutError:
+        metrics.incr(self, "deadline_exceeded")
+        raise DeadlineExceeded()
+    raise tornado.gen.Return(output)
+
+
+def _check_output(validator, output):
+    """Validate ``output`` with ``validator``
+
+    :raises TypeError: If ``output`` is invalid
+    """
+    try:
+        validator.validate(output)
+    except jsonschema.ValidationError as e:
+        # We essentially re-raise this as a TypeError because
+        #  we don't want this error data passed back to the client
+        #  because it's a fault on our end. The client should
+        #  only see a 500 - Internal Server Error.
+        raise TypeError(str(e))
 
 
 def validate(input_schema=None, output_schema=None,
              input_example=None, output_example=None,
-             format_checker=None, on_empty_404=False):
+             format_checker=None, on_empty_404=False, lazy=False,
+             specialize=False, etag=None, timeout=None, paginate=None,
+             fields=False, bulk=None, ndjson=False, all_errors=None,
+             coerce=None, query_schema=None, path_schema=None):
     """Parameterized decorator for schema validation
 
+    Methods may also return a ``datasets.RawJSON``, which is written back
+    as it is, without being validated or projected.
+
     :type format_checker: jsonschema.FormatChecker or None
     :type on_empty_404: bool
     :param on_empty_404: If this is set, and the result from the
         decorated method is a falsy value, a 404 will be raised.
+    :type lazy: bool
+    :param lazy: If this is set and ``input_schema`` describes an object
+        with ``properties``, only the top level of the input is validated
+        up front; ``self.body`` is then a ``LazyBody`` that validates
+        each property the first time the handler reads it.
+    :type specialize: bool
+    :param specialize: If this is set, the wrapper is built for the kind
+        of method being decorated instead of always being a
+        ``tornado.gen.coroutine``: synchronous methods are called and
+        written back directly (no Future is allocated), and coroutines
+        (native ``async def`` or ``tornado_json.gen.coroutine``) have
+        their Future chained to the output validation rather than being
+        driven by another generator. Requires ``tornado>=4.3``.
+    :type etag: callable
+    :param etag: For GET and HEAD requests, called as
+        ``etag(self, *args, **kwargs)`` before the decorated method to
+        cheaply get the current version of the resource (e.g., a row
+        version); the result, unless it is ``None``, is sent as the
+        ``Etag``. If it matches the ``If-None-Match`` of the request, a
+        304 is sent back without calling the method or validating and
+        serializing output.
+    :type timeout: float
+    :param timeout: Seconds the method has to produce its output; a
+        shorter budget may be given by clients in the
+        ``X-Request-Deadline`` header. The deadline is set as
+        ``self.deadline`` (see ``BaseHandler.get_remaining_time``) and, if
+        the method returns a Future that is not done by then, a 504 is
+        sent back. Requires ``tornado>=4``.
+    :type paginate: bool or pagination.Pagination
+    :param paginate: If this is set (``True`` for the defaults of
+        ``Pagination``), the method is asked for one page of its output
+        at a time and only that page is validated against
+        ``output_schema``; see ``tornado_json.pagination``. The
+        ``output_schema`` (and ``output_example``) documented for the
+        method is that of the paginated response.
+    :type fields: bool
+    :param fields: If this is set, requests can ask for only some fields
+        of the output with the ``fields`` argument, e.g.,
+        ``?fields=make,engine.power``; the rest is pruned before the
+        output is validated (against the sub-schema of ``output_schema``
+        for those fields) and written back. See
+        ``tornado_json.projection``.
+    :type bulk: bool or bulk.Bulk
+    :param bulk: If this is set (``True`` for the defaults of ``Bulk``),
+        ``input_schema`` describes one item of a body of many (a JSON
+        array or NDJSON), and ``output_schema`` the result of one item;
+        valid items are passed to the method in batches and every item
+        gets its own result. See ``tornado_json.bulk``; of the other
+        options, only ``timeout`` applies in bulk mode.
+    :type ndjson: bool
+    :param ndjson: If this is set, the body is NDJSON, one item per line,
+        each validated against ``input_schema`` (decoded as it streams in
+        with an ``NDJSONHandler``), and the method returns an iterable
+        (e.g., a generator) of items, each validated against
+        ``output_schema`` and written back as a line of NDJSON, with
+        periodic flushes. See ``tornado_json.ndjson``; of the other
+        options, only ``timeout`` applies in NDJSON mode.
+    :type all_errors: bool or validation.ErrorCollector
+    :param all_errors: If this is set (``True`` for the defaults of
+        ``ErrorCollector``), invalid input gets a 400 with all the errors
+        found (up to a cap and a time budget), keyed by JSON pointer,
+        rather than just the first. See ``tornado_json.validation``; it
+        does not apply to the items of bulk or NDJSON bodies, nor to the
+        properties of a ``LazyBody``.
+    :type coerce: bool or validation.Coercion
+    :param coerce: If this is set (``True`` for the defaults of
+        ``Coercion``), the input is coerced in the same pass that
+        validates it: missing properties get their ``default`` and
+        values are converted by ``format`` (e.g., ``date-time`` to
+        ``datetime``). See ``tornado_json.validation``; it does not apply
+        with ``lazy``.
+    :type query_schema: dict
+    :param query_schema: Schema of an object of the query arguments of
+        the request (the last value of each, or all of them for arguments
+        of ``"type": "array"``). They are validated before anything else
+        is done with the request, once converted to the ``type`` of their
+        schemas (``integer``, ``number`` or ``boolean``) and with their
+        ``default``s (see ``validation.Coercion``), and set as
+        ``self.query``. Arguments of ``paginate`` and ``fields`` are left
+        out.
+    :type path_schema: dict
+    :param path_schema: Schema of an object of the URL arguments of the
+        method (see ``routes.get_module_routes``), validated and coerced
+        as with ``query_schema`` and passed on to the method.
     """
+    if paginate is True:
+        paginate = Pagination()
+    if bulk is True:
+        bulk = Bulk()
+    if all_errors is True:
+        all_errors = ErrorCollector()
+    if coerce is True:
+        # Shared, so is the validator of the same schema in the registry
+        coerce = default_coercion
+    lazy = lazy and bulk is None and input_schema is not None and \
+        "properties" in input_schema
+    if lazy:
+        coerce = None
+    # Validators are compiled once here (and shared through the schema
+    #   registry with any other handler using the same schemas) rather
+    #   than on every request
+    input_validator = output_validator = None
+    if input_schema is not None:
+        input_validator = default_registry.get_validator(
+            _shallow_schema(input_schema) if lazy else input_schema,
+            format_checker=format_checker,
+            referrer=input_schema,
+            coerce=coerce or None
+        )
+    if lazy:
+        property_validators = dict(
+            (k, default_registry.get_validator(
+                v, format_checker=format_checker, referrer=input_schema))
+            for k, v in input_schema["properties"].items()
+        )
+    if output_schema is not None:
+        output_validator = default_registry.get_validator(output_schema)
+    # Arguments are strings, so they are coerced to the types of their
+    #   schemas
+    path_validator = query_validator = None
+    if path_schema is not None:
+        path_validator = default_registry.get_validator(
+            path_schema, format_checker=format_checker,
+            coerce=type_coercion)
+    if query_schema is not None:
+        query_validator = default_registry.get_validator(
+            query_schema, format_checker=format_checker,
+            coerce=type_coercion)
+        query_properties = query_schema.get("properties", {})
+    # Query arguments taken by the options of the wrapper rather than the
+    #   method, which ``query_schema`` does not describe
+    own_args = set(paginate.arg_names) if paginate is not None else set()
+    if fields:
+        own_args.add("fields")
+    # Projections by requested ``fields``
+    projections = {}
+
+    def _check_input(validator, input_):
+        """Validate ``input_``, reporting all errors if ``all_errors``"""
+        if all_errors:
+            all_errors.validate(validator, input_)
+        else:
+            validator.validate(input_)
+
+    def _load_args(self, kwargs):
+        """Validate and coerce the URL arguments of the request, in
+        ``kwargs`` for the method, and its query arguments, which are set
+        as ``self.query``"""
+        if path_validator is not None:
+            path_args = dict(kwargs)
+            _check_input(path_validator, path_args)
+            kwargs.update(path_args)
+        if query_validator is not None:
+            query = {}
+            # For tornado<3.2, ``arguments`` are those of the query (and of
+            #   form-encoded bodies)
+            arguments = getattr(self.request, "query_arguments",
+                                self.request.arguments)
+            get_values = getattr(self, "get_query_arguments",
+                                 self.get_arguments)
+            for name in arguments:
+                if name in own_args:
+                    continue
+                values = get_values(name)
+                # Only arguments that are arrays may be repeated
+                schema = query_properties.get(name, {})
+                query[name] = values if schema.get("type") == "array" \
+                    else values[-1]
+            _check_input(query_validator, query)
+            self.query = query
+
+    def _load_input(self):
+        """Decode and validate the request body and set it as ``self.body``
+        """
+        # In case the specified input_schema is ``None``, we
+        #   don't json.loads the input, but just set it to ``None``
+        #   instead.
+        if input_schema is not None:
+            # Input decoded along with its envelope, e.g., of a WebSocket
+            #   message, is not decoded again
+            input_ = getattr(self.request, "decoded_body", _UNDECODED)
+            if input_ is _UNDECODED:
+                # Attempt to json.loads the input
+                try:
+                    # TODO: Assuming UTF-8 encoding for all requests,
+                    #   find a nice way of determining this from charset
+                    #   in headers if provided
+                    encoding = "UTF-8"
+                    input_ = json.loads(self.request.body.decode(encoding))
+                except ValueError as e:
+                    raise jsonschema.ValidationError(
+                        "Input is malformed; could not decode JSON object."
+                    )
+            # Validate the received input
+            _check_input(input_validator, input_)
+            if lazy and isinstance(input_, dict):
+                input_ = LazyBody(input_, property_validators)
+        else:
+            input_ = None
+
+        # A json.loads'd version of self.request["body"] is now available
+        #   as self.body
+        setattr(self, "body", input_)
+
+    def _get_page_args(self, kwargs):
+        """Add the arguments of the requested page, if paginating, to
+        ``kwargs`` for the method
+
+        :returns: The arguments of the page, or ``None``
+        """
+        if paginate is None:
+            return None
+        page_args = paginate.get_page_args(self)
+        kwargs.update(page_args)
+        return page_args
+
+    def _get_projection(self):
+        """Get the ``Projection`` for the ``fields`` argument of the
+        request, if there is one"""
+        requested = self.get_argument("fields", None)
+        if not requested:
+            return None
+        projection = projections.get(requested)
+        if projection is None:
+            if len(projections) >= _MAX_PROJECTIONS:
+                projections.clear()
+            projection = projections[requested] = Projection(
+                requested, output_schema)
+        return projection
+
+    def _write_output(self, output, page_args=None):
+        """Validate ``output`` (the page of it, if paginating) and write it
+        back"""
+        # The method may have written back a response of its own, e.g., a
+        #   stream of events
+        if getattr(self, "_finished", False):
+            return
+        if isinstance(output, RawJSON):
+            # Validated when its dataset was loaded
+            self.success_raw(output.data)
+            return
+        if page_args is not None:
+            output, next_cursor = paginate.split_output(output)
+
+        # if output is empty, auto return the error 404.
+        if not output and on_empty_404:
+            raise APIError(404, "Resource not found.")
+
+        projection = _get_projection(self) if fields else None
+        if projection is not None and projection.validator is not None:
+            # Only what is left of the output is validated
+            output = projection(output)
+            _check_output(projection.validator, output)
+        else:
+            if output_schema is not None:
+                _check_output(output_validator, output)
+            if projection is not None:
+                output = projection(output)
+
+        # If no ValidationError has been raised up until here, we write
+        #  back output
+        if page_args is not None:
+            output = paginate.wrap(self, page_args, output, next_cursor)
+        self.success(output)
+
     @container
     def _validate(rh_method):
         """Decorator for RequestHandler schema validation
@@ -47,76 +503,126 @@ def validate(input_schema=None, output_schema=None,
         :raises APIError: If the output is a falsy value and
             on_empty_404 is True, an HTTP 404 error is returned
         """
-        @wraps(rh_method)
-        @tornado.gen.coroutine
-        def _wrapper(self, *args, **kwargs):
-            # In case the specified input_schema is ``None``, we
-            #   don't json.loads the input, but just set it to ``None``
-            #   instead.
-            if input_schema is not None:
-                # Attempt to json.loads the input
-                try:
-                    # TODO: Assuming UTF-8 encoding for all requests,
-                    #   find a nice way of determining this from charset
-                    #   in headers if provided
-                    encoding = "UTF-8"
-                    input_ = json.loads(self.request.body.decode(encoding))
-                except ValueError as e:
-                    raise jsonschema.ValidationError(
-                        "Input is malformed; could not decode JSON object."
-                    )
-                # Validate the received input
-                jsonschema.validate(
-                    input_,
-                    input_schema,
-                    format_checker=format_checker
-                )
-            else:
-                input_ = None
-
-            # A json.loads'd version of self.request["body"] is now available
-            #   as self.body
-            setattr(self, "body", input_)
-            # Call the requesthandler method
-            output = rh_method(self, *args, **kwargs)
-            # If the rh_method returned a Future a la `raise Return(value)`
-            #   we grab the output.
-            if is_future(output):
+        if ndjson:
+            @wraps(rh_method)
+            @tornado.gen.coroutine
+            def _wrapper(self, *args, **kwargs):
+                _load_args(self, kwargs)
+                deadline = _get_deadline(self, timeout)
+                if getattr(self, "streams_ndjson", False):
+                    # Only the last line can still be left
+                    yield self.finish_items()
+                elif input_schema is not None:
+                    self.body = ndjson_.decode(self.request.body,
+                                               input_validator)
+                else:
+                    self.body = None
+                output = rh_method(self, *args, **kwargs)
+                if is_future(output):
+                    if deadline is not None:
+                        output = _with_deadline(self, output, deadline)
+                    output = yield output
+                yield ndjson_.write_lines(self, output or (),
+                                          output_validator)
+        elif bulk is not None:
+            @wraps(rh_method)
+            @tornado.gen.coroutine
+            def _wrapper(self, *args, **kwargs):
+                _load_args(self, kwargs)
+                deadline = _get_deadline(self, timeout)
+                output = bulk.run(self, rh_method, args, kwargs,
+                                  input_validator, output_validator)
+                if deadline is not None:
+                    output = _with_deadline(self, output, deadline)
                 output = yield output
-
-            # if output is empty, auto return the error 404.
-            if not output and on_empty_404:
-                raise APIError(404, "Resource not found.")
-
-            if output_schema is not None:
-                # We wrap output in an object before validating in case
-                #  output is a string (and ergo not a validatable JSON object)
-                try:
-                    jsonschema.validate(
-                        {"result": output},
-                        {
-                            "type": "object",
-                            "properties": {
-                                "result": output_schema
-                            },
-                            "required": ["result"]
-                        }
+                self.success(output)
+        elif specialize and convert_yielded is not None:
+            if is_coroutine_function(rh_method):
+                @wraps(rh_method)
+                def _wrapper(self, *args, **kwargs):
+                    _load_args(self, kwargs)
+                    if etag is not None and \
+                            _not_modified(self, etag, args, kwargs):
+                        return
+                    deadline = _get_deadline(self, timeout)
+                    _load_input(self)
+                    page_args = _get_page_args(self, kwargs)
+                    output = convert_yielded(rh_method(self, *args, **kwargs))
+                    if deadline is not None:
+                        output = _with_deadline(self, output, deadline)
+                    return then(
+                        output,
+                        lambda output: _write_output(self, output, page_args)
                     )
-                except jsonschema.ValidationError as e:
-                    # We essentially re-raise this as a TypeError because
-                    #  we don't want this error data passed back to the client
-                    #  because it's a fault on our end. The client should
-                    #  only see a 500 - Internal Server Error.
-                    raise TypeError(str(e))
-
-            # If no ValidationError has been raised up until here, we write
-            #  back output
-            self.success(output)
+            else:
+                @wraps(rh_method)
+                def _wrapper(self, *args, **kwargs):
+                    _load_args(self, kwargs)
+                    if etag is not None and \
+                            _not_modified(self, etag, args, kwargs):
+                        return
+                    deadline = _get_deadline(self, timeout)
+                    _load_input(self)
+                    page_args = _get_page_args(self, kwargs)
+                    output = rh_method(self, *args, **kwargs)
+                    # The method may still return a Future, e.g., if it
+                    #   just passes one on from another call
+                    if is_future(output):
+                        if deadline is not None:
+                            output = _with_deadline(self, output, deadline)
+                        return then(
+                            output,
+                            lambda output: _write_output(
+                                self, output, page_args)
+                        )
+                    _write_output(self, output, page_args)
+        else:
+            @wraps(rh_method)
+            @tornado.gen.coroutine
+            def _wrapper(self, *args, **kwargs):
+                _load_args(self, kwargs)
+                if etag is not None and \
+                        _not_modified(self, etag, args, kwargs):
+                    return
+                deadline = _get_deadline(self, timeout)
+                _load_input(self)
+                page_args = _get_page_args(self, kwargs)
+                # Call the requesthandler method
+                output = rh_method(self, *args, **kwargs)
+                # If the rh_method returned a Future a la
+                #   `raise Return(value)` we grab the output.
+                if is_future(output):
+                    if deadline is not None:
+                        output = _with_deadline(self, output, deadline)
+                    output = yield output
+                _write_output(self, output, page_args)
 
         setattr(_wrapper, "input_schema", input_schema)
         setattr(_wrapper, "output_schema", output_schema)
         setattr(_wrapper, "input_example", input_example)
         setattr(_wrapper, "output_example", output_example)
+        setattr(_wrapper, "query_schema", query_schema)
+        setattr(_wrapper, "path_schema", path_schema)
+        setattr(_wrapper, "pagination", paginate)
+        if bulk is not None:
+            setattr(_wrapper, "input_schema",
+                    bulk.get_input_schema(input_schema))
+            setattr(_wrapper, "output_schema",
+                    bulk.get_output_schema(output_schema))
+            setattr(_wrapper, "input_example",
+                    bulk.get_input_example(input_example))
+            setattr(_wrapper, "output_example",
+                    bulk.get_output_example(output_example))
+        if paginate is not None:
+            setattr(_wrapper, "output_schema",
+                    paginate.get_output_schema(output_schema))
+            setattr(_wrapper, "output_example",
+                    paginate.get_output_example(output_example))
+            # Page arguments are not captured from the URL
+            setattr(_wrapper, "__route_args__", [
+                (a, t) for a, t in get_route_args(rh_method)
+                if a not in paginate.arg_names
+            ])
 
         return _wrapper
     return _validate
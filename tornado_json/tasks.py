@@ -0,0 +1,196 @@
+"""Background tasks, for side effects that responses need not wait for
+
+Tasks (e.g., audit logging or notifications) are put in a bounded
+in-process queue and run by worker coroutines, or in the thread pool of
+an ``executor`` if they are plain functions, so that the response does
+not wait for them::
+
+    app = Application(routes, settings,
+                      tasks=TaskQueue(executor=ThreadPoolExecutor(4)))
+
+    class CarHandler(APIHandler):
+
+        @schema.validate(input_schema=CAR_SCHEMA)
+        def put(self, make):
+            self.tasks.check()
+            self.db_conn.put_car(make, self.body)
+            self.tasks.enqueue(audit_log, "put", make)
+
+Tasks start as soon as a worker is free, which may be before the
+response has been written. Without an ``executor``, plain functions run
+on the ``IOLoop`` and block it (and every request) while they run, so
+give one unless tasks are coroutines or trivial.
+
+Failed tasks are retried with exponential backoff. When the queue is
+full, ``enqueue`` raises ``Overloaded``, so that clients back off rather
+than the queue growing without bound. Raised after the side effects of a
+request, that 503 would have clients retry (and repeat) them, so handlers
+call ``check`` (or test ``full``) first, as above: the request is then
+rejected before anything is done. With no ``yield`` between ``check`` and
+``enqueue``, the queue cannot fill in between; across one, other
+requests may fill it, and ``enqueue`` raises after all. Counters
+(``tasks_enqueued``, ``tasks_rejected``, ``tasks_done``, ``tasks_retried``,
+``tasks_failed``) are kept in the ``Metrics`` of the application, and
+``get_stats`` has the depth of the queue. ``Application.shutdown`` drains
+the queue.
+
+This module needs Tornado 4.2 or later, for ``tornado.queues``.
+"""
+from datetime import timedelta
+
+import tornado.gen
+from tornado.ioloop import IOLoop
+from tornado.log import app_log
+from tornado.queues import Queue
+
+from tornado_json.exceptions import Overloaded
+from tornado_json.gen import is_coroutine_function, is_future
+
+
+class TaskQueue(object):
+    """Bounded queue of background tasks
+
+    Workers are started on the current ``IOLoop`` with the first task.
+
+    :type  workers: int
+    :param workers: Tasks run at once
+    :type  max_size: int
+    :param max_size: Tasks queued at most, besides those running
+    :type  retries: int
+    :param retries: Times a failed task is retried
+    :type  retry_delay: float
+    :param retry_delay: Seconds before the first retry, doubled for each
+        one after it
+    :type  executor: concurrent.futures.Executor
+    :param executor: Executor (e.g., a ``ThreadPoolExecutor``) to run
+        tasks that are not coroutine functions in; they are run on the
+        ``IOLoop``, blocking it, if it is not given
+    :type  retry_after: int
+    :param retry_after: ``Retry-After`` of requests rejected when the queue
+        is full
+    :ivar metrics: ``Metrics`` to count tasks in; set by ``Application``
+    """
+
+    def __init__(self, workers=4, max_size=1000, retries=3,
+                 retry_delay=0.5, executor=None, retry_after=1):
+        self.workers = workers
+        self.max_size = max_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.executor = executor
+        self.retry_after = retry_after
+        self.metrics = None
+        self.running = 0
+        # Most tasks ever queued at once
+        self.max_queued = 0
+        self._queue = None
+        self._closed = False
+
+    def _count(self, name):
+        if self.metrics is not None:
+            self.metrics.incr(name)
+
+    def _start(self):
+        self._queue = Queue(maxsize=self.max_size)
+        for _ in range(self.workers):
+            IOLoop.current().spawn_callback(self._work)
+
+    def full(self):
+        """Whether a task enqueued now would be rejected, because the queue
+        is full or draining
+
+        :rtype: bool
+        """
+        return self._closed or \
+            (self._queue is not None and self._queue.full())
+
+    def check(self):
+        """Make sure that a task can be enqueued now; call this before the
+        side effects of a request that enqueues tasks after them
+
+        :raises Overloaded: If the queue is full or draining
+        """
+        if self.full():
+            self._count("tasks_rejected")
+            raise Overloaded(
+                self.retry_after,
+                "Shutting down." if self._closed else "Task queue is full.")
+
+    def enqueue(self, func, *args, **kwargs):
+        """Run ``func(*args, **kwargs)`` in the background
+
+        :raises Overloaded: If the queue is full or draining (see ``check``)
+        """
+        self.check()
+        if self._queue is None:
+            self._start()
+        self._queue.put_nowait((func, args, kwargs))
+        self._count("tasks_enqueued")
+        self.max_queued = max(self.max_queued, self._queue.qsize())
+
+    @tornado.gen.coroutine
+    def _work(self):
+        while True:
+            task = yield self._queue.get()
+            try:
+                if task is None:
+                    return
+                self.running += 1
+                yield self._run(*task)
+            finally:
+                if task is not None:
+                    self.running -= 1
+                self._queue.task_done()
+
+    @tornado.gen.coroutine
+    def _run(self, func, args, kwargs):
+        for attempt in range(self.retries + 1):
+            try:
+                if self.executor is not None and \
+                        not is_coroutine_function(func):
+                    yield self.executor.submit(func, *args, **kwargs)
+                else:
+                    result = func(*args, **kwargs)
+                    if is_future(result):
+                        yield result
+            except Exception:
+                if attempt == self.retries:
+                    app_log.error("Background task %r failed", func,
+                                  exc_info=True)
+                    self._count("tasks_failed")
+                    return
+                self._count("tasks_retried")
+                yield tornado.gen.sleep(self.retry_delay * 2 ** attempt)
+            else:
+                self._count("tasks_done")
+                return
+
+    @tornado.gen.coroutine
+    def drain(self, timeout=None):
+        """Stop taking tasks, and wait for those queued to be done (or for
+        ``timeout`` seconds)
+
+        :returns: Whether all tasks were done
+        :rtype: bool
+        """
+        self._closed = True
+        if self._queue is None:
+            raise tornado.gen.Return(True)
+        try:
+            yield self._queue.join(
+                None if timeout is None else timedelta(seconds=timeout))
+        except tornado.gen.TimeoutError:
+            raise tornado.gen.Return(False)
+        # Stop the workers
+        for _ in range(self.workers):
+            yield self._queue.put(None)
+        raise tornado.gen.Return(True)
+
+    def get_stats(self):
+        """:rtype: dict"""
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": self.running,
+            "max_size": self.max_size,
+            "max_queued": self.max_queued,
+        }
@@ -1,5 +1,6 @@
 import types
 import pyclbr
+import inspect
 from functools import wraps
 
 
@@ -32,6 +33,47 @@ def extract_method(wrapped_method):
         hasattr(wrapped_method, "orig_func") else wrapped_method
 
 
+def get_route_args(method):
+    """Get the arguments of ``method`` (except ``self``) that should be
+    captured from its URL, as ``(name, annotation)`` pairs
+
+    The result is computed once and cached on ``method`` as
+    ``__route_args__``. Keyword-only arguments are included; ``*args``
+    and ``**kwargs`` are not. ``annotation`` is ``None`` for arguments
+    without one.
+
+    :rtype: [(str, object), ...]
+    """
+    route_args = getattr(method, "__route_args__", None)
+    if route_args is not None:
+        return route_args
+
+    func = extract_method(method)
+    if hasattr(inspect, "signature"):
+        # Follows __wrapped__, i.e., through tornado.gen.coroutine
+        params = inspect.signature(func).parameters.values()
+        route_args = [
+            (p.name, None if p.annotation is p.empty else p.annotation)
+            for p in params
+            if p.kind in (p.POSITIONAL_OR_KEYWORD, p.KEYWORD_ONLY)
+        ]
+    else:
+        # If using tornado_json.gen.coroutine, original args are
+        #   annotated, otherwise just grab them from the method
+        args = getattr(func, "__argspec_args", None) or \
+            inspect.getargspec(func).args
+        annotations = getattr(func, "__annotations__", {})
+        route_args = [(a, annotations.get(a)) for a in args]
+    route_args = [(a, t) for a, t in route_args if a != "self"]
+
+    try:
+        method.__route_args__ = route_args
+    except AttributeError:
+        # Unbound methods (in Python 2) do not take attributes
+        pass
+    return route_args
+
+
 def is_method(method):
     method = extract_method(method)
     # Can be either a method or a function
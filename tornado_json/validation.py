@@ -0,0 +1,266 @@
+"""Options of how input is validated by ``schema.validate``
+
+``all_errors``
+    Rather than only the first error found, clients get a JSend ``fail``
+    with the errors keyed by JSON pointer to where they are in the
+    input::
+
+        {"status": "fail", "data": {
+            "errors": {
+                "/year": ["'nineteen' is not of type 'integer'"],
+                "": ["'make' is a required property"]
+            },
+            "truncated": false
+        }}
+
+    So that a pathological document cannot make validation arbitrarily
+    expensive, it is stopped (and ``truncated`` is ``true``) once
+    ``max_errors`` have been found or ``time_budget`` is spent. See
+    ``ErrorCollector``.
+
+``coerce``
+    As the input is validated, missing properties with a ``default`` are
+    filled in and values are converted by their ``format`` (e.g.,
+    ``date-time`` strings to ``datetime``), so handlers get ready-to-use
+    objects without walking the input again. See ``Coercion``.
+"""
+import copy
+import re
+import time
+from datetime import datetime, timedelta
+
+from jsonschema import ValidationError
+from jsonschema.validators import extend
+from tornado.util import basestring_type
+
+from tornado_json.exceptions import InvalidInput
+
+_DATE_TIME = re.compile(
+    r"^(\d{4})-(\d\d)-(\d\d)[Tt ](\d\d):(\d\d):(\d\d)(\.\d+)?"
+    r"(?:([Zz])|([+-])(\d\d):(\d\d))$"
+)
+
+
+def get_pointer(path):
+    """Get the JSON pointer (RFC 6901) of ``path``
+
+    :type  path: iterable
+    :param path: Keys and indices from the root of a document
+    :rtype: str
+    """
+    return "".join(
+        "/" + str(p).replace("~", "~0").replace("/", "~1") for p in path
+    )
+
+
+class ErrorCollector(object):
+    """Options for collecting validation errors
+
+    :type  max_errors: int
+    :param max_errors: Errors after which validation is stopped
+    :type  time_budget: float
+    :param time_budget: Seconds after which validation is stopped; it is
+        checked as each error is found
+    """
+
+    def __init__(self, max_errors=20, time_budget=0.05):
+        self.max_errors = max_errors
+        self.time_budget = time_budget
+
+    def collect(self, validator, instance):
+        """Collect the errors of ``instance`` found by ``validator``
+
+        :returns: ``(errors, truncated)``; see ``InvalidInput``
+        :rtype: tuple
+        """
+        errors = {}
+        count = 0
+        stop_at = time.time() + self.time_budget
+        # ``iter_errors`` is lazy, so validation stops when we do
+        for error in validator.iter_errors(instance):
+            errors.setdefault(get_pointer(error.absolute_path),
+                              []).append(error.message)
+            count += 1
+            if count >= self.max_errors or time.time() >= stop_at:
+                return errors, True
+        return errors, False
+
+    def validate(self, validator, instance):
+        """Validate ``instance`` with ``validator``
+
+        :raises InvalidInput: With the errors found, if there are any
+        """
+        errors, truncated = self.collect(validator, instance)
+        if errors:
+            raise InvalidInput(errors, truncated)
+
+
+def parse_date_time(value):
+    """Parse an RFC 3339 ``date-time``
+
+    :rtype: datetime.datetime
+    :returns: The time in UTC, as a naive ``datetime``
+    :raises ValueError: If ``value`` is not a ``date-time``
+    """
+    match = _DATE_TIME.match(value)
+    if match is None:
+        raise ValueError(value)
+    (year, month, day, hour, minute, second, fraction, utc, sign,
+     offset_hours, offset_minutes) = match.groups()
+    parsed = datetime(
+        int(year), int(month), int(day), int(hour), int(minute),
+        # Leap seconds are not representable
+        min(int(second), 59),
+        int(round(float(fraction) * 1e6)) if fraction else 0
+    )
+    if not utc:
+        offset = timedelta(hours=int(offset_hours),
+                           minutes=int(offset_minutes))
+        parsed = parsed - offset if sign == "+" else parsed + offset
+    return parsed
+
+
+def parse_date(value):
+    """Parse an RFC 3339 ``full-date``
+
+    :rtype: datetime.date
+    :raises ValueError: If ``value`` is not a date
+    """
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+# Converters of strings by ``format``
+COERCERS = {
+    "date-time": parse_date_time,
+    "date": parse_date,
+}
+
+
+def coerce_type(value, schema):
+    """Convert ``value``, if it is a string, to the ``type`` of ``schema``
+    (``integer``, ``number`` or ``boolean``), e.g., for query arguments
+
+    :returns: The converted value, or ``value`` if it cannot be converted
+    """
+    if not isinstance(value, basestring_type):
+        return value
+    type_ = schema.get("type")
+    try:
+        if type_ == "integer":
+            return int(value)
+        if type_ == "number":
+            return float(value)
+    except ValueError:
+        return value
+    if type_ == "boolean" and value in ("true", "false"):
+        return value == "true"
+    return value
+
+
+class Coercion(object):
+    """Options for coercing input as it is validated
+
+    Values of ``properties`` and ``items`` are coerced once they are
+    valid, in the same pass that validates them. A ``default`` given
+    directly in the sub-schema of a missing property is filled in (in a
+    copy); ``format`` and ``type`` behind a ``$ref`` are not followed.
+    Values are not coerced under ``anyOf``, ``oneOf`` or ``not``, whose
+    branches may fail after coercing them.
+    Only Draft 4 schemas are supported.
+
+    :type  coercers: dict
+    :param coercers: Converters of strings by ``format``; ``COERCERS`` by
+        default. A converter raising ``ValueError`` makes the value
+        invalid.
+    :type  defaults: bool
+    :param defaults: Fill in the ``default`` of missing properties
+    :type  types: bool
+    :param types: Convert strings to the ``type`` of their schema before
+        validating them (see ``coerce_type``)
+    """
+
+    def __init__(self, coercers=None, defaults=True, types=False):
+        self.coercers = COERCERS if coercers is None else coercers
+        self.defaults = defaults
+        self.types = types
+        # Extended validator classes by the class they extend
+        self._classes = {}
+
+    def _descend(self, validator, container, key, subschema):
+        """Validate ``container[key]`` against ``subschema`` and, if it is
+        valid, coerce it in place
+
+        :returns: Errors of ``container[key]``
+        :rtype: list
+        """
+        value = container[key]
+        if self.types:
+            value = container[key] = coerce_type(value, subschema)
+        errors = list(validator.descend(value, subschema, path=key,
+                                        schema_path=key))
+        coercer = self.coercers.get(subschema.get("format"))
+        if errors or coercer is None or \
+                not isinstance(value, basestring_type):
+            return errors
+        try:
+            container[key] = coercer(value)
+        except ValueError:
+            errors.append(ValidationError(
+                "{!r} is not a {!r}".format(value, subschema["format"]),
+                path=[key]
+            ))
+        return errors
+
+    def extend(self, cls):
+        """Get the class of validators of ``cls`` that coerce input
+
+        :type  cls: jsonschema.IValidator
+        """
+        extended = self._classes.get(cls)
+        if extended is not None:
+            return extended
+
+        def properties(validator, properties, instance, schema):
+            if not validator.is_type(instance, "object"):
+                return
+            for name, subschema in properties.items():
+                if name in instance:
+                    for error in self._descend(validator, instance, name,
+                                               subschema):
+                        yield error
+                elif self.defaults and "default" in subschema:
+                    instance[name] = copy.deepcopy(subschema["default"])
+
+        def items(validator, items, instance, schema):
+            if not validator.is_type(instance, "array"):
+                return
+            if validator.is_type(items, "object"):
+                pairs = ((index, items) for index in range(len(instance)))
+            else:
+                pairs = zip(range(len(instance)), items)
+            for index, subschema in pairs:
+                for error in self._descend(validator, instance, index,
+                                           subschema):
+                    yield error
+
+        def uncoerced(validate):
+            # Branches of ``anyOf``, ``oneOf`` and ``not`` may fail, so
+            #   they are validated by a validator that does not coerce
+            #   (which would leave changes behind)
+            def validate_uncoerced(validator, value, instance, schema):
+                plain = cls(validator.schema, resolver=validator.resolver,
+                            format_checker=validator.format_checker)
+                return validate(plain, value, instance, schema)
+            return validate_uncoerced
+
+        validators = {"properties": properties, "items": items}
+        for keyword in ("anyOf", "oneOf", "not"):
+            if keyword in cls.VALIDATORS:
+                validators[keyword] = uncoerced(cls.VALIDATORS[keyword])
+        extended = self._classes[cls] = extend(cls, validators)
+        return extended
+
+
+default_coercion = Coercion()
+# Of strings, e.g., query arguments
+type_coercion = Coercion(types=True)
@@ -0,0 +1,187 @@
+"""WebSocket handler with JSend messages validated by ``schema.validate``
+
+Each inbound message is a JSON object with a ``type``, an optional ``id``
+and ``data``, e.g., ``{"type": "echo", "id": 1, "data": "Hi"}``. It is
+dispatched to the ``handle_<type>`` method of the handler, decorated with
+``schema.validate`` just as an HTTP method would be, with ``data`` as the
+body. Whatever the method returns, or any error, is sent back as a JSend
+envelope with the ``id`` of the message added, e.g.,
+``{"status": "success", "data": "Hi", "id": 1}``::
+
+    class ChatHandler(WebSocketAPIHandler):
+
+        @schema.validate(input_schema={"type": "string"},
+                         output_schema={"type": "string"})
+        def handle_echo(self):
+            return self.body
+
+Validators are compiled once, when the methods are decorated. Messages
+are handled concurrently, up to ``max_in_flight`` per socket; past that,
+no more messages are read from the socket until one is done.
+"""
+import re
+
+from tornado.concurrent import Future
+from tornado.escape import json_decode, json_encode
+from tornado.ioloop import IOLoop
+from tornado.log import app_log
+from tornado.websocket import WebSocketHandler
+from jsonschema import ValidationError
+
+try:
+    from tornado.websocket import WebSocketClosedError
+except ImportError:
+    # For tornado<3.2, where writing to a closed socket fails with
+    #   AttributeError
+    WebSocketClosedError = AttributeError
+
+from tornado_json.jsend import JSendMixin
+from tornado_json.exceptions import APIError
+from tornado_json.gen import is_future
+
+_TYPE_RE = re.compile(r"^[A-Za-z]\w*$")
+
+
+class _MessageRequest(object):
+    """Stands in for the ``HTTPServerRequest`` of a message"""
+
+    method = "MESSAGE"
+    body = b""
+
+    def __init__(self, connection_request, data):
+        self.connection_request = connection_request
+        # Picked up by ``schema.validate`` instead of decoding ``body``
+        self.decoded_body = data
+        self.headers = {}
+
+
+class Message(JSendMixin):
+    """A message being handled, which is what ``self`` is in the methods
+    of a ``WebSocketAPIHandler``
+
+    Attributes not set on the message are looked up on the handler of
+    the socket, so methods can use the handler as they would in HTTP.
+    ``self.request`` is the message; the HTTP request that opened the
+    socket is ``self.request.connection_request``.
+    """
+
+    _finished = False
+
+    def __init__(self, handler, id, data):
+        self.handler = handler
+        self.id = id
+        self.request = _MessageRequest(handler.request, data)
+        self._envelope = None
+
+    def __getattr__(self, name):
+        return getattr(self.handler, name)
+
+    def write(self, chunk):
+        self._envelope = chunk
+
+    def finish(self):
+        self._finished = True
+        envelope = self._envelope
+        if self.id is not None:
+            envelope["id"] = self.id
+        try:
+            self.handler.write_message(json_encode(envelope))
+        except WebSocketClosedError:
+            pass
+
+
+class WebSocketAPIHandler(WebSocketHandler):
+    """WebSocket handler for JSend messages (see above)
+
+    :cvar int max_in_flight: Messages handled at once per socket
+    """
+
+    max_in_flight = 16
+
+    def open(self, *args, **kwargs):
+        self._in_flight = 0
+        self._resume_reading = None
+
+    def on_message(self, message):
+        """Start handling ``message``
+
+        :returns: A Future, resolved once fewer than ``max_in_flight``
+            messages are being handled, if that many already are; Tornado
+            does not read further messages until then
+        """
+        self._in_flight += 1
+        IOLoop.current().add_future(self._handle_message(message),
+                                    self._on_message_done)
+        if self._in_flight >= self.max_in_flight:
+            self._resume_reading = Future()
+            return self._resume_reading
+
+    def _on_message_done(self, future):
+        self._in_flight -= 1
+        resume_reading, self._resume_reading = self._resume_reading, None
+        if resume_reading is not None:
+            resume_reading.set_result(None)
+
+    def _get_method(self, type_):
+        """Get the function handling messages of ``type_``, to be called
+        with the ``Message`` as ``self``"""
+        if not _TYPE_RE.match(type_):
+            return None
+        method = getattr(type(self), "handle_" + type_, None)
+        # Unbound methods of Python 2 only take instances of the class
+        return getattr(method, "__func__", method)
+
+    def _handle_message(self, raw):
+        """Dispatch ``raw`` and write back the result
+
+        :returns: A Future resolved once the result is written back
+        """
+        done = Future()
+        message = None
+        try:
+            try:
+                envelope = json_decode(raw)
+            except ValueError:
+                raise APIError(400, "Message is not valid JSON.")
+            if not isinstance(envelope, dict):
+                raise APIError(400, "Message is not a JSON object.")
+            message = Message(self, envelope.get("id"), envelope.get("data"))
+            method = self._get_method(str(envelope.get("type")))
+            if method is None:
+                raise APIError(400, "Unknown message type.")
+            result = method(message)
+        except Exception as e:
+            self._write_error(message, e)
+            done.set_result(None)
+            return done
+
+        if not is_future(result):
+            done.set_result(None)
+            return done
+
+        def on_done(future):
+            try:
+                future.result()
+            except Exception as e:
+                self._write_error(message, e)
+            done.set_result(None)
+        IOLoop.current().add_future(result, on_done)
+        return done
+
+    def _write_error(self, message, exception):
+        """Write back ``exception``, raised while handling ``message``, as
+        ``APIHandler.write_error`` would"""
+        if message is None:
+            message = Message(self, None, None)
+        if isinstance(exception, (APIError, ValidationError)):
+            message.fail(getattr(exception, "data", None) or
+                         getattr(exception, "log_message", None) or
+                         str(exception))
+        else:
+            app_log.error("Uncaught exception handling message",
+                          exc_info=True)
+            message.error(
+                message="Internal Server Error",
+                data=str(exception) if self.settings.get("debug") else None,
+                code=500
+            )